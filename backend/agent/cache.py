@@ -0,0 +1,225 @@
+"""
+通用两级缓存
+第一级为进程内 LRU，第二级为可选的 SQLite 持久化存储，两级均支持 TTL 与容量上限。
+用于缓存 LLM 响应等可按内容寻址的结果。
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(*parts: Any) -> str:
+    """
+    根据任意可 JSON 序列化的内容生成稳定的缓存键
+    字典按键排序，保证相同内容得到相同的键
+    """
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TieredCache:
+    """
+    内存 LRU + SQLite 的两级缓存
+    - 读取时先查内存，未命中再查磁盘，磁盘命中会回填到内存
+    - 写入时同时写入两级
+    - 值需要可 JSON 序列化（磁盘层以 JSON 文本存储）
+    """
+    def __init__(
+        self,
+        namespace: str,
+        max_entries: int = 512,
+        ttl: Optional[float] = 3600,
+        db_path: Optional[str] = None,
+        max_disk_entries: int = 10000
+    ):
+        """
+        :param namespace: 命名空间，多个缓存可以共用同一个 SQLite 文件
+        :param max_entries: 内存层最大条目数
+        :param ttl: 默认过期时间（秒），None 表示永不过期
+        :param db_path: SQLite 文件路径，None 表示只使用内存层
+        :param max_disk_entries: 磁盘层最大条目数
+        """
+        self.namespace = namespace
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.max_disk_entries = max(1, max_disk_entries)
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, Tuple[Optional[float], Any]]" = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self._writes_since_prune = 0
+
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "sets": 0,
+            "evictions": 0,
+        }
+
+        if db_path:
+            self._open_db(db_path)
+
+    def _open_db(self, db_path: str):
+        try:
+            directory = os.path.dirname(db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entries ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                "expires_at REAL, created_at REAL NOT NULL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_cache_created ON cache_entries (namespace, created_at)")
+        except sqlite3.Error as e:
+            # 磁盘层不可用时退化为纯内存缓存
+            logger.warning(f"缓存数据库 {db_path} 打开失败，仅使用内存缓存: {e}")
+            self._db = None
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            value = self._get_from_memory(key, now)
+            if value is not None:
+                return value
+
+            if self._db is not None:
+                value, expires_at = self._get_from_disk(key, now)
+                if value is not None:
+                    self._put_memory(key, value, expires_at)
+                    self._stats["disk_hits"] += 1
+                    return value
+
+            self._stats["misses"] += 1
+            return None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._put_memory(key, value, expires_at)
+            self._stats["sets"] += 1
+            if self._db is not None:
+                self._put_disk(key, value, expires_at)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._memory.pop(key, None)
+            if self._db is not None:
+                try:
+                    self._db.execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (self.namespace, key))
+                except sqlite3.Error as e:
+                    logger.warning(f"删除缓存失败: {e}")
+
+    # 异步版本：内存层直接访问，涉及 SQLite 的读写放到线程中执行，不阻塞事件循环
+    async def aget(self, key: str) -> Optional[Any]:
+        with self._lock:
+            value = self._get_from_memory(key, time.time())
+            if value is not None:
+                return value
+            if self._db is None:
+                self._stats["misses"] += 1
+                return None
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key: str, value: Any, ttl: Optional[float] = None):
+        if self._db is None:
+            self.set(key, value, ttl)
+        else:
+            await asyncio.to_thread(self.set, key, value, ttl)
+
+    async def adelete(self, key: str):
+        if self._db is None:
+            self.delete(key)
+        else:
+            await asyncio.to_thread(self.delete, key)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM cache_entries WHERE namespace = ?", (self.namespace,))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 4) if lookups else 0.0
+        stats["namespace"] = self.namespace
+        stats["persistent"] = self._db is not None
+        return stats
+
+    def _put_memory(self, key: str, value: Any, expires_at: Optional[float]):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _get_from_memory(self, key: str, now: float) -> Optional[Any]:
+        """调用方需持有 _lock；命中时计入 memory_hits，未命中不计数"""
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at is None or expires_at > now:
+            self._memory.move_to_end(key)
+            self._stats["memory_hits"] += 1
+            return value
+        del self._memory[key]
+        return None
+
+    def _get_from_disk(self, key: str, now: float) -> Tuple[Optional[Any], Optional[float]]:
+        try:
+            row = self._db.execute(
+                "SELECT value, expires_at FROM cache_entries WHERE namespace = ? AND key = ?",
+                (self.namespace, key)
+            ).fetchone()
+            if row is None:
+                return None, None
+            value, expires_at = row
+            if expires_at is not None and expires_at <= now:
+                self._db.execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (self.namespace, key))
+                return None, None
+            return json.loads(value), expires_at
+        except (sqlite3.Error, ValueError) as e:
+            logger.warning(f"读取缓存失败: {e}")
+            return None, None
+
+    def _put_disk(self, key: str, value: Any, expires_at: Optional[float]):
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO cache_entries (namespace, key, value, expires_at, created_at) VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, key, json.dumps(value, ensure_ascii=False), expires_at, time.time())
+            )
+            # 每写入一定次数清理一次过期与超量条目，避免每次写入都扫描
+            self._writes_since_prune += 1
+            if self._writes_since_prune >= 100:
+                self._writes_since_prune = 0
+                self._prune_disk()
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            logger.warning(f"写入缓存失败: {e}")
+
+    def _prune_disk(self):
+        self._db.execute(
+            "DELETE FROM cache_entries WHERE namespace = ? AND expires_at IS NOT NULL AND expires_at <= ?",
+            (self.namespace, time.time())
+        )
+        self._db.execute(
+            "DELETE FROM cache_entries WHERE namespace = ? AND key IN ("
+            "SELECT key FROM cache_entries WHERE namespace = ? ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (self.namespace, self.namespace, self.max_disk_entries)
+        )
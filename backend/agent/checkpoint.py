@@ -0,0 +1,319 @@
+"""
+AgentState 的检查点
+每次运行对应一个追加写入的 JSONL 文件（<checkpoint_dir>/<run_id>.jsonl），每步结束后只追加增量：
+- start：问题、对话记忆与调用方附带的元数据
+- plan：计划发生变化（初始规划、重规划）时写入完整计划
+- record：每个完成的步骤写入一条执行记录（步骤 + 结果）
+- done：运行结束时写入最终答案
+单次写入的大小只与本步的产出有关，不随历史变长而增加。
+加载时按顺序回放各行重建 AgentState，进程在写入中途崩溃留下的残缺末行会被忽略。
+过期的检查点文件由写入触发清理，两次清理之间至少间隔 checkpoint_prune_interval 秒。
+"""
+import asyncio
+import logging
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set
+
+from agent.schema import AgentState, Plan, StepRecord, StepStatus
+from agent.serialization import JSONDecodeError, dumps, loads, record_json
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_RUN_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class CheckpointNotFound(Exception):
+    """指定运行没有可用的检查点"""
+
+
+class Checkpoint:
+    """从检查点文件重建的运行状态"""
+    def __init__(
+        self,
+        run_id: str,
+        state: AgentState,
+        initial_plan: Plan,
+        step_count: int,
+        finished: bool,
+        metadata: Dict[str, Any]
+    ):
+        self.run_id = run_id
+        self.state = state
+        # 初始计划，运行成功后用于写入计划缓存
+        self.initial_plan = initial_plan
+        # 已消耗的步数（含重规划），恢复后继续受 max_steps 限制
+        self.step_count = step_count
+        self.finished = finished
+        self.metadata = metadata
+
+
+class RunCheckpoint:
+    """
+    单次运行的检查点写入器
+    记住上次写入的计划对象，计划未被替换时只追加新的执行记录
+    """
+    def __init__(self, store: Optional["CheckpointStore"], run_id: str):
+        self.store = store
+        self.run_id = run_id
+        self._plan: Optional[Plan] = None
+
+    def start(self, problem: str, context: Optional[str] = None, metadata: Optional[Dict[str, Any]] = None):
+        self._append([dumps({
+            "t": "start",
+            "problem": problem,
+            "context": context,
+            "metadata": metadata or {},
+            "created_at": time.time(),
+        })])
+
+    def resumed(self, plan: Plan):
+        """从检查点恢复后，当前计划已在文件中，不需要重复写入"""
+        self._plan = plan
+
+    def save(self, agent_state: AgentState, records: List[StepRecord], step_count: int):
+        """追加本步新增的执行记录，计划被替换时追加新计划"""
+        lines = []
+        if agent_state.current_plan is not self._plan:
+            self._plan = agent_state.current_plan
+            lines.append(f'{{"t":"plan","n":{step_count},"plan":{self._plan.model_dump_json()}}}')
+        for record in records:
+            # 与重规划共用记录的 JSON 片段缓存
+            lines.append(f'{{"t":"record","n":{step_count},"record":{record_json(record)}}}')
+        self._append(lines)
+
+    def finish(self, agent_state: AgentState, step_count: int):
+        self._append([dumps({"t": "done", "n": step_count, "final_answer": agent_state.current_plan.final_answer})])
+
+    # 异步版本：文件写入（含 fsync 与定期清理）放到线程中执行，不阻塞事件循环中的其他运行
+    async def astart(self, problem: str, context: Optional[str] = None, metadata: Optional[Dict[str, Any]] = None):
+        if self.store is not None:
+            await asyncio.to_thread(self.start, problem, context, metadata)
+
+    async def asave(self, agent_state: AgentState, records: List[StepRecord], step_count: int):
+        if self.store is not None:
+            await asyncio.to_thread(self.save, agent_state, records, step_count)
+
+    async def afinish(self, agent_state: AgentState, step_count: int):
+        if self.store is not None:
+            await asyncio.to_thread(self.finish, agent_state, step_count)
+
+    def _append(self, lines: List[str]):
+        if self.store is None or not lines:
+            return
+        try:
+            self.store.append(self.run_id, lines)
+        except OSError as e:
+            # 检查点写入失败不影响本次运行
+            logger.warning(f"写入运行 {self.run_id} 的检查点失败: {e}")
+
+
+class CheckpointStore:
+    """基于本地文件的检查点存储"""
+    def __init__(self, directory: str, fsync: bool = False, max_age: Optional[float] = None, prune_interval: float = 600):
+        """
+        :param directory: 检查点目录
+        :param fsync: 每次写入后是否 fsync
+        :param max_age: 检查点保留时间（秒），None 表示不自动清理
+        :param prune_interval: 两次自动清理之间的最小间隔（秒）
+        """
+        self.directory = directory
+        self.fsync = fsync
+        self.max_age = max_age
+        self.prune_interval = prune_interval
+        self._lock = threading.Lock()
+        self._prune_lock = threading.Lock()
+        self._next_prune = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, run_id: str) -> str:
+        if not _RUN_ID.match(run_id):
+            raise CheckpointNotFound(f"非法的运行ID: {run_id}")
+        return os.path.join(self.directory, f"{run_id}.jsonl")
+
+    def writer(self, run_id: str) -> RunCheckpoint:
+        return RunCheckpoint(self, run_id)
+
+    def append(self, run_id: str, lines: List[str]):
+        """追加已编码为 JSON 的若干行"""
+        payload = "".join(line + "\n" for line in lines)
+        with self._lock, open(self._path(run_id), "a", encoding="utf-8") as f:
+            f.write(payload)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        self._maybe_prune()
+
+    def exists(self, run_id: str) -> bool:
+        try:
+            return os.path.exists(self._path(run_id))
+        except CheckpointNotFound:
+            return False
+
+    def delete(self, run_id: str):
+        try:
+            os.remove(self._path(run_id))
+        except (FileNotFoundError, CheckpointNotFound):
+            pass
+
+    def output_refs(self, run_id: str) -> Set[str]:
+        """运行的执行记录引用的外置输出"""
+        refs: Set[str] = set()
+        try:
+            with open(self._path(run_id), encoding="utf-8") as f:
+                raw_lines = f.readlines()
+        except (FileNotFoundError, CheckpointNotFound):
+            return refs
+        for raw in raw_lines:
+            try:
+                line = loads(raw)
+            except JSONDecodeError:
+                continue
+            if line.get("t") == "record":
+                ref = line["record"].get("result", {}).get("output_ref")
+                if ref:
+                    refs.add(ref)
+        return refs
+
+    def shared_refs(self, refs: Set[str]) -> Set[str]:
+        """refs 中仍被现存检查点引用的部分（相同内容的 blob 会被多个运行共用）"""
+        shared: Set[str] = set()
+        if not refs:
+            return shared
+        for name in os.listdir(self.directory):
+            if not name.endswith(".jsonl"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), encoding="utf-8") as f:
+                    content = f.read()
+            except OSError:
+                continue
+            shared.update(ref for ref in refs if ref in content)
+        return shared
+
+    def metadata(self, run_id: str) -> Dict[str, Any]:
+        """只读取 start 行中的元数据，用于恢复前的权限校验"""
+        try:
+            with open(self._path(run_id), encoding="utf-8") as f:
+                line = loads(f.readline())
+        except FileNotFoundError:
+            raise CheckpointNotFound(f"运行 {run_id} 没有检查点")
+        except JSONDecodeError:
+            raise CheckpointNotFound(f"运行 {run_id} 的检查点不完整")
+        if line.get("t") != "start":
+            raise CheckpointNotFound(f"运行 {run_id} 的检查点不完整")
+        return line.get("metadata") or {}
+
+    def load(self, run_id: str) -> Checkpoint:
+        """
+        回放检查点文件重建运行状态
+        :raises CheckpointNotFound: 文件不存在或缺少 start / plan 记录
+        """
+        path = self._path(run_id)
+        try:
+            with open(path, encoding="utf-8") as f:
+                raw_lines = f.readlines()
+        except FileNotFoundError:
+            raise CheckpointNotFound(f"运行 {run_id} 没有检查点")
+
+        start: Optional[Dict[str, Any]] = None
+        initial_plan: Optional[Plan] = None
+        plan: Optional[Plan] = None
+        history: List[StepRecord] = []
+        step_count = 0
+        finished = False
+        final_answer = None
+
+        for index, raw in enumerate(raw_lines):
+            try:
+                line = loads(raw)
+            except JSONDecodeError:
+                # 崩溃时可能留下写了一半的末行
+                logger.warning(f"运行 {run_id} 的检查点第 {index + 1} 行不完整，已忽略")
+                continue
+            kind = line.get("t")
+            step_count = max(step_count, line.get("n", 0))
+            if kind == "start":
+                start = line
+            elif kind == "plan":
+                plan = Plan.model_validate(line["plan"])
+                initial_plan = initial_plan or plan.model_copy(deep=True)
+            elif kind == "record":
+                record = StepRecord.model_validate(line["record"])
+                history.append(record)
+                # 计划中的步骤状态以最新的执行记录为准
+                if plan is not None:
+                    for step in plan.steps:
+                        if step.id == record.step.id:
+                            step.status = record.step.status
+            elif kind == "done":
+                finished = True
+                final_answer = line.get("final_answer")
+
+        if start is None or plan is None:
+            raise CheckpointNotFound(f"运行 {run_id} 的检查点不完整")
+
+        # 崩溃时正在执行的步骤需要重新执行
+        for step in plan.steps:
+            if step.status == StepStatus.RUNNING:
+                step.status = StepStatus.PENDING
+        if finished:
+            plan.final_answer = final_answer
+
+        last_error = next((r.result.error_message for r in reversed(history) if not r.result.is_success), None)
+        state = AgentState(
+            problem=start["problem"],
+            context=start.get("context"),
+            run_id=run_id,
+            current_plan=plan,
+            history=history,
+            last_error=last_error
+        )
+        return Checkpoint(run_id, state, initial_plan, step_count, finished, start.get("metadata") or {})
+
+    def _maybe_prune(self):
+        """距上次清理超过 prune_interval 时清理过期的检查点，同一时间只有一个线程执行清理"""
+        if self.max_age is None or time.monotonic() < self._next_prune:
+            return
+        if not self._prune_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_prune = time.monotonic() + self.prune_interval
+            self.prune(self.max_age)
+        finally:
+            self._prune_lock.release()
+
+    def prune(self, max_age: float):
+        """删除超过保留时间的检查点文件"""
+        deadline = time.time() - max_age
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if name.endswith(".jsonl") and os.path.getmtime(path) < deadline:
+                    os.remove(path)
+            except OSError:
+                continue
+
+
+_store: Optional[CheckpointStore] = None
+_store_lock = threading.Lock()
+
+
+def get_checkpoint_store() -> Optional[CheckpointStore]:
+    """获取进程内共享的检查点存储，未启用时返回 None"""
+    global _store
+    if not settings.checkpoint_enabled:
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = CheckpointStore(
+                    settings.checkpoint_dir,
+                    fsync=settings.checkpoint_fsync,
+                    max_age=settings.checkpoint_retention_hours * 3600,
+                    prune_interval=settings.checkpoint_prune_interval
+                )
+    return _store
@@ -0,0 +1,238 @@
+"""
+进程级的 LLM 并发控制
+所有 LLM 请求（同步线程与各个事件循环中的协程）共用 llm_max_concurrency 个名额：
+- 有空闲名额且无人排队时直接占用
+- 否则按用户排队，名额释放时在有等待者的用户之间轮转分配，一个用户的大量请求不会挤占其他用户
+- 等待超过 llm_queue_timeout 时抛出 LLMQueueTimeout
+
+当前用户通过 bind_llm_user 绑定到 contextvar，Manager 向线程池提交任务时会复制上下文，批内并行的步骤同样计入该用户。
+"""
+import asyncio
+import contextvars
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Callable, Deque, Dict, Iterator, Optional
+
+from agent.metrics import registry
+from core.config import settings
+
+LLM_IN_FLIGHT = registry.gauge(
+    "planflow_llm_in_flight", "正在进行的 LLM 请求数"
+)
+LLM_QUEUE_WAIT = registry.histogram(
+    "planflow_llm_queue_wait_seconds", "LLM 请求等待并发名额的时间（秒）"
+)
+LLM_QUEUE_TIMEOUTS = registry.counter(
+    "planflow_llm_queue_timeouts_total", "等待并发名额超时的 LLM 请求数"
+)
+
+ANONYMOUS = "anonymous"
+
+_llm_user: contextvars.ContextVar[str] = contextvars.ContextVar("planflow_llm_user", default=ANONYMOUS)
+
+
+class LLMQueueTimeout(Exception):
+    """等待 LLM 并发名额超时"""
+
+
+@contextmanager
+def bind_llm_user(user_id) -> Iterator[None]:
+    """在当前上下文中绑定发起请求的用户，之后的 LLM 请求按该用户排队"""
+    token = _llm_user.set(str(user_id))
+    try:
+        yield
+    finally:
+        _llm_user.reset(token)
+
+
+def current_llm_user() -> str:
+    return _llm_user.get()
+
+
+class _Waiter:
+    __slots__ = ("wake", "granted")
+
+    def __init__(self, wake: Callable[[], None]):
+        self.wake = wake
+        self.granted = False
+
+
+class FairSemaphore:
+    """
+    线程安全、可同时被线程与协程使用的公平信号量
+    名额释放时直接移交给下一个等待者（按用户轮转），被唤醒的等待者无需再次竞争
+    """
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        # 用户 -> 该用户的等待者队列；_turns 为有等待者的用户的轮转顺序
+        self._queues: Dict[str, Deque[_Waiter]] = {}
+        self._turns: Deque[str] = deque()
+
+    def _try_acquire(self) -> bool:
+        """调用方需持有 _lock"""
+        if self._in_flight < self.limit and not self._turns:
+            self._in_flight += 1
+            return True
+        return False
+
+    def _enqueue(self, key: str, waiter: _Waiter):
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = deque()
+            self._turns.append(key)
+        queue.append(waiter)
+
+    def _remove(self, key: str, waiter: _Waiter):
+        queue = self._queues.get(key)
+        if queue is None:
+            return
+        try:
+            queue.remove(waiter)
+        except ValueError:
+            return
+        if not queue:
+            del self._queues[key]
+            self._turns.remove(key)
+
+    def acquire(self, key: str, timeout: Optional[float] = None):
+        """
+        同步获取名额，阻塞当前线程
+        :raises LLMQueueTimeout: 等待超时
+        """
+        event = threading.Event()
+        waiter = _Waiter(event.set)
+        with self._lock:
+            if self._try_acquire():
+                return
+            self._enqueue(key, waiter)
+
+        if event.wait(timeout):
+            return
+        with self._lock:
+            if not waiter.granted:
+                self._remove(key, waiter)
+                raise LLMQueueTimeout(f"等待 LLM 并发名额超过 {timeout}s")
+
+    async def aacquire(self, key: str, timeout: Optional[float] = None):
+        """
+        异步获取名额，不阻塞事件循环
+        :raises LLMQueueTimeout: 等待超时
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        waiter = _Waiter(wake)
+        with self._lock:
+            if self._try_acquire():
+                return
+            self._enqueue(key, waiter)
+
+        try:
+            await asyncio.wait_for(future, timeout)
+        except BaseException as e:
+            # 超时或被取消：已经分到的名额要归还，否则从队列中移除
+            with self._lock:
+                granted = waiter.granted
+                if not granted:
+                    self._remove(key, waiter)
+            if granted:
+                self.release()
+            if isinstance(e, asyncio.TimeoutError):
+                raise LLMQueueTimeout(f"等待 LLM 并发名额超过 {timeout}s")
+            raise
+
+    def release(self):
+        """释放名额：有等待者时按用户轮转移交给下一个等待者"""
+        with self._lock:
+            if not self._turns:
+                self._in_flight -= 1
+                return
+            key = self._turns.popleft()
+            queue = self._queues[key]
+            waiter = queue.popleft()
+            if queue:
+                self._turns.append(key)
+            else:
+                del self._queues[key]
+            waiter.granted = True
+        waiter.wake()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "limit": self.limit,
+                "in_flight": self._in_flight,
+                "waiting": sum(len(queue) for queue in self._queues.values()),
+                "waiting_users": len(self._turns),
+            }
+
+
+_governor: Optional[FairSemaphore] = None
+_governor_lock = threading.Lock()
+
+
+def get_llm_governor() -> Optional[FairSemaphore]:
+    """获取进程内共享的 LLM 并发控制，llm_max_concurrency 为 0 时不限制，返回 None"""
+    global _governor
+    if settings.llm_max_concurrency <= 0:
+        return None
+    if _governor is None:
+        with _governor_lock:
+            if _governor is None:
+                _governor = FairSemaphore(settings.llm_max_concurrency)
+    return _governor
+
+
+def _wait_timeout() -> Optional[float]:
+    return settings.llm_queue_timeout if settings.llm_queue_timeout > 0 else None
+
+
+@contextmanager
+def llm_slot() -> Iterator[None]:
+    """在同步代码中占用一个 LLM 并发名额"""
+    governor = get_llm_governor()
+    if governor is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        governor.acquire(current_llm_user(), _wait_timeout())
+    except LLMQueueTimeout:
+        LLM_QUEUE_TIMEOUTS.inc()
+        raise
+    LLM_QUEUE_WAIT.observe(time.perf_counter() - started)
+    LLM_IN_FLIGHT.inc()
+    try:
+        yield
+    finally:
+        LLM_IN_FLIGHT.inc(-1)
+        governor.release()
+
+
+@asynccontextmanager
+async def allm_slot() -> AsyncIterator[None]:
+    """llm_slot 的异步版本"""
+    governor = get_llm_governor()
+    if governor is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        await governor.aacquire(current_llm_user(), _wait_timeout())
+    except LLMQueueTimeout:
+        LLM_QUEUE_TIMEOUTS.inc()
+        raise
+    LLM_QUEUE_WAIT.observe(time.perf_counter() - started)
+    LLM_IN_FLIGHT.inc()
+    try:
+        yield
+    finally:
+        LLM_IN_FLIGHT.inc(-1)
+        governor.release()
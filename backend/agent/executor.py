@@ -3,230 +3,488 @@ backend.agent.executor 的 Docstring
 负责执行计划中的单步骤任务。
 """
 import logging
-import os
-import json
-from string import Template
-from typing import Callable, List, Optional
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
 
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 
+from agent.history import HistoryBuffer
+from agent.concurrency import LLMQueueTimeout
+from agent.llm import achat_completion, achat_completion_stream, chat_completion, get_async_llm_client, get_llm_client
+from agent.memory import render_context
+from agent.metrics import ROLE_LLM_STEP, ROLE_SUMMARY, ROLE_TOOL_ARGS, record_tool_args_reused, track_tool_call
+from agent.tracing import span
 from agent.schema import StepResult, Step, StepStatus, StepRecord
-from agent.prompts import TOOL_ARGUMENT_PROMPT_TEMPLATE, LLM_EXECUTOR_PROMPT_TEMPLATE, FINAL_FALLBACK_SYSTEM_PROMPT_TEMPLATE
+from agent.serialization import loads, loads_object
+from agent.registry import ToolRegistry, ToolSpec
+from agent.routing import acall_with_escalation, call_with_escalation, get_model_policy
+from agent.prompts import (
+    FINAL_FALLBACK_INPUT,
+    FINAL_FALLBACK_SYSTEM_PROMPT,
+    LLM_EXECUTOR_INPUT,
+    LLM_EXECUTOR_PROMPT,
+    TOOL_ARGUMENT_INPUT,
+    TOOL_ARGUMENT_PROMPT,
+)
+from agent.tool_schema import references_step_output
+from core.config import settings
 
 logger = logging.getLogger(__name__)
 
 class Executor:
-    def __init__(self, tools: List[Callable]):
-        self.client = OpenAI(
-            api_key=os.getenv('DASHSCOPE_API_KEY'),
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"  # 示例URL
-        )
-        self.model = "qwen-plus"  # 示例模型
+    def __init__(self, tools: Optional[List[Callable]] = None, registry: Optional[ToolRegistry] = None):
+        self.client = self._create_client()
+        # 按角色选择模型（参数生成 / LLM 步骤 / 最终总结），见 core.config 中的 llm_role_models
+        self.models = get_model_policy()
+
+        # 可调用工具的注册表，未传入时由 tools 列表构建；与 Planner 共用时运行期间可动态增删工具
+        self.registry = registry if registry is not None else ToolRegistry(tools)
 
-        # 加载可调用工具列表
-        self.tools = { func.__name__: func for func in tools}
+    def _create_client(self) -> OpenAI:
+        # 所有实例共享进程级客户端及其连接池
+        return get_llm_client()
 
-    def execute_step(self, step:Step, history:Optional[List[StepRecord]] = None) -> StepResult:
-        if history is None:
-            history = []
+    def execute_step(
+        self,
+        step:Step,
+        history:Optional[List[StepRecord]] = None,
+        history_buffer: Optional[HistoryBuffer] = None
+    ) -> StepResult:
+        """
+        执行单个步骤
+        :param history: 执行历史记录
+        :param history_buffer: 本次运行维护的历史缓冲区，传入时直接复用其渲染结果，不再从 history 重新构建
+        """
+        history = self._history_buffer(history, history_buffer)
         # 1. 检查当前步骤状态
+        error = self._check_pending(step)
+        if error:
+            return error
+        # 2. 标记为RUNNING
+        step.status = StepStatus.RUNNING
+
+        logger.info(f"Executing step {step.id}, action type is {step.action_type}")
+        with span("executor.execute_step", step_id=step.id, action_type=step.action_type) as current:
+            try:
+                if step.action_type == "LLM":
+                    result = self._execute_llm_step(step, history)
+                elif step.action_type == "TOOL":
+                    result = self._execute_tool_step(step, history)
+                else:
+                    raise ValueError(f"Unknown action type {step.action_type}")
+            except LLMQueueTimeout:
+                # 等待 LLM 并发名额超时说明服务过载，不当作普通的调用失败处理，交给接口层返回 429
+                raise
+            except Exception as e:
+                result = self._step_failed(step, e)
+            current.set_attribute("success", result.is_success)
+            return result
+
+    def _call_llm(
+        self,
+        messages: List[Dict[str, str]],
+        response_format: Optional[Dict[str, Any]] = None,
+        role: str = ROLE_LLM_STEP,
+        model: Optional[str] = None,
+        parse: Optional[Callable[[str], Any]] = None
+    ) -> Any:
+        """调用LLM的辅助函数（相同请求直接命中响应缓存），未指定 model 时使用角色对应的模型；提供 parse 时返回解析结果"""
+        return chat_completion(
+            self.client, model=model or self.models.model_for(role), messages=messages,
+            response_format=response_format, role=role, parse=parse
+        )
+
+    def _check_pending(self, step: Step) -> Optional[StepResult]:
         if step.status != StepStatus.PENDING:
             return StepResult(
                 is_success=False,
                 error_message=f"Step {step.id} is not PENDING, currrent status is {step.status}"
             )
-        # 2. 标记为RUNNING
-        step.status = StepStatus.RUNNING
+        return None
+
+    def _step_failed(self, step: Step, e: Exception) -> StepResult:
+        logger.error(f"Execution failed for step {step.id}: {e}")
+        step.status = StepStatus.FAILED
+        return StepResult(
+            is_success=False,
+            error_message=str(e)
+        )
+
+    def _history_buffer(self, history: Optional[List[StepRecord]], history_buffer: Optional[HistoryBuffer]) -> HistoryBuffer:
+        if history_buffer is not None:
+            return history_buffer
+        return HistoryBuffer.from_records(history or [])
+
+    def _execute_llm_step(self, step:Step, history: HistoryBuffer) -> StepResult:
+        logger.debug(f"Executing step {step.id}, history has {len(history)} steps")
+        messages = self._build_llm_step_messages(step, history)
 
-        print(f"Executing step {step.id}, action type is {step.action_type}")
         try:
-            if step.action_type == "LLM":
-                return self._execute_llm_step(step, history)
-            elif step.action_type == "TOOL":
-                return self._execute_tool_step(step, history)
-            else:
-                raise ValueError(f"Unknown action type {step.action_type}")
-        except Exception as e:
-            logger.error(f"Execution failed for step {step.id}: {e}")
-            step.status = StepStatus.FAILED
-            return StepResult(
-                is_success=False,
-                error_message=str(e)
+            return call_with_escalation(
+                self.models, ROLE_LLM_STEP,
+                lambda model, parse: self._call_llm(messages, response_format={"type": "json_object"}, model=model, parse=parse),
+                lambda content: self._finish_llm_step(step, content)
             )
 
-    def _execute_llm_step(self, step:Step, history: List[StepRecord]) -> StepResult:
-        print(f"Executing step {step.id}, history is {history}")
+        except LLMQueueTimeout:
+            raise
+        except Exception as e:
+            return self._llm_step_failed(step, e)
+
+    def _build_llm_step_messages(self, step: Step, history: HistoryBuffer) -> List[Dict[str, str]]:
         # 1. 准备 Prompt
-        history_str = ""
-        if history:
-            history_str = "\n".join([f"Step {record.step.id}: {record.step.description}\nResult: {record.result.raw_output}" for record in history])
-        else:
-            history_str = "无"
-
-        prompt = Template(LLM_EXECUTOR_PROMPT_TEMPLATE).safe_substitute(
-            current_step=step.description,
-            history=history_str
+        history_str = history.render()
+
+        user_prompt = LLM_EXECUTOR_INPUT.safe_substitute(
+            history=history_str,
+            current_step=step.description
         )
 
-        # 2. 调用 LLM
-        messages = [
-            {"role": "system", "content": prompt},
-            {"role": "user", "content": "请执行当前步骤"}
+        # 2. 调用 LLM：system 为固定指令，历史与当前步骤放在 user 消息中
+        return [
+            {"role": "system", "content": LLM_EXECUTOR_PROMPT},
+            {"role": "user", "content": render_context(history.context) + user_prompt}
         ]
 
-        try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                response_format={"type": "json_object"}
-            )
+    def _finish_llm_step(self, step: Step, content: str) -> StepResult:
+        logger.debug(f"LLM step response: {content}")
+        result_json = loads_object(content)
 
-            print(f"execute LLM response: {response}")
+        # 3. 解析结果
+        # 简化逻辑：直接提取 content，若无则使用原始 JSON 字符串
 
-            content = response.choices[0].message.content
-            result_json = json.loads(content)
-            
-            # 3. 解析结果
-            # 简化逻辑：直接提取 content，若无则使用原始 JSON 字符串
-            
-            step.status = StepStatus.COMPLETED
-            
-            return StepResult(
-                is_success=True,
-                raw_output=result_json.get("content", content),
-                structured_output=result_json
-            )
+        step.status = StepStatus.COMPLETED
 
-        except Exception as e:
-            step.status = StepStatus.FAILED
-            logger.error(f"LLM execution failed: {e}")
+        return StepResult(
+            is_success=True,
+            raw_output=result_json.get("content", content),
+            structured_output=result_json
+        )
 
-            return StepResult(
-                is_success=False,
-                error_message=f"LLM execution failed: {str(e)}"
-            )
+    def _llm_step_failed(self, step: Step, e: Exception) -> StepResult:
+        step.status = StepStatus.FAILED
+        logger.error(f"LLM execution failed: {e}")
+
+        return StepResult(
+            is_success=False,
+            error_message=f"LLM execution failed: {str(e)}"
+        )
+
+    def _execute_tool_step(self, step:Step, history: HistoryBuffer) -> StepResult:
+        logger.debug(f"Executing step {step.id}, history has {len(history)} steps")
+        spec, error = self._resolve_tool(step)
+        if error:
+            return error
+        tool_name = step.tool_name
+
+        # 2. Planner 参数可直接使用时跳过参数生成，否则使用 LLM 生成参数
+        tool_args = self._planner_tool_args(step, spec)
+        if tool_args is None:
+            try:
+                messages = self._build_tool_args_messages(step, spec, history)
+
+                tool_args = call_with_escalation(
+                    self.models, ROLE_TOOL_ARGS,
+                    lambda model, parse: self._call_llm(messages, response_format={"type": "json_object"}, role=ROLE_TOOL_ARGS, model=model, parse=parse),
+                    lambda args_content: self._parse_tool_args(spec, args_content)
+                )
+
+            except LLMQueueTimeout:
+                raise
+            except Exception as e:
+                logger.warning(f"Failed to generate args using LLM, falling back to planner args. Error: {e}")
+                tool_args = step.tool_args or {}
+
+        # 3. 执行工具
+        try:
+            logger.info(f"Executing tool {tool_name} with args: {tool_args}")
+
+            self._check_tool_args(spec, tool_args)
+            with span(f"tool.{tool_name}"), track_tool_call(tool_name):
+                result = spec.runner.call(**tool_args)
+
+            return self._finish_tool_step(step, tool_name, result)
+        except LLMQueueTimeout:
+            raise
+        except Exception as e:
+            return self._tool_step_failed(step, tool_name, e)
 
-    def _execute_tool_step(self, step:Step, history: List[StepRecord]) -> StepResult:
-        print(f"Executing step {step.id}, history is {history}")
+    def _resolve_tool(self, step: Step):
+        """
+        验证工具是否存在
+        :return: (ToolSpec, None) 或 (None, 失败结果)
+        """
         tool_name = step.tool_name
-        
-        # 1. 验证工具是否存在
+
         if not tool_name:
-            return StepResult(
+            return None, StepResult(
                 is_success=False,
                 error_message=f"Tool name is missing for TOOL step {step.id}."
             )
-            
-        tool_func = self.tools.get(tool_name)
-        if not tool_func:
-            return StepResult(
+
+        spec = self.registry.get(tool_name)
+        if not spec:
+            return None, StepResult(
                 is_success=False,
                 error_message=f"Tool '{tool_name}' not found."
             )
+        return spec, None
 
-        # 2. 使用 LLM 生成参数
-        try:
-            history_str = ""
-            if history:
-                history_str = "\n".join([f"Step {record.step.id}: {record.step.description}\nResult: {record.result.raw_output}" for record in history])
-            else:
-                history_str = "无"
-
-            prompt = Template(TOOL_ARGUMENT_PROMPT_TEMPLATE).safe_substitute(
-                tool_name=tool_name,
-                tool_doc=tool_func.__doc__,
-                step_description=step.description,
-                history=history_str
-            )
+    def _check_tool_args(self, spec: ToolSpec, tool_args: Any):
+        """调用前按工具参数 Schema 校验，不合法时直接判定步骤失败，不调用工具"""
+        errors = spec.validate(tool_args)
+        if errors:
+            raise ValueError(f"Invalid arguments for {spec.name}: {'; '.join(errors)}")
 
-            messages = [
-                {"role": "system", "content": prompt},
-                {"role": "user", "content": "请生成参数"}
-            ]
+    def _planner_tool_args(self, step: Step, spec: ToolSpec) -> Optional[Dict[str, Any]]:
+        """
+        Planner 给出的 tool_args 符合工具签名且不引用前序步骤的输出时直接使用
+        :return: 可直接调用工具的参数，None 表示需要由 LLM 生成参数
+        """
+        if not settings.reuse_planner_tool_args or step.tool_args is None:
+            return None
 
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                response_format={"type": "json_object"}
-            )
-            
-            args_content = response.choices[0].message.content
+        errors = spec.validate(step.tool_args)
+        if errors:
+            logger.info(f"Planner args for {step.tool_name} are invalid, generating with LLM: {errors}")
+            return None
+        if references_step_output(step.tool_args):
+            logger.info(f"Planner args for {step.tool_name} reference earlier steps, generating with LLM")
+            return None
 
-            print(f"execute TOOL args: {args_content}")
+        logger.info(f"Using planner args for {step.tool_name}: {step.tool_args}")
+        record_tool_args_reused(step.tool_name)
+        return dict(step.tool_args)
 
-            tool_args = json.loads(args_content)
-            logger.info(f"LLM generated args for {tool_name}: {tool_args}")
+    def _build_tool_args_messages(self, step: Step, spec: ToolSpec, history: HistoryBuffer) -> List[Dict[str, str]]:
+        history_str = history.render()
 
-        except Exception as e:
-            logger.warning(f"Failed to generate args using LLM, falling back to planner args. Error: {e}")
-            tool_args = step.tool_args or {}
+        # 同一工具的 system 消息固定不变，步骤描述与历史放在 user 消息中
+        system_prompt = TOOL_ARGUMENT_PROMPT.safe_substitute(
+            tool_name=spec.name,
+            tool_doc=spec.doc_fragment
+        )
+        user_prompt = TOOL_ARGUMENT_INPUT.safe_substitute(
+            history=history_str,
+            step_description=step.description
+        )
 
-        # 3. 执行工具
-        try:
-            logger.info(f"Executing tool {tool_name} with args: {tool_args}")
-            print(f"Executing tool {tool_name} with args: {tool_args}")
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": render_context(history.context) + user_prompt}
+        ]
 
-            # 假设工具函数支持 **kwargs 传参
-            result = tool_func(**tool_args)
+    def _parse_tool_args(self, spec: ToolSpec, args_content: str) -> Dict[str, Any]:
+        logger.debug(f"LLM tool args response: {args_content}")
 
-            print(f"execute TOOL {tool_name} success for {step.id}, get result len: {len(result)}")
-            step.status = StepStatus.COMPLETED
+        tool_args = loads(args_content)
+        logger.info(f"LLM generated args for {spec.name}: {tool_args}")
+        # 不符合参数 Schema 时抛出 ValueError，由更强的模型重新生成
+        self._check_tool_args(spec, tool_args)
+        return tool_args
 
-            return StepResult(
-                is_success=True,
-                raw_output=str(result),
-                # 尝试将结果作为结构化数据，如果不是 dict/list 则为 None
-                structured_output=result if isinstance(result, (dict, list)) else {"result": result},
-                tool_name=tool_name
-            )
-        except Exception as e:
-            logger.error(f"Tool execution failed: {e}")
-            step.status = StepStatus.FAILED
-            return StepResult(
-                is_success=False,
-                error_message=f"Tool execution failed: {str(e)}",
-                tool_name=tool_name
-            )
+    def _finish_tool_step(self, step: Step, tool_name: str, result: Any) -> StepResult:
+        logger.info(f"Tool {tool_name} succeeded for step {step.id}, result length {len(result)}")
+        step.status = StepStatus.COMPLETED
+
+        return StepResult(
+            is_success=True,
+            raw_output=str(result),
+            # 尝试将结果作为结构化数据，如果不是 dict/list 则为 None
+            structured_output=result if isinstance(result, (dict, list)) else {"result": result},
+            tool_name=tool_name
+        )
 
-    def summary_final(self, query: str, history: List[StepRecord]) -> StepResult:
+    def _tool_step_failed(self, step: Step, tool_name: str, e: Exception) -> StepResult:
+        logger.error(f"Tool execution failed: {e}")
+        step.status = StepStatus.FAILED
+        return StepResult(
+            is_success=False,
+            error_message=f"Tool execution failed: {str(e)}",
+            tool_name=tool_name
+        )
+
+    def summary_final(
+        self,
+        query: str,
+        history: List[StepRecord],
+        history_buffer: Optional[HistoryBuffer] = None
+    ) -> StepResult:
         """
         当达到最大步数限制时，尝试根据历史记录生成最终答案
         """
         logger.info("Max steps reached, generating final summary.")
-        
-        history_str = ""
-        if history:
-            history_str = "\n".join([f"Step {record.step.id}: {record.step.description}\nResult: {record.result.raw_output}" for record in history])
-        else:
-            history_str = "无"
-
-        prompt = Template(FINAL_FALLBACK_SYSTEM_PROMPT_TEMPLATE).safe_substitute(
+        messages = self._build_summary_messages(query, self._history_buffer(history, history_buffer))
+
+        try:
+            with span("executor.summary_final"):
+                content = self._call_llm(messages, role=ROLE_SUMMARY)
+
+            return self._finish_summary(content)
+
+        except LLMQueueTimeout:
+            raise
+        except Exception as e:
+            return self._summary_failed(e)
+
+    def _build_summary_messages(self, query: str, history: HistoryBuffer) -> List[Dict[str, str]]:
+        history_str = history.render()
+
+        user_prompt = FINAL_FALLBACK_INPUT.safe_substitute(
             query=query,
             history=history_str
         )
 
-        messages = [
-            {"role": "system", "content": prompt},
-            {"role": "user", "content": "请给出最终答案"}
+        return [
+            {"role": "system", "content": FINAL_FALLBACK_SYSTEM_PROMPT},
+            {"role": "user", "content": render_context(history.context) + user_prompt}
         ]
 
+    def _finish_summary(self, content: str) -> StepResult:
+        return StepResult(
+            is_success=True,
+            raw_output=content,
+            structured_output={"final_answer": content}
+        )
+
+    def _summary_failed(self, e: Exception) -> StepResult:
+        logger.error(f"Final summary failed: {e}")
+        return StepResult(
+            is_success=False,
+            error_message=f"Final summary failed: {str(e)}"
+        )
+
+
+class AsyncExecutor(Executor):
+    """
+    Executor 的异步版本
+    LLM 调用使用 AsyncOpenAI；协程工具直接 await，同步工具放到线程中执行，避免阻塞事件循环
+    """
+    def _create_client(self) -> AsyncOpenAI:
+        return get_async_llm_client()
+
+    async def _call_llm(
+        self,
+        messages: List[Dict[str, str]],
+        response_format: Optional[Dict[str, Any]] = None,
+        role: str = ROLE_LLM_STEP,
+        model: Optional[str] = None,
+        parse: Optional[Callable[[str], Any]] = None
+    ) -> Any:
+        return await achat_completion(
+            self.client, model=model or self.models.model_for(role), messages=messages,
+            response_format=response_format, role=role, parse=parse
+        )
+
+    async def execute_step(
+        self,
+        step:Step,
+        history:Optional[List[StepRecord]] = None,
+        history_buffer: Optional[HistoryBuffer] = None
+    ) -> StepResult:
+        history = self._history_buffer(history, history_buffer)
+        error = self._check_pending(step)
+        if error:
+            return error
+        step.status = StepStatus.RUNNING
+
+        logger.info(f"Executing step {step.id}, action type is {step.action_type}")
+        with span("executor.execute_step", step_id=step.id, action_type=step.action_type) as current:
+            try:
+                if step.action_type == "LLM":
+                    result = await self._execute_llm_step(step, history)
+                elif step.action_type == "TOOL":
+                    result = await self._execute_tool_step(step, history)
+                else:
+                    raise ValueError(f"Unknown action type {step.action_type}")
+            except LLMQueueTimeout:
+                raise
+            except Exception as e:
+                result = self._step_failed(step, e)
+            current.set_attribute("success", result.is_success)
+            return result
+
+    async def _execute_llm_step(self, step:Step, history: HistoryBuffer) -> StepResult:
+        messages = self._build_llm_step_messages(step, history)
+
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages
-            )
-            
-            content = response.choices[0].message.content
-            
-            return StepResult(
-                is_success=True,
-                raw_output=content,
-                structured_output={"final_answer": content}
+            return await acall_with_escalation(
+                self.models, ROLE_LLM_STEP,
+                lambda model, parse: self._call_llm(messages, response_format={"type": "json_object"}, model=model, parse=parse),
+                lambda content: self._finish_llm_step(step, content)
             )
-            
+
+        except LLMQueueTimeout:
+            raise
         except Exception as e:
-            logger.error(f"Final summary failed: {e}")
-            return StepResult(
-                is_success=False,
-                error_message=f"Final summary failed: {str(e)}"
-            )
+            return self._llm_step_failed(step, e)
+
+    async def _execute_tool_step(self, step:Step, history: HistoryBuffer) -> StepResult:
+        spec, error = self._resolve_tool(step)
+        if error:
+            return error
+        tool_name = step.tool_name
+
+        tool_args = self._planner_tool_args(step, spec)
+        if tool_args is None:
+            try:
+                messages = self._build_tool_args_messages(step, spec, history)
+
+                tool_args = await acall_with_escalation(
+                    self.models, ROLE_TOOL_ARGS,
+                    lambda model, parse: self._call_llm(messages, response_format={"type": "json_object"}, role=ROLE_TOOL_ARGS, model=model, parse=parse),
+                    lambda args_content: self._parse_tool_args(spec, args_content)
+                )
+
+            except LLMQueueTimeout:
+                raise
+            except Exception as e:
+                logger.warning(f"Failed to generate args using LLM, falling back to planner args. Error: {e}")
+                tool_args = step.tool_args or {}
+
+        try:
+            logger.info(f"Executing tool {tool_name} with args: {tool_args}")
+
+            self._check_tool_args(spec, tool_args)
+            with span(f"tool.{tool_name}"), track_tool_call(tool_name):
+                result = await spec.runner.acall(**tool_args)
+
+            return self._finish_tool_step(step, tool_name, result)
+        except LLMQueueTimeout:
+            raise
+        except Exception as e:
+            return self._tool_step_failed(step, tool_name, e)
+
+    async def summary_final(
+        self,
+        query: str,
+        history: List[StepRecord],
+        history_buffer: Optional[HistoryBuffer] = None
+    ) -> StepResult:
+        logger.info("Max steps reached, generating final summary.")
+        messages = self._build_summary_messages(query, self._history_buffer(history, history_buffer))
+
+        try:
+            with span("executor.summary_final"):
+                content = await self._call_llm(messages, role=ROLE_SUMMARY)
+            return self._finish_summary(content)
+
+        except LLMQueueTimeout:
+            raise
+        except Exception as e:
+            return self._summary_failed(e)
+
+    async def stream_summary(
+        self,
+        query: str,
+        history: List[StepRecord],
+        history_buffer: Optional[HistoryBuffer] = None
+    ) -> AsyncIterator[str]:
+        """
+        summary_final 的流式版本，逐段产出最终答案文本
+        """
+        logger.info("Generating final summary (streaming).")
+        messages = self._build_summary_messages(query, self._history_buffer(history, history_buffer))
+        async for delta in achat_completion_stream(
+            self.client, model=self.models.model_for(ROLE_SUMMARY), messages=messages, role=ROLE_SUMMARY
+        ):
+            yield delta
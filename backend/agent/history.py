@@ -0,0 +1,153 @@
+"""
+执行历史的增量渲染
+每次运行维护一个 HistoryBuffer，步骤完成时追加一次并预先渲染好文本，
+构建 Prompt 时按 token 预算拼接：最近的步骤保留原文，较早的步骤只保留截断后的摘要。
+"""
+import threading
+from typing import Callable, Iterable, List, Optional
+
+from agent.schema import StepRecord
+from core.config import settings
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算文本的 token 数
+    中日韩字符按 1 个 token 计算，其余字符按 4 个字符 1 个 token 计算
+    """
+    cjk = sum(1 for ch in text if "⺀" <= ch <= "鿿" or "가" <= ch <= "힯" or "＀" <= ch <= "￯")
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class _Entry:
+    __slots__ = ("_load", "full_tokens", "brief", "brief_tokens")
+
+    def __init__(self, load: Callable[[], str], full_tokens: int, brief: str):
+        """
+        :param load: 生成原文的函数；不在条目中另存原文，输出外置后只在渲染原文时从输出存储读取
+        """
+        self._load = load
+        self.full_tokens = full_tokens
+        self.brief = brief
+        self.brief_tokens = estimate_tokens(brief)
+
+    @property
+    def full(self) -> str:
+        return self._load()
+
+
+class HistoryBuffer:
+    """
+    单次运行内的执行历史缓冲区
+    - append 时对每条记录只渲染一次（原文与截断摘要两种形式）
+    - render 从最新的步骤向前拼接，直到用完 token 预算，结果缓存到下一次 append
+    """
+    EMPTY = "无"
+
+    def __init__(
+        self,
+        max_tokens: Optional[int] = None,
+        keep_recent: Optional[int] = None,
+        preview_chars: Optional[int] = None,
+        context: str = ""
+    ):
+        """
+        :param max_tokens: 历史部分的 token 预算
+        :param keep_recent: 最近多少个步骤保留原文
+        :param preview_chars: 较早步骤保留的输出字符数
+        :param context: 同一任务之前的对话记忆，与执行历史一起提供给 Executor
+        """
+        self.context = context
+        self.max_tokens = max_tokens if max_tokens is not None else settings.history_token_budget
+        self.keep_recent = keep_recent if keep_recent is not None else settings.history_recent_steps
+        self.preview_chars = preview_chars if preview_chars is not None else settings.history_preview_chars
+
+        self._entries: List[_Entry] = []
+        self._rendered: Optional[str] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_records(cls, records: Iterable[StepRecord], **kwargs) -> "HistoryBuffer":
+        buffer = cls(**kwargs)
+        buffer.extend(records)
+        return buffer
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def append(self, record: StepRecord):
+        """
+        追加一条执行记录，应在输出外置之前调用：token 数与摘要直接由内存中的原文计算，不读取输出存储
+        已经外置的记录（如从检查点恢复的历史）按预览与原文长度估算
+        """
+        result = record.result
+        header = f"Step {record.step.id}: {record.step.description}\nResult: "
+
+        if result.output_ref is None:
+            output = self._output_text(record)
+            size = len(output)
+            output_tokens = estimate_tokens(output)
+        else:
+            # 预览末尾带有截断说明，只取预览正文
+            output = (result.raw_output or "")[:settings.output_preview_chars]
+            size = result.output_size or len(output)
+            output_tokens = estimate_tokens(output) * size // max(len(output), 1)
+
+        if size > self.preview_chars:
+            brief_output = f"{output[:self.preview_chars]}...(已截断，原文共{size}字)"
+        else:
+            brief_output = output
+
+        entry = _Entry(
+            load=lambda: header + self._output_text(record),
+            full_tokens=estimate_tokens(header) + output_tokens,
+            brief=header + brief_output
+        )
+        with self._lock:
+            self._entries.append(entry)
+            self._rendered = None
+
+    def extend(self, records: Iterable[StepRecord]):
+        for record in records:
+            self.append(record)
+
+    def render(self) -> str:
+        with self._lock:
+            if self._rendered is None:
+                self._rendered = self._render()
+            return self._rendered
+
+    def _output_text(self, record: StepRecord) -> str:
+        result = record.result
+        if result.raw_output is not None:
+            # 外置的输出在这里按需读取原文
+            return str(result.full_output())
+        if not result.is_success:
+            return f"执行失败: {result.error_message}"
+        return ""
+
+    def _render(self) -> str:
+        if not self._entries:
+            return self.EMPTY
+
+        parts: List[str] = []
+        remaining = self.max_tokens
+        total = len(self._entries)
+
+        # 从最新的步骤向前拼接
+        for offset, entry in enumerate(reversed(self._entries)):
+            if offset < self.keep_recent and entry.full_tokens <= remaining:
+                text, tokens = entry.full, entry.full_tokens
+            elif entry.brief_tokens <= remaining:
+                text, tokens = entry.brief, entry.brief_tokens
+            elif offset == 0:
+                # 即使最新步骤的摘要也超出预算，仍按预算截断保留
+                text, tokens = entry.brief[:max(remaining, 0) * 2], remaining
+            else:
+                parts.append(f"（更早的 {total - offset} 个步骤已省略）")
+                break
+            parts.append(text)
+            remaining -= tokens
+
+        parts.reverse()
+        return "\n".join(parts)
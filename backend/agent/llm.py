@@ -0,0 +1,380 @@
+"""
+LLM 客户端管理
+进程内所有 Planner / Executor 共享同一组 OpenAI 客户端及其 HTTP 连接池，
+避免每次请求都重新创建客户端、重新进行 TLS 握手。
+"""
+import asyncio
+import logging
+import threading
+import time
+import weakref
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+import httpx
+from openai import AsyncOpenAI, OpenAI
+
+from agent.cache import TieredCache, make_cache_key
+from agent.concurrency import allm_slot, get_llm_governor, llm_slot
+from agent.metrics import record_llm_call, usage_cached_tokens, usage_tokens
+from agent.replay import MODE_LIVE, AsyncRecordReplayTransport, FixtureStore, RecordReplayTransport
+from agent.routing import VALIDATION_ERRORS
+from agent.tracing import record_span
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_client: Optional[OpenAI] = None
+# httpx.AsyncClient 的连接绑定在创建它的事件循环上，因此按事件循环分别缓存
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOpenAI]" = weakref.WeakKeyDictionary()
+_no_loop_async_client: Optional[AsyncOpenAI] = None
+_llm_cache: Optional[TieredCache] = None
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=settings.llm_max_connections,
+        max_keepalive_connections=settings.llm_max_keepalive_connections,
+        keepalive_expiry=settings.llm_keepalive_expiry
+    )
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(settings.llm_timeout, connect=settings.llm_connect_timeout)
+
+
+def _transport() -> Optional[httpx.BaseTransport]:
+    """llm_transport_mode 为 record / replay 时返回包装后的 transport，live 时使用 httpx 默认 transport"""
+    if settings.llm_transport_mode == MODE_LIVE:
+        return None
+    return RecordReplayTransport(
+        settings.llm_transport_mode,
+        FixtureStore(settings.llm_fixture_dir),
+        httpx.HTTPTransport(limits=_limits())
+    )
+
+
+def _async_transport() -> Optional[httpx.AsyncBaseTransport]:
+    if settings.llm_transport_mode == MODE_LIVE:
+        return None
+    return AsyncRecordReplayTransport(
+        settings.llm_transport_mode,
+        FixtureStore(settings.llm_fixture_dir),
+        httpx.AsyncHTTPTransport(limits=_limits())
+    )
+
+
+def get_llm_client() -> OpenAI:
+    """获取进程内共享的同步 LLM 客户端"""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = OpenAI(
+                    api_key=settings.dashscope_api_key,
+                    base_url=settings.llm_base_url,
+                    max_retries=settings.llm_max_retries,
+                    http_client=httpx.Client(limits=_limits(), timeout=_timeout(), transport=_transport())
+                )
+                logger.info(f"创建共享LLM客户端: {settings.llm_base_url} ({settings.llm_transport_mode})")
+    return _client
+
+
+def get_async_llm_client() -> AsyncOpenAI:
+    """获取当前事件循环共享的异步 LLM 客户端"""
+    global _no_loop_async_client
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+
+    with _lock:
+        client = _async_clients.get(loop) if loop else _no_loop_async_client
+        if client is None:
+            client = AsyncOpenAI(
+                api_key=settings.dashscope_api_key,
+                base_url=settings.llm_base_url,
+                max_retries=settings.llm_max_retries,
+                http_client=httpx.AsyncClient(limits=_limits(), timeout=_timeout(), transport=_async_transport())
+            )
+            if loop:
+                _async_clients[loop] = client
+            else:
+                _no_loop_async_client = client
+            logger.info(f"创建共享异步LLM客户端: {settings.llm_base_url} ({settings.llm_transport_mode})")
+    return client
+
+
+async def close_llm_clients():
+    """关闭所有共享客户端，释放连接池（应用退出时调用）"""
+    global _client, _no_loop_async_client
+    with _lock:
+        client, _client = _client, None
+        async_clients = list(_async_clients.values())
+        _async_clients.clear()
+        if _no_loop_async_client is not None:
+            async_clients.append(_no_loop_async_client)
+            _no_loop_async_client = None
+
+    if client is not None:
+        client.close()
+    for async_client in async_clients:
+        try:
+            await async_client.close()
+        except Exception as e:
+            logger.warning(f"关闭异步LLM客户端失败: {e}")
+
+
+def _pool_stats(http_client: Any) -> Dict[str, int]:
+    """
+    读取 httpx 客户端底层 httpcore 连接池的状态
+    httpcore 未提供公开的统计接口，这里只做尽力而为的读取
+    """
+    pool = getattr(getattr(http_client, "_transport", None), "_pool", None)
+    connections = list(getattr(pool, "connections", []) or [])
+    requests = list(getattr(pool, "_requests", []) or [])
+
+    idle = sum(1 for conn in connections if conn.is_idle())
+    queued = sum(1 for request in requests if getattr(request, "is_queued", lambda: False)())
+    return {
+        "connections": len(connections),
+        "idle_connections": idle,
+        "active_connections": len(connections) - idle,
+        "in_flight_requests": len(requests) - queued,
+        "queued_requests": queued,
+    }
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """汇总同步与异步客户端的连接池状态与 LLM 并发名额，用于评估连接池与并发上限配置"""
+    with _lock:
+        sync_client = _client
+        async_clients = list(_async_clients.values())
+        if _no_loop_async_client is not None:
+            async_clients.append(_no_loop_async_client)
+
+    stats: Dict[str, Any] = {
+        "limits": {
+            "max_connections": settings.llm_max_connections,
+            "max_keepalive_connections": settings.llm_max_keepalive_connections,
+            "keepalive_expiry": settings.llm_keepalive_expiry,
+        },
+        "sync": _pool_stats(sync_client._client) if sync_client else None,
+        "async": [_pool_stats(client._client) for client in async_clients],
+    }
+    # 进程级 LLM 并发名额的占用与排队情况
+    governor = get_llm_governor()
+    stats["concurrency"] = governor.stats() if governor else None
+    return stats
+
+
+def get_llm_cache() -> Optional[TieredCache]:
+    """获取进程内共享的 LLM 响应缓存，未启用时返回 None"""
+    global _llm_cache
+    if not settings.llm_cache_enabled:
+        return None
+    if _llm_cache is None:
+        with _lock:
+            if _llm_cache is None:
+                _llm_cache = TieredCache(
+                    namespace="llm",
+                    max_entries=settings.llm_cache_max_entries,
+                    ttl=settings.llm_cache_ttl,
+                    db_path=settings.cache_db_path,
+                    max_disk_entries=settings.llm_cache_max_disk_entries
+                )
+    return _llm_cache
+
+
+def _completion_kwargs(model: str, messages: List[Dict[str, str]], response_format: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    kwargs: Dict[str, Any] = {"model": model, "messages": messages}
+    if response_format is not None:
+        kwargs["response_format"] = response_format
+    return kwargs
+
+
+def _observe(
+    role: str,
+    model: str,
+    latency: float,
+    prompt_tokens: int = 0,
+    completion_tokens: int = 0,
+    success: bool = True,
+    cached: bool = False,
+    cached_prompt_tokens: int = 0
+):
+    """记录一次 LLM 调用的指标，并作为当前 span 的子 span 写入追踪"""
+    record_llm_call(
+        role, model, latency, prompt_tokens, completion_tokens,
+        success=success, cached=cached, cached_prompt_tokens=cached_prompt_tokens
+    )
+    record_span(
+        f"llm.{role}",
+        latency,
+        status="ok" if success else "error",
+        model=model,
+        cached=cached,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        cached_prompt_tokens=cached_prompt_tokens
+    )
+
+
+def _record_completion(role: str, model: str, started: float, completion: Any):
+    usage = getattr(completion, "usage", None)
+    prompt_tokens, completion_tokens = usage_tokens(usage)
+    cached_prompt_tokens = usage_cached_tokens(usage)
+    latency = time.perf_counter() - started
+    logger.debug(
+        f"LLM调用[{role}] 耗时 {latency:.2f}s, prompt_tokens={prompt_tokens} (cached {cached_prompt_tokens}), "
+        f"completion_tokens={completion_tokens}"
+    )
+    _observe(role, model, latency, prompt_tokens, completion_tokens, cached_prompt_tokens=cached_prompt_tokens)
+
+
+def _use_cached(key: str, role: str, model: str, cached: Any, parse: Optional[Callable[[str], Any]]) -> Tuple[bool, Any]:
+    """
+    处理缓存中读到的内容，提供 parse 时返回解析结果
+    :return: (是否可用, 内容或解析结果)；内容解析失败时返回不可用，调用方应删除该条目
+    """
+    if parse is not None:
+        try:
+            cached = parse(cached)
+        except VALIDATION_ERRORS as e:
+            logger.warning(f"LLM缓存内容校验失败，已删除: {key[:12]} ({e})")
+            return False, None
+    logger.debug(f"LLM缓存命中: {key[:12]}")
+    _observe(role, model, 0.0, cached=True)
+    return True, cached
+
+
+def _parse_response(content: str, parse: Optional[Callable[[str], Any]]) -> Any:
+    """解析新生成的响应；解析成功后调用方才写入缓存，避免缓存不合格的输出"""
+    return parse(content) if parse is not None else content
+
+
+def chat_completion(
+    client: OpenAI,
+    model: str,
+    messages: List[Dict[str, str]],
+    response_format: Optional[Dict[str, Any]] = None,
+    role: str = "llm",
+    parse: Optional[Callable[[str], Any]] = None
+) -> Any:
+    """
+    调用 LLM 并返回文本内容
+    以 (model, messages, response_format) 为键查询响应缓存，命中时不发起网络请求
+    :param role: 调用角色（plan / replan / tool-args / llm-step / summary），用于耗时与 token 统计
+    :param parse: 解析并校验文本的函数；提供时返回解析结果，且只有解析成功的响应才会写入缓存
+    """
+    cache = get_llm_cache()
+    key = make_cache_key(model, messages, response_format)
+    cached = cache.get(key) if cache is not None else None
+    if cached is not None:
+        usable, result = _use_cached(key, role, model, cached, parse)
+        if usable:
+            return result
+        cache.delete(key)
+
+    # 占用进程级并发名额后再发起请求，耗时不含排队时间
+    with llm_slot():
+        started = time.perf_counter()
+        try:
+            completion = client.chat.completions.create(**_completion_kwargs(model, messages, response_format))
+        except Exception:
+            _observe(role, model, time.perf_counter() - started, success=False)
+            raise
+    _record_completion(role, model, started, completion)
+    content = completion.choices[0].message.content
+    result = _parse_response(content, parse)
+    if cache is not None and content:
+        cache.set(key, content)
+    return result
+
+
+async def achat_completion(
+    client: AsyncOpenAI,
+    model: str,
+    messages: List[Dict[str, str]],
+    response_format: Optional[Dict[str, Any]] = None,
+    role: str = "llm",
+    parse: Optional[Callable[[str], Any]] = None
+) -> Any:
+    """chat_completion 的异步版本，响应缓存的磁盘读写不阻塞事件循环"""
+    cache = get_llm_cache()
+    key = make_cache_key(model, messages, response_format)
+    cached = await cache.aget(key) if cache is not None else None
+    if cached is not None:
+        usable, result = _use_cached(key, role, model, cached, parse)
+        if usable:
+            return result
+        await cache.adelete(key)
+
+    async with allm_slot():
+        started = time.perf_counter()
+        try:
+            completion = await client.chat.completions.create(**_completion_kwargs(model, messages, response_format))
+        except Exception:
+            _observe(role, model, time.perf_counter() - started, success=False)
+            raise
+    _record_completion(role, model, started, completion)
+    content = completion.choices[0].message.content
+    result = _parse_response(content, parse)
+    if cache is not None and content:
+        await cache.aset(key, content)
+    return result
+
+
+async def achat_completion_stream(
+    client: AsyncOpenAI,
+    model: str,
+    messages: List[Dict[str, str]],
+    role: str = "llm"
+) -> AsyncIterator[str]:
+    """
+    流式调用 LLM，逐段产出模型生成的文本
+    缓存命中时一次性产出完整内容；完整生成结束后写入缓存
+    token 用量取自流末尾的 usage 块（stream_options.include_usage）
+    """
+    cache = get_llm_cache()
+    key = make_cache_key(model, messages, None)
+    if cache is not None:
+        cached = await cache.aget(key)
+        if cached is not None:
+            _observe(role, model, 0.0, cached=True)
+            yield cached
+            return
+
+    parts: List[str] = []
+    usage = None
+    # 流式请求在整个生成期间占用并发名额
+    async with allm_slot():
+        started = time.perf_counter()
+        try:
+            stream = await client.chat.completions.create(
+                model=model,
+                messages=messages,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            async for chunk in stream:
+                if getattr(chunk, "usage", None) is not None:
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        except Exception:
+            _observe(role, model, time.perf_counter() - started, success=False)
+            raise
+
+    prompt_tokens, completion_tokens = usage_tokens(usage)
+    _observe(
+        role, model, time.perf_counter() - started, prompt_tokens, completion_tokens,
+        cached_prompt_tokens=usage_cached_tokens(usage)
+    )
+    content = "".join(parts)
+    if cache is not None and content:
+        await cache.aset(key, content)
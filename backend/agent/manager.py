@@ -1,78 +1,650 @@
 """
 Agent 主程序，负责管理和协调各个组件的工作。
 """
-from typing import List
+import asyncio
+import contextvars
+import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from agent.checkpoint import Checkpoint, CheckpointNotFound, RunCheckpoint, get_checkpoint_store
+from agent.concurrency import LLMQueueTimeout
+from agent.executor import AsyncExecutor, Executor
+from agent.history import HistoryBuffer
+from agent.metrics import AGENT_RUNS, bind_run_metrics
+from agent.output_store import get_output_store
+from agent.planner import AsyncPlanner, Planner
+from agent.policy import ReplanPolicy
+from agent.registry import ToolRegistry, get_default_registry
+from agent.schema import AgentEvent, AgentState, Plan, RunMetrics, Step, StepResult, StepStatus, StepRecord
+from agent.tracing import span
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+EventCallback = Callable[[AgentEvent], Awaitable[None]]
+
+
+def _step_record(step: Step, result: StepResult) -> StepRecord:
+    """
+    执行记录保存步骤当时的副本：记录的 JSON 片段会被缓存（见 agent.serialization.record_json），
+    计划中的步骤之后再被修改也不会让已写入历史的记录失效
+    """
+    return StepRecord(step=step.model_copy(deep=True), result=result)
 
-from agent.executor import Executor
-from agent.planner import Planner
-from agent.schema import AgentState, StepStatus, StepRecord
-from agent.tools import web_search
 
 class AgentManager:
-    def __init__(self, max_steps: int):
-        self.tools = [web_search]
+    def __init__(
+        self,
+        max_steps: int,
+        max_parallel_steps: int = 4,
+        replan_policy: Optional[ReplanPolicy] = None,
+        speculative: Optional[bool] = None,
+        registry: Optional[ToolRegistry] = None
+    ):
+        # Planner 与 Executor 共用的工具注册表，运行期间注册 / 注销的工具对后续步骤立即生效
+        self.registry = registry if registry is not None else get_default_registry()
 
-        self.planner = Planner(tools=self.tools)
-        self.executor = Executor(tools=self.tools)
+        self.planner = self._create_planner()
+        self.executor = self._create_executor()
 
         self.max_steps = max_steps
+        # 同一轮中可并行执行的最大步骤数
+        self.max_parallel_steps = max(1, max_parallel_steps)
+        # 决定每批步骤执行后是否需要重规划
+        self.replan_policy = replan_policy or ReplanPolicy()
+        # 重规划期间是否推测执行下一个待执行步骤
+        self.speculative = settings.speculative_execution if speculative is None else speculative
+
+    def _create_planner(self) -> Planner:
+        return Planner(registry=self.registry)
+
+    def _create_executor(self) -> Executor:
+        return Executor(registry=self.registry)
+
+    def run(
+        self,
+        problem: str,
+        context: Optional[str] = None,
+        run_id: Optional[str] = None,
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> AgentState:
+        """
+        :param problem: 用户问题
+        :param context: 同一任务之前的对话记忆，提供给 Planner 与 Executor
+        :param run_id: 运行ID，不传时自动生成；调用方需要在运行结束前拿到ID（用于恢复运行）时传入
+        :param metadata: 写入检查点的附加信息（如所属任务），恢复运行时原样返回
+        """
+        # 本次运行的 LLM / 工具调用统计，运行期间所有调用都累加到这里
+        metrics = RunMetrics()
+        # 运行ID同时作为本次运行的 trace_id，规划、执行、工具与 LLM 调用的 span 都挂在 agent.run 之下
+        run_id = run_id or uuid.uuid4().hex
+        with bind_run_metrics(metrics), span("agent.run", trace_id=run_id, max_steps=self.max_steps):
+            try:
+                agent_state = self._run(problem, metrics, context, run_id, metadata)
+            except Exception:
+                AGENT_RUNS.inc(status="error")
+                raise
+        AGENT_RUNS.inc(status="success")
+        self._log_metrics(agent_state)
+        return agent_state
+
+    def resume(self, run_id: str) -> AgentState:
+        """
+        从最近一次检查点继续运行：已完成的步骤不再执行，崩溃时正在执行的步骤重新执行
+        :raises CheckpointNotFound: 该运行没有可用的检查点
+        """
+        saved = self._load_checkpoint(run_id)
+        metrics = RunMetrics()
+        with bind_run_metrics(metrics), span("agent.resume", trace_id=run_id, max_steps=self.max_steps):
+            try:
+                agent_state = self._resume(saved, metrics)
+            except Exception:
+                AGENT_RUNS.inc(status="error")
+                raise
+        AGENT_RUNS.inc(status="success")
+        self._log_metrics(agent_state)
+        return agent_state
+
+    def _run(
+        self,
+        problem: str,
+        metrics: RunMetrics,
+        context: Optional[str] = None,
+        run_id: Optional[str] = None,
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> AgentState:
+        checkpoint = self._checkpoint_writer(run_id)
+        checkpoint.start(problem, context, metadata)
 
-    def run(self, problem: str) -> AgentState:
-        plan = self.planner.create_initial_plan(problem)
+        plan = self.planner.create_initial_plan(problem, context)
 
         agent_state = AgentState(
             problem=problem,
+            run_id=run_id,
+            context=context or None,
             current_plan=plan,
-            history=[]
+            history=[],
+            metrics=metrics
         )
+        checkpoint.save(agent_state, [], 0)
+        # 本次运行的历史缓冲区，随步骤完成增量追加
+        history_buffer = HistoryBuffer(context=context or "")
+        return self._continue(agent_state, history_buffer, plan, checkpoint)
 
-        step_count = 0
+    def _resume(self, saved: Checkpoint, metrics: RunMetrics) -> AgentState:
+        agent_state = saved.state
+        agent_state.metrics = metrics
+        if saved.finished:
+            return agent_state
+
+        logger.info(f"Resuming run {saved.run_id} from step {saved.step_count}, {len(agent_state.history)} steps done")
+        checkpoint = self._checkpoint_writer(saved.run_id)
+        checkpoint.resumed(agent_state.current_plan)
+        history_buffer = HistoryBuffer.from_records(agent_state.history, context=agent_state.context or "")
+        return self._continue(agent_state, history_buffer, saved.initial_plan, checkpoint, saved.step_count)
+
+    def _continue(
+        self,
+        agent_state: AgentState,
+        history_buffer: HistoryBuffer,
+        initial_plan: Plan,
+        checkpoint: RunCheckpoint,
+        step_count: int = 0
+    ) -> AgentState:
+        """主执行循环，新运行与恢复的运行共用"""
+        steps_since_replan = 0
 
         # 2. 主执行循环
         while not agent_state.is_task_completed():
             if step_count >= self.max_steps:
                 break
 
-            next_step = agent_state.current_plan.next_step()
-            if not next_step:
+            ready_steps = agent_state.current_plan.ready_steps()
+            if not ready_steps:
                 # 没有可执行步骤，但也没 final_answer → 交给 replanner
-                self.planner.refine_plan(current_plan=plan, history=agent_state.history)
+                agent_state.current_plan = self.planner.refine_plan(
+                    current_plan=agent_state.current_plan, history=agent_state.history, context=agent_state.context
+                )
+                steps_since_replan = 0
                 step_count += 1
+                checkpoint.save(agent_state, [], step_count)
                 continue
 
-            # 3. 执行单步
-            result = self.executor.execute_step(step=next_step, history=agent_state.history)
-            print(f"In Manage, success executing step {next_step.id}, result {result.raw_output[:20]}")
+            # 3. 并行执行所有就绪步骤（受剩余步数限制）
+            batch = ready_steps[:self.max_steps - step_count]
+            records = self._execute_batch(batch, agent_state.history, history_buffer)
+
+            # 4. 按计划顺序记录历史
+            self._record_batch(agent_state, records, history_buffer)
+            step_count += len(batch)
+            steps_since_replan += len(batch)
+            checkpoint.save(agent_state, records, step_count)
+
+            # 5. 是否完成？
+            if agent_state.current_plan.final_answer:
+                break
+
+            # 6. 按重规划策略决定是否交给 Replanner 调整计划，否则直接继续执行后续步骤
+            while self.replan_policy.should_replan(agent_state.current_plan, records, steps_since_replan):
+                records = self._replan(agent_state, history_buffer, speculate=step_count < self.max_steps)
+                steps_since_replan = 0
+                if not records:
+                    checkpoint.save(agent_state, [], step_count)
+                    break
+                # 推测执行的结果被采用，视同执行了一个新的批次
+                self._record_batch(agent_state, records, history_buffer)
+                step_count += len(records)
+                steps_since_replan += len(records)
+                checkpoint.save(agent_state, records, step_count)
+                if step_count >= self.max_steps:
+                    break
+
+        if agent_state.current_plan.final_answer:
+            self._remember_plan(agent_state, initial_plan)
+        else:
+            logger.info("Max steps reached or no final answer, generating summary...")
+            final_result = self.executor.summary_final(agent_state.problem, agent_state.history, history_buffer)
+            agent_state.current_plan.final_answer = final_result.raw_output
+
+        checkpoint.finish(agent_state, step_count)
+        return agent_state
 
-            # 4. 更新 step 状态
-            if result.is_success:
-                next_step.status = StepStatus.COMPLETED
-            else:
-                next_step.status = StepStatus.FAILED
-                agent_state.last_error = result.error_message
+    def _checkpoint_writer(self, run_id: Optional[str]) -> RunCheckpoint:
+        store = get_checkpoint_store()
+        return RunCheckpoint(store if run_id else None, run_id or "")
 
-            # 5. 记录历史
-            agent_state.history.append(
-                StepRecord(step=next_step, result=result)
+    def _load_checkpoint(self, run_id: str) -> Checkpoint:
+        store = get_checkpoint_store()
+        if store is None:
+            raise CheckpointNotFound("未启用运行检查点")
+        return store.load(run_id)
+
+    def _execute_batch(self, batch: List[Step], history: List[StepRecord], history_buffer: HistoryBuffer) -> List[StepRecord]:
+        """
+        执行一批互不依赖的步骤
+        :param batch: 就绪步骤列表（按计划顺序）
+        :param history: 本批次开始前的历史记录，批内所有步骤共享同一份快照
+        :param history_buffer: 本次运行的历史缓冲区，批次结束后才会追加
+        :return: 与 batch 顺序一致的执行记录
+        """
+        snapshot = list(history)
+        if len(batch) == 1:
+            results = [self._execute_one(batch[0], snapshot, history_buffer)]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_parallel_steps, len(batch))) as pool:
+                # 每个线程在当前上下文的副本中运行，保证调用统计计入本次运行
+                futures = [
+                    pool.submit(contextvars.copy_context().run, self._execute_one, step, snapshot, history_buffer)
+                    for step in batch
+                ]
+                results = [future.result() for future in futures]
+
+        return [_step_record(step, result) for step, result in zip(batch, results)]
+
+    def _execute_one(self, step: Step, history: List[StepRecord], history_buffer: HistoryBuffer) -> StepResult:
+        result = self.executor.execute_step(step=step, history=history, history_buffer=history_buffer)
+        self._apply_result(step, result)
+        return result
+
+    def _replan(self, agent_state: AgentState, history_buffer: HistoryBuffer, speculate: bool = True) -> List[StepRecord]:
+        """
+        调用 Replanner 更新计划
+        启用推测执行时，在等待 Replanner 的同时执行下一个就绪步骤的副本
+        :return: 被采用的推测执行记录（未推测或结果被丢弃时为空列表）
+        """
+        candidate = self._speculation_candidate(agent_state) if self.speculative and speculate else None
+        if candidate is None:
+            agent_state.current_plan = self.planner.refine_plan(
+                current_plan=agent_state.current_plan, history=agent_state.history, context=agent_state.context
             )
+            return []
 
-            # 6. 是否完成？
-            if agent_state.current_plan.final_answer:
+        snapshot = list(agent_state.history)
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            future = pool.submit(
+                contextvars.copy_context().run,
+                self.executor.execute_step, step=candidate, history=snapshot, history_buffer=history_buffer
+            )
+            agent_state.current_plan = self.planner.refine_plan(
+                current_plan=agent_state.current_plan, history=agent_state.history, context=agent_state.context
+            )
+            result = future.result()
+
+        return self._resolve_speculation(agent_state, candidate, result)
+
+    def _speculation_candidate(self, agent_state: AgentState) -> Optional[Step]:
+        """返回下一个就绪步骤的副本，推测执行不会修改当前计划中的步骤"""
+        ready_steps = agent_state.current_plan.ready_steps()
+        if not ready_steps:
+            return None
+        return ready_steps[0].model_copy(deep=True)
+
+    def _resolve_speculation(self, agent_state: AgentState, candidate: Step, result: StepResult) -> List[StepRecord]:
+        """
+        重规划完成后判断推测执行的结果能否采用
+        新计划中仍存在相同 id、描述、动作、工具与参数的待执行步骤时采用，否则丢弃
+        """
+        plan = agent_state.current_plan
+        matched = None
+        if not plan.final_answer:
+            matched = next((step for step in plan.steps if step.id == candidate.id), None)
+
+        if (
+            matched is None
+            or matched.status != StepStatus.PENDING
+            or matched.description != candidate.description
+            or matched.action_type != candidate.action_type
+            or matched.tool_name != candidate.tool_name
+            or matched.tool_args != candidate.tool_args
+        ):
+            agent_state.metrics.speculation_waste += 1
+            logger.info(f"Speculative result of step {candidate.id} discarded, the replanned step differs")
+            return []
+
+        agent_state.metrics.speculation_hits += 1
+        self._apply_result(matched, result)
+        return [_step_record(matched, result)]
+
+    def _remember_plan(self, agent_state: AgentState, initial_plan: Plan):
+        """
+        所有步骤都成功且由 Replanner 给出最终答案的运行，其初始计划写入计划缓存
+        依赖对话记忆的后续提问不写入
+        """
+        if not agent_state.context and all(record.result.is_success for record in agent_state.history):
+            self.planner.remember_plan(agent_state.problem, initial_plan)
+
+    def _log_metrics(self, agent_state: AgentState):
+        metrics = agent_state.metrics
+        by_role = ", ".join(
+            f"{role}={stats.calls}次/{stats.latency_seconds:.2f}s/{stats.prompt_tokens + stats.completion_tokens}tok"
+            for role, stats in metrics.llm_by_role.items()
+        )
+        logger.info(
+            f"Agent run {agent_state.run_id} finished: {metrics.llm_calls} LLM calls, {metrics.llm_latency_seconds:.2f}s, "
+            f"{metrics.prompt_tokens} prompt ({metrics.cached_prompt_tokens} cached, {metrics.prompt_cache_ratio:.0%}) "
+            f"+ {metrics.completion_tokens} completion tokens, {metrics.llm_escalations} escalations, "
+            f"{metrics.plan_cache_hits} plan cache hits, "
+            f"{metrics.tool_calls} tool calls, {metrics.tool_latency_seconds:.2f}s ({by_role})"
+        )
+
+    def _apply_result(self, step: Step, result: StepResult):
+        # 更新 step 状态
+        if result.is_success:
+            step.status = StepStatus.COMPLETED
+        else:
+            step.status = StepStatus.FAILED
+
+    def _record_batch(self, agent_state: AgentState, records: List[StepRecord], history_buffer: HistoryBuffer):
+        self._append_records(agent_state, records, history_buffer)
+        self._offload_outputs(records)
+
+    def _append_records(self, agent_state: AgentState, records: List[StepRecord], history_buffer: HistoryBuffer):
+        for record in records:
+            logger.debug(f"Finished executing step {record.step.id}, result {(record.result.raw_output or '')[:20]}")
+            if not record.result.is_success:
+                agent_state.last_error = record.result.error_message
+            agent_state.history.append(record)
+            # 先用内存中的原文计算 token 数与摘要，再外置输出
+            history_buffer.append(record)
+
+    def _offload_outputs(self, records: List[StepRecord]):
+        """过大的输出写入输出存储，历史中只保留引用与预览"""
+        output_store = get_output_store()
+        if output_store is None:
+            return
+        for record in records:
+            output_store.offload(record.result)
+
+
+class AsyncAgentManager(AgentManager):
+    """
+    AgentManager 的异步版本
+    规划、执行、重规划全部以协程方式运行，就绪步骤通过 asyncio.gather 并发执行，
+    适合在 FastAPI 等事件循环中直接 await，单个 worker 可同时服务多个 Agent 运行
+    """
+    # 事件中步骤输出的最大预览长度
+    event_preview_chars = 300
+
+    def _create_planner(self) -> AsyncPlanner:
+        return AsyncPlanner(registry=self.registry)
+
+    def _create_executor(self) -> AsyncExecutor:
+        return AsyncExecutor(registry=self.registry)
+
+    async def run(
+        self,
+        problem: str,
+        on_event: Optional[EventCallback] = None,
+        context: Optional[str] = None,
+        run_id: Optional[str] = None,
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> AgentState:
+        """
+        :param problem: 用户问题
+        :param on_event: 可选的事件回调，运行过程中的计划、步骤、重规划与最终答案片段会依次推送给它
+        """
+        metrics = RunMetrics()
+        run_id = run_id or uuid.uuid4().hex
+        with bind_run_metrics(metrics), span("agent.run", trace_id=run_id, max_steps=self.max_steps):
+            try:
+                agent_state = await self._run(problem, metrics, on_event, context, run_id, metadata)
+            except Exception:
+                AGENT_RUNS.inc(status="error")
+                raise
+        AGENT_RUNS.inc(status="success")
+        self._log_metrics(agent_state)
+        return agent_state
+
+    async def resume(self, run_id: str, on_event: Optional[EventCallback] = None) -> AgentState:
+        """
+        从最近一次检查点继续运行，恢复时先推送一次当前计划
+        :raises CheckpointNotFound: 该运行没有可用的检查点
+        """
+        saved = await asyncio.to_thread(self._load_checkpoint, run_id)
+        metrics = RunMetrics()
+        with bind_run_metrics(metrics), span("agent.resume", trace_id=run_id, max_steps=self.max_steps):
+            try:
+                agent_state = await self._resume(saved, metrics, on_event)
+            except Exception:
+                AGENT_RUNS.inc(status="error")
+                raise
+        AGENT_RUNS.inc(status="success")
+        self._log_metrics(agent_state)
+        return agent_state
+
+    async def _arecord_batch(self, agent_state: AgentState, records: List[StepRecord], history_buffer: HistoryBuffer):
+        """_record_batch 的异步版本，输出外置的文件写入放到线程中执行"""
+        self._append_records(agent_state, records, history_buffer)
+        if get_output_store() is not None:
+            await asyncio.to_thread(self._offload_outputs, records)
+
+    async def _run(
+        self,
+        problem: str,
+        metrics: RunMetrics,
+        on_event: Optional[EventCallback] = None,
+        context: Optional[str] = None,
+        run_id: Optional[str] = None,
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> AgentState:
+        checkpoint = self._checkpoint_writer(run_id)
+        await checkpoint.astart(problem, context, metadata)
+
+        plan = await self.planner.create_initial_plan(problem, context)
+
+        agent_state = AgentState(
+            problem=problem,
+            run_id=run_id,
+            context=context or None,
+            current_plan=plan,
+            history=[],
+            metrics=metrics
+        )
+        await checkpoint.asave(agent_state, [], 0)
+        history_buffer = HistoryBuffer(context=context or "")
+        await self._emit(on_event, "plan", **self._plan_event_data(plan))
+        return await self._continue(agent_state, history_buffer, plan, checkpoint, on_event=on_event)
+
+    async def _resume(self, saved: Checkpoint, metrics: RunMetrics, on_event: Optional[EventCallback] = None) -> AgentState:
+        agent_state = saved.state
+        agent_state.metrics = metrics
+        await self._emit(on_event, "plan", resumed=True, **self._plan_event_data(agent_state.current_plan))
+        if saved.finished:
+            await self._emit(on_event, "answer_delta", content=agent_state.current_plan.final_answer)
+            return agent_state
+
+        logger.info(f"Resuming run {saved.run_id} from step {saved.step_count}, {len(agent_state.history)} steps done")
+        checkpoint = self._checkpoint_writer(saved.run_id)
+        checkpoint.resumed(agent_state.current_plan)
+        history_buffer = HistoryBuffer.from_records(agent_state.history, context=agent_state.context or "")
+        return await self._continue(
+            agent_state, history_buffer, saved.initial_plan, checkpoint, saved.step_count, on_event=on_event
+        )
+
+    async def _continue(
+        self,
+        agent_state: AgentState,
+        history_buffer: HistoryBuffer,
+        initial_plan: Plan,
+        checkpoint: RunCheckpoint,
+        step_count: int = 0,
+        on_event: Optional[EventCallback] = None
+    ) -> AgentState:
+        steps_since_replan = 0
+
+        while not agent_state.is_task_completed():
+            if step_count >= self.max_steps:
                 break
 
-            # 7. 交给 Replanner 判断是否需要调整计划
-            plan = self.planner.refine_plan(current_plan=plan, history=agent_state.history)
-            agent_state.current_plan = plan
+            ready_steps = agent_state.current_plan.ready_steps()
+            if not ready_steps:
+                agent_state.current_plan = await self.planner.refine_plan(
+                    current_plan=agent_state.current_plan, history=agent_state.history, context=agent_state.context
+                )
+                await self._emit(on_event, "replan", **self._plan_event_data(agent_state.current_plan))
+                steps_since_replan = 0
+                step_count += 1
+                await checkpoint.asave(agent_state, [], step_count)
+                continue
+
+            batch = ready_steps[:self.max_steps - step_count]
+            records = await self._execute_batch(batch, agent_state.history, history_buffer, on_event)
+            await self._arecord_batch(agent_state, records, history_buffer)
+            step_count += len(batch)
+            steps_since_replan += len(batch)
+            await checkpoint.asave(agent_state, records, step_count)
 
-            step_count += 1
+            if agent_state.current_plan.final_answer:
+                break
 
-        if not agent_state.current_plan.final_answer:
-            print("Max steps reached or no final answer, generating summary...")
-            final_result = self.executor.summary_final(problem, agent_state.history)
-            agent_state.current_plan.final_answer = final_result.raw_output
+            while self.replan_policy.should_replan(agent_state.current_plan, records, steps_since_replan):
+                records = await self._replan(agent_state, history_buffer, speculate=step_count < self.max_steps, on_event=on_event)
+                steps_since_replan = 0
+                if not records:
+                    await checkpoint.asave(agent_state, [], step_count)
+                    break
+                await self._arecord_batch(agent_state, records, history_buffer)
+                step_count += len(records)
+                steps_since_replan += len(records)
+                await checkpoint.asave(agent_state, records, step_count)
+                if step_count >= self.max_steps:
+                    break
 
+        if agent_state.current_plan.final_answer:
+            self._remember_plan(agent_state, initial_plan)
+            await self._emit(on_event, "answer_delta", content=agent_state.current_plan.final_answer)
+        else:
+            logger.info("Max steps reached or no final answer, generating summary...")
+            agent_state.current_plan.final_answer = await self._summarize(
+                agent_state.problem, agent_state, history_buffer, on_event
+            )
+
+        await checkpoint.afinish(agent_state, step_count)
         return agent_state
 
+    async def _summarize(
+        self,
+        problem: str,
+        agent_state: AgentState,
+        history_buffer: HistoryBuffer,
+        on_event: Optional[EventCallback]
+    ) -> Optional[str]:
+        if on_event is None:
+            final_result = await self.executor.summary_final(problem, agent_state.history, history_buffer)
+            return final_result.raw_output
+
+        # 有订阅者时流式生成，模型产出的片段立即推送
+        parts: List[str] = []
+        try:
+            with span("executor.stream_summary"):
+                async for delta in self.executor.stream_summary(problem, agent_state.history, history_buffer):
+                    parts.append(delta)
+                    await self._emit(on_event, "answer_delta", content=delta)
+        except LLMQueueTimeout:
+            raise
+        except Exception as e:
+            logger.error(f"Final summary failed: {e}")
+            return None
+        return "".join(parts) or None
+
+    async def _execute_batch(
+        self,
+        batch: List[Step],
+        history: List[StepRecord],
+        history_buffer: HistoryBuffer,
+        on_event: Optional[EventCallback] = None
+    ) -> List[StepRecord]:
+        snapshot = list(history)
+        semaphore = asyncio.Semaphore(self.max_parallel_steps)
+
+        async def execute_one(step: Step) -> StepResult:
+            async with semaphore:
+                await self._emit(on_event, "step_started", **self._step_event_data(step))
+                result = await self.executor.execute_step(step=step, history=snapshot, history_buffer=history_buffer)
+            self._apply_result(step, result)
+            await self._emit(on_event, "step_finished", **self._step_event_data(step, result))
+            return result
+
+        # gather 保证返回顺序与 batch 一致
+        results = await asyncio.gather(*[execute_one(step) for step in batch])
+        return [_step_record(step, result) for step, result in zip(batch, results)]
+
+    async def _replan(
+        self,
+        agent_state: AgentState,
+        history_buffer: HistoryBuffer,
+        speculate: bool = True,
+        on_event: Optional[EventCallback] = None
+    ) -> List[StepRecord]:
+        candidate = self._speculation_candidate(agent_state) if self.speculative and speculate else None
+        if candidate is None:
+            agent_state.current_plan = await self.planner.refine_plan(
+                current_plan=agent_state.current_plan, history=agent_state.history, context=agent_state.context
+            )
+            await self._emit(on_event, "replan", **self._plan_event_data(agent_state.current_plan))
+            return []
+
+        snapshot = list(agent_state.history)
+        speculation = asyncio.create_task(
+            self.executor.execute_step(step=candidate, history=snapshot, history_buffer=history_buffer)
+        )
+        try:
+            agent_state.current_plan = await self.planner.refine_plan(
+                current_plan=agent_state.current_plan, history=agent_state.history, context=agent_state.context
+            )
+        finally:
+            result = await speculation
+        await self._emit(on_event, "replan", **self._plan_event_data(agent_state.current_plan))
+
+        records = self._resolve_speculation(agent_state, candidate, result)
+        for record in records:
+            await self._emit(on_event, "step_finished", speculative=True, **self._step_event_data(record.step, record.result))
+        return records
+
+    async def _emit(self, on_event: Optional[EventCallback], event_type: str, **data):
+        if on_event is None:
+            return
+        try:
+            await on_event(AgentEvent(type=event_type, data=data))
+        except Exception as e:
+            # 事件推送失败不影响 Agent 运行
+            logger.warning(f"Failed to emit {event_type} event: {e}")
+
+    def _plan_event_data(self, plan: Plan) -> Dict[str, Any]:
+        return {
+            "steps": [
+                {
+                    "id": step.id,
+                    "description": step.description,
+                    "action_type": step.action_type,
+                    "tool_name": step.tool_name,
+                    "status": step.status.value,
+                    "depends_on": step.depends_on,
+                }
+                for step in plan.steps
+            ],
+            "has_final_answer": plan.final_answer is not None,
+        }
+
+    def _step_event_data(self, step: Step, result: Optional[StepResult] = None) -> Dict[str, Any]:
+        data: Dict[str, Any] = {
+            "step_id": step.id,
+            "description": step.description,
+            "action_type": step.action_type,
+            "tool_name": step.tool_name,
+        }
+        if result is not None:
+            output = result.raw_output or ""
+            data.update(
+                is_success=result.is_success,
+                output=output[:self.event_preview_chars],
+                truncated=len(output) > self.event_preview_chars,
+                error_message=result.error_message,
+            )
+        return data
+
 if __name__ == "__main__":
     agent = AgentManager(max_steps=10)
     agent_status = agent.run(problem="25考研软微的复试分数线是多少?")
@@ -0,0 +1,120 @@
+"""
+任务级的对话记忆
+同一任务的后续提问需要参考之前的对话，避免重复检索已经得到的信息：
+- 最近 window 条消息保留原文
+- 滑出窗口的更早消息逐条压缩为一行摘要，追加到滚动摘要中（增量更新，不重新处理已有消息）
+- render 按 token 预算拼接：优先保留最近的原文，剩余预算留给摘要，结果缓存到下一次更新
+"""
+import threading
+from collections import deque
+from string import Template
+from typing import Deque, Iterable, List, Optional, Tuple
+
+from agent.history import estimate_tokens
+from core.config import settings
+
+CONVERSATION_CONTEXT = Template(
+    "## 之前的对话\n"
+    "以下是同一任务中之前的对话，其中已经获得的信息可以直接使用，无需重复检索\n"
+    "${context}\n\n"
+)
+
+_ROLE_NAMES = {"user": "用户", "assistant": "助手"}
+
+
+def render_context(context: Optional[str]) -> str:
+    """把对话记忆渲染为放在 user 消息开头的上下文段落，没有记忆时为空字符串"""
+    if not context:
+        return ""
+    return CONVERSATION_CONTEXT.substitute(context=context)
+
+
+class ConversationMemory:
+    """单个任务的对话记忆：最近若干条消息原文 + 更早消息的滚动摘要"""
+    def __init__(
+        self,
+        window: Optional[int] = None,
+        token_budget: Optional[int] = None,
+        brief_chars: Optional[int] = None,
+        max_summary_lines: Optional[int] = None
+    ):
+        """
+        :param window: 保留原文的最近消息数
+        :param token_budget: 渲染结果的 token 预算
+        :param brief_chars: 摘要中每条消息保留的字符数
+        :param max_summary_lines: 滚动摘要最多保留的行数，超出时丢弃最早的行
+        """
+        self.window = max(1, window if window is not None else settings.memory_window_messages)
+        self.token_budget = token_budget if token_budget is not None else settings.memory_token_budget
+        self.brief_chars = brief_chars if brief_chars is not None else settings.memory_brief_chars
+        max_lines = max_summary_lines if max_summary_lines is not None else settings.memory_max_summary_lines
+
+        # 已并入记忆的最后一条消息ID，下次只需加载之后的消息
+        self.last_id = 0
+        self._recent: Deque[Tuple[str, str]] = deque()
+        self._summary: Deque[str] = deque(maxlen=max(1, max_lines))
+        self._rendered: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._recent) + len(self._summary)
+
+    def extend(self, messages: Iterable[Tuple[int, str, str]]):
+        """
+        按时间顺序追加消息
+        :param messages: (消息ID, 角色, 内容) 序列，ID 不大于 last_id 的消息会被忽略
+        """
+        with self._lock:
+            for message_id, role, content in messages:
+                if message_id <= self.last_id:
+                    continue
+                self.last_id = message_id
+                self._recent.append((role, content))
+                while len(self._recent) > self.window:
+                    self._summary.append(self._brief(*self._recent.popleft()))
+                self._rendered = None
+
+    def render(self) -> str:
+        """按 token 预算渲染记忆，没有任何消息时返回空字符串"""
+        with self._lock:
+            if self._rendered is None:
+                self._rendered = self._render()
+            return self._rendered
+
+    def _brief(self, role: str, content: str) -> str:
+        text = " ".join(content.split())
+        if len(text) > self.brief_chars:
+            text = f"{text[:self.brief_chars]}..."
+        return f"- {_ROLE_NAMES.get(role, role)}: {text}"
+
+    def _render(self) -> str:
+        remaining = self.token_budget
+        recent: List[str] = []
+        # 从最新的消息向前拼接原文，放不下时改用摘要形式
+        for role, content in reversed(self._recent):
+            text = f"{_ROLE_NAMES.get(role, role)}: {content}"
+            tokens = estimate_tokens(text)
+            if tokens > remaining:
+                text = self._brief(role, content)[2:]
+                tokens = estimate_tokens(text)
+                if tokens > remaining:
+                    break
+            recent.append(text)
+            remaining -= tokens
+        recent.reverse()
+
+        summary: List[str] = []
+        for line in reversed(self._summary):
+            tokens = estimate_tokens(line)
+            if tokens > remaining:
+                break
+            summary.append(line)
+            remaining -= tokens
+        summary.reverse()
+
+        parts = []
+        if summary:
+            parts.append("较早对话摘要：\n" + "\n".join(summary))
+        if recent:
+            parts.append("最近对话：\n" + "\n".join(recent))
+        return "\n\n".join(parts)
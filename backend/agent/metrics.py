@@ -0,0 +1,320 @@
+"""
+LLM 与工具调用的计量
+每次 LLM / 工具调用按角色记录耗时与 token 用量，同时累加到两处：
+- 进程级的 Prometheus 风格指标（计数器 + 直方图），由 /metrics 接口导出
+- 当前运行的 RunMetrics（通过 contextvars 绑定，线程池与协程中同样生效）
+"""
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from agent.schema import CallStats, RunMetrics
+
+# LLM 调用角色
+ROLE_PLAN = "plan"
+ROLE_REPLAN = "replan"
+ROLE_TOOL_ARGS = "tool-args"
+ROLE_LLM_STEP = "llm-step"
+ROLE_SUMMARY = "summary"
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: LabelValues, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Counter:
+    """单调递增的计数器，按标签值分别计数"""
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(Counter):
+    """可增可减的瞬时值"""
+    type_name = "gauge"
+
+    def set(self, value: float, **labels: str):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram:
+    """累积分桶的直方图，额外记录总和与次数"""
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 标签值 -> (各桶计数, 总和, 次数)
+        self._values: Dict[LabelValues, Tuple[List[int], float, int]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            if index < len(counts):
+                counts[index] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', _format_value(bound)))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', '+Inf'))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """进程内指标注册表，按 Prometheus 文本格式导出"""
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines: List[str] = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+LLM_REQUESTS = registry.counter(
+    "planflow_llm_requests_total", "LLM 调用次数", ("role", "model", "status")
+)
+LLM_TOKENS = registry.counter(
+    "planflow_llm_tokens_total", "LLM 消耗的 token 数", ("role", "model", "kind")
+)
+LLM_LATENCY = registry.histogram(
+    "planflow_llm_request_duration_seconds", "LLM 调用耗时（秒）", ("role", "model")
+)
+LLM_PROMPT_TOKENS = registry.histogram(
+    "planflow_llm_prompt_tokens", "单次 LLM 调用的 prompt token 数", ("role",), buckets=TOKEN_BUCKETS
+)
+LLM_ESCALATIONS = registry.counter(
+    "planflow_llm_escalations_total", "输出校验失败后改用更强模型重试的次数", ("role", "from_model", "to_model")
+)
+TOOL_CALLS = registry.counter(
+    "planflow_tool_calls_total", "工具调用次数", ("tool", "status")
+)
+TOOL_ARGS_REUSED = registry.counter(
+    "planflow_tool_args_reused_total", "直接使用 Planner 参数、跳过参数生成 LLM 调用的次数", ("tool",)
+)
+TOOL_LATENCY = registry.histogram(
+    "planflow_tool_call_duration_seconds", "工具调用耗时（秒）", ("tool",)
+)
+AGENT_RUNS = registry.counter(
+    "planflow_agent_runs_total", "Agent 运行次数", ("status",)
+)
+
+# 当前运行的统计对象，由 AgentManager 在运行开始时绑定
+_current_run: contextvars.ContextVar[Optional[RunMetrics]] = contextvars.ContextVar("planflow_run_metrics", default=None)
+# 同一运行的并行步骤会在多个线程中同时累加
+_run_lock = threading.Lock()
+
+
+@contextmanager
+def bind_run_metrics(metrics: RunMetrics) -> Iterator[RunMetrics]:
+    """在当前上下文中绑定本次运行的统计对象，退出时恢复"""
+    token = _current_run.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current_run.reset(token)
+
+
+def current_run_metrics() -> Optional[RunMetrics]:
+    return _current_run.get()
+
+
+def _accumulate(
+    stats: CallStats,
+    latency: float,
+    success: bool,
+    cached: bool,
+    prompt_tokens: int,
+    completion_tokens: int,
+    cached_prompt_tokens: int = 0
+):
+    stats.calls += 1
+    stats.errors += 0 if success else 1
+    stats.cache_hits += 1 if cached else 0
+    stats.latency_seconds += latency
+    stats.prompt_tokens += prompt_tokens
+    stats.completion_tokens += completion_tokens
+    stats.cached_prompt_tokens += cached_prompt_tokens
+
+
+def record_llm_call(
+    role: str,
+    model: str,
+    latency: float,
+    prompt_tokens: int = 0,
+    completion_tokens: int = 0,
+    success: bool = True,
+    cached: bool = False,
+    cached_prompt_tokens: int = 0
+):
+    """
+    记录一次 LLM 调用（含缓存命中）
+    :param cached: 是否命中本地响应缓存（未发起请求）
+    :param cached_prompt_tokens: prompt 中命中模型服务端前缀缓存的 token 数
+    """
+    status = "cached" if cached else ("success" if success else "error")
+    LLM_REQUESTS.inc(role=role, model=model, status=status)
+    if not cached:
+        LLM_LATENCY.observe(latency, role=role, model=model)
+    if prompt_tokens or completion_tokens:
+        LLM_TOKENS.inc(prompt_tokens, role=role, model=model, kind="prompt")
+        LLM_TOKENS.inc(completion_tokens, role=role, model=model, kind="completion")
+        LLM_PROMPT_TOKENS.observe(prompt_tokens, role=role)
+    if cached_prompt_tokens:
+        LLM_TOKENS.inc(cached_prompt_tokens, role=role, model=model, kind="cached_prompt")
+
+    metrics = _current_run.get()
+    if metrics is None:
+        return
+    with _run_lock:
+        metrics.llm_calls += 1
+        metrics.llm_latency_seconds += latency
+        metrics.prompt_tokens += prompt_tokens
+        metrics.completion_tokens += completion_tokens
+        metrics.cached_prompt_tokens += cached_prompt_tokens
+        stats = metrics.llm_by_role.setdefault(role, CallStats())
+        _accumulate(stats, latency, success, cached, prompt_tokens, completion_tokens, cached_prompt_tokens)
+
+
+def record_llm_escalation(role: str, from_model: str, to_model: str):
+    """记录一次模型升级重试"""
+    LLM_ESCALATIONS.inc(role=role, from_model=from_model, to_model=to_model)
+
+    metrics = _current_run.get()
+    if metrics is None:
+        return
+    with _run_lock:
+        metrics.llm_escalations += 1
+
+
+def record_tool_call(tool: str, latency: float, success: bool = True):
+    """记录一次工具调用"""
+    TOOL_CALLS.inc(tool=tool, status="success" if success else "error")
+    TOOL_LATENCY.observe(latency, tool=tool)
+
+    metrics = _current_run.get()
+    if metrics is None:
+        return
+    with _run_lock:
+        metrics.tool_calls += 1
+        metrics.tool_latency_seconds += latency
+        stats = metrics.tools.setdefault(tool, CallStats())
+        _accumulate(stats, latency, success, False, 0, 0)
+
+
+def record_tool_args_reused(tool: str):
+    """记录一次直接使用 Planner 参数调用工具"""
+    TOOL_ARGS_REUSED.inc(tool=tool)
+
+    metrics = _current_run.get()
+    if metrics is None:
+        return
+    with _run_lock:
+        metrics.tool_args_reused += 1
+
+
+@contextmanager
+def track_tool_call(tool: str) -> Iterator[None]:
+    """计时包裹一次工具调用，抛出异常时记为失败"""
+    started = time.perf_counter()
+    success = False
+    try:
+        yield
+        success = True
+    finally:
+        record_tool_call(tool, time.perf_counter() - started, success)
+
+
+def usage_tokens(usage) -> Tuple[int, int]:
+    """从 OpenAI 响应的 usage 字段中取出 (prompt_tokens, completion_tokens)，缺失时为 0"""
+    if usage is None:
+        return 0, 0
+    return getattr(usage, "prompt_tokens", 0) or 0, getattr(usage, "completion_tokens", 0) or 0
+
+
+def usage_cached_tokens(usage) -> int:
+    """从 usage.prompt_tokens_details.cached_tokens 中取出命中前缀缓存的 prompt token 数，缺失时为 0"""
+    details = getattr(usage, "prompt_tokens_details", None) if usage is not None else None
+    return getattr(details, "cached_tokens", 0) or 0
+
+
+def render_metrics() -> str:
+    return registry.render()
@@ -0,0 +1,197 @@
+"""
+大步骤输出的外置存储
+超过 output_inline_chars 的步骤输出按内容哈希写入本地 blob 存储（相同内容只写一次），
+内存中的 StepResult 只保留引用、原文长度与截断预览。
+执行历史、重规划 Prompt 与检查点都只序列化预览，需要原文的 Prompt 构建方调用 StepResult.full_output() 按需读取。
+运行的检查点被删除时一并删除它引用的 blob；其余 blob 超过保留时间后由写入触发定期清理。
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional
+
+from agent.serialization import dumps, loads
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_REF = re.compile(r"^[0-9a-f]{64}$")
+
+
+class OutputNotFound(Exception):
+    """引用的输出不存在（已被清理或存储目录不同）"""
+
+
+class OutputStore:
+    """基于本地文件的内容寻址存储，blob 按哈希前两位分目录存放"""
+    def __init__(
+        self,
+        directory: str,
+        inline_chars: int = 4000,
+        preview_chars: int = 500,
+        max_age: Optional[float] = None,
+        prune_interval: float = 600
+    ):
+        """
+        :param directory: 存储目录
+        :param inline_chars: 输出不超过该长度时保留在内存中
+        :param preview_chars: 外置输出在内存中保留的预览长度
+        :param max_age: blob 保留时间（秒），None 表示不自动清理
+        :param prune_interval: 两次自动清理之间的最小间隔（秒）
+        """
+        self.directory = directory
+        self.inline_chars = inline_chars
+        self.preview_chars = preview_chars
+        self.max_age = max_age
+        self.prune_interval = prune_interval
+        self._stats = {"offloaded": 0, "written": 0, "bytes_written": 0, "loads": 0, "deleted": 0}
+        self._lock = threading.Lock()
+        self._prune_lock = threading.Lock()
+        self._next_prune = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, ref: str) -> str:
+        return os.path.join(self.directory, ref[:2], ref)
+
+    def put(self, payload: Dict[str, Any]) -> str:
+        """写入一个 blob 并返回其引用；相同内容已存在时只刷新修改时间"""
+        data = dumps(payload, sort_keys=True).encode("utf-8")
+        ref = hashlib.sha256(data).hexdigest()
+        path = self._path(ref)
+        if os.path.exists(path):
+            os.utime(path)
+            return ref
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写临时文件再原子替换，避免并发读到写了一半的 blob
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._stats["written"] += 1
+            self._stats["bytes_written"] += len(data)
+        self._maybe_prune()
+        return ref
+
+    def get(self, ref: str) -> Dict[str, Any]:
+        """
+        读取 blob
+        :raises OutputNotFound: blob 不存在
+        """
+        if not _REF.match(ref):
+            raise OutputNotFound(f"非法的输出引用: {ref}")
+        try:
+            with open(self._path(ref), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            raise OutputNotFound(f"输出 {ref} 不存在")
+        with self._lock:
+            self._stats["loads"] += 1
+        return loads(data)
+
+    def offload(self, result: Any) -> bool:
+        """
+        输出超过 inline_chars 时把原文与结构化输出移入存储，result 就地改为引用 + 预览
+        :param result: StepResult
+        :return: 是否外置
+        """
+        raw_output = result.raw_output
+        if result.output_ref is not None or raw_output is None or len(raw_output) <= self.inline_chars:
+            return False
+        try:
+            ref = self.put({"raw_output": raw_output, "structured_output": result.structured_output})
+        except OSError as e:
+            # 写入失败时保留原文，不影响运行
+            logger.warning(f"写入步骤输出失败，保留在内存中: {e}")
+            return False
+
+        result.output_ref = ref
+        result.output_size = len(raw_output)
+        result.raw_output = f"{raw_output[:self.preview_chars]}...(已截断，原文共{len(raw_output)}字)"
+        result.structured_output = None
+        with self._lock:
+            self._stats["offloaded"] += 1
+        return True
+
+    def delete(self, refs: Iterable[str]):
+        """删除指定的 blob，不存在的引用直接跳过"""
+        deleted = 0
+        for ref in refs:
+            if not _REF.match(ref):
+                continue
+            try:
+                os.remove(self._path(ref))
+                deleted += 1
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                logger.warning(f"删除输出 {ref} 失败: {e}")
+        with self._lock:
+            self._stats["deleted"] += deleted
+
+    def _maybe_prune(self):
+        """距上次清理超过 prune_interval 时清理过期的 blob，同一时间只有一个线程执行清理"""
+        if self.max_age is None or time.monotonic() < self._next_prune:
+            return
+        if not self._prune_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_prune = time.monotonic() + self.prune_interval
+            self.prune(self.max_age)
+        finally:
+            self._prune_lock.release()
+
+    def prune(self, max_age: float):
+        """删除超过保留时间未被写入或引用的 blob"""
+        deadline = time.time() - max_age
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if os.path.getmtime(path) < deadline:
+                        os.remove(path)
+                except OSError:
+                    continue
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["inline_chars"] = self.inline_chars
+        return stats
+
+
+_store: Optional[OutputStore] = None
+_store_lock = threading.Lock()
+
+
+def get_output_store() -> Optional[OutputStore]:
+    """获取进程内共享的输出存储，未启用时返回 None"""
+    global _store
+    if not settings.output_store_enabled:
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = OutputStore(
+                    settings.output_store_dir,
+                    inline_chars=settings.output_inline_chars,
+                    preview_chars=settings.output_preview_chars,
+                    max_age=settings.output_store_retention_hours * 3600,
+                    prune_interval=settings.output_store_prune_interval
+                )
+    return _store
+
+
+def load_output(ref: str) -> Dict[str, Any]:
+    """
+    按引用读取外置的步骤输出
+    :raises OutputNotFound: 存储未启用或 blob 不存在
+    """
+    store = get_output_store()
+    if store is None:
+        raise OutputNotFound(f"未启用输出存储，无法读取 {ref}")
+    return store.get(ref)
@@ -0,0 +1,160 @@
+"""
+同形态目标的计划缓存
+对成功完成的目标按“形态”建立索引，新目标与已有目标形态完全相同时直接复用其计划步骤，省去一次规划 LLM 调用。
+
+形态 = 去掉空白与标点、转小写、数字替换为占位符后的目标文本，
+“2023 年 xx 比分”与“2024 年 xx 比分”视为同一形态，命中后按新旧目标中数字的对应关系替换步骤描述与 tool_args 中的数字。
+除数字以外的任何字符不同（如“北京市”与“上海市”）都不会命中：步骤与 tool_args 中的实体无法可靠替换，
+而 Planner 给出的 tool_args 会被直接用于调用工具。
+"""
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from agent.metrics import current_run_metrics, registry
+from agent.schema import Plan, StepStatus
+from agent.serialization import trusted_step
+from core.config import settings
+
+PLAN_CACHE_LOOKUPS = registry.counter(
+    "planflow_plan_cache_lookups_total", "计划缓存查询次数", ("result",)
+)
+
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+_IGNORED = re.compile(r"[\s　,，.。!！?？:：;；、\"'“”‘’()（）\[\]【】<>《》]+")
+_NUMBER_PLACEHOLDER = "#"
+
+
+def goal_shape(goal: str) -> Tuple[str, List[str]]:
+    """
+    归一化目标文本：去掉空白与标点、转小写，数字替换为占位符
+    :return: (形态字符串, 按出现顺序排列的数字)
+    """
+    text = _IGNORED.sub("", goal.lower())
+    return _NUMBER.sub(_NUMBER_PLACEHOLDER, text), _NUMBER.findall(text)
+
+
+def _replace_numbers(value: Any, mapping: Dict[str, str]) -> Any:
+    if isinstance(value, str):
+        return _NUMBER.sub(lambda m: mapping.get(m.group(0), m.group(0)), value)
+    if isinstance(value, dict):
+        return {key: _replace_numbers(item, mapping) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_replace_numbers(item, mapping) for item in value]
+    return value
+
+
+class _Entry:
+    __slots__ = ("goal", "shape", "numbers", "steps")
+
+    def __init__(self, goal: str, shape: str, numbers: List[str], steps: List[Dict[str, Any]]):
+        self.goal = goal
+        self.shape = shape
+        self.numbers = numbers
+        self.steps = steps
+
+
+class PlanCache:
+    """
+    线程安全的计划缓存，按目标形态去重，超过容量时淘汰最久未命中的条目
+    """
+    def __init__(self, max_entries: int = 512):
+        """
+        :param max_entries: 最多缓存的目标形态数
+        """
+        self.max_entries = max(1, max_entries)
+
+        self._lock = threading.Lock()
+        # 形态 -> 条目，按最近使用排序
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def lookup(self, goal: str) -> Optional[Plan]:
+        """
+        查找形态相同的已缓存计划
+        :return: 替换数字后的新计划（步骤均为 PENDING），未命中时返回 None
+        """
+        shape, numbers = goal_shape(goal)
+        with self._lock:
+            match = self._match(shape, numbers)
+            if match is None:
+                self._stats["misses"] += 1
+            else:
+                self._stats["hits"] += 1
+                self._entries.move_to_end(shape)
+        PLAN_CACHE_LOOKUPS.inc(result="miss" if match is None else "hit")
+        if match is None:
+            return None
+
+        entry, mapping = match
+        metrics = current_run_metrics()
+        if metrics is not None:
+            metrics.plan_cache_hits += 1
+        # 缓存的步骤已校验过，替换数字后直接构造；status 是 str 枚举，替换时会变成普通字符串，需重新设置
+        steps = [trusted_step({**_replace_numbers(data, mapping), "status": StepStatus.PENDING}) for data in entry.steps]
+        return Plan(steps=steps, original_goal=goal, source="cache")
+
+    def add(self, goal: str, plan: Plan):
+        """记录一个成功完成的目标及其计划，同一形态的目标只保留最新的计划"""
+        shape, numbers = goal_shape(goal)
+        if not shape or not plan.steps:
+            return
+        steps = [{**step.model_dump(), "status": StepStatus.PENDING} for step in plan.steps]
+        entry = _Entry(goal, shape, numbers, steps)
+        with self._lock:
+            self._entries.pop(shape, None)
+            self._entries[shape] = entry
+            self._stats["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
+
+    def _match(self, shape: str, numbers: List[str]) -> Optional[Tuple[_Entry, Dict[str, str]]]:
+        """形态完全相同且数字可以一一对应时命中，结果与缓存中的其他条目无关"""
+        entry = self._entries.get(shape)
+        if entry is None:
+            return None
+        mapping = self._number_mapping(entry.numbers, numbers)
+        if mapping is None:
+            return None
+        return entry, mapping
+
+    @staticmethod
+    def _number_mapping(old: List[str], new: List[str]) -> Optional[Dict[str, str]]:
+        """旧目标数字到新目标数字的映射；数量不同或同一个旧数字对应多个新数字时无法替换，返回 None"""
+        if len(old) != len(new):
+            return None
+        mapping: Dict[str, str] = {}
+        for before, after in zip(old, new):
+            if mapping.setdefault(before, after) != after:
+                return None
+        return {before: after for before, after in mapping.items() if before != after}
+
+
+_plan_cache: Optional[PlanCache] = None
+_plan_cache_lock = threading.Lock()
+
+
+def get_plan_cache() -> Optional[PlanCache]:
+    """获取进程内共享的计划缓存，未启用时返回 None"""
+    global _plan_cache
+    if not settings.plan_cache_enabled:
+        return None
+    if _plan_cache is None:
+        with _plan_cache_lock:
+            if _plan_cache is None:
+                _plan_cache = PlanCache(max_entries=settings.plan_cache_max_entries)
+    return _plan_cache
@@ -2,183 +2,331 @@
 planner负责初步的任务规划和分解。
 replanner负责在任务执行过程中根据反馈进行动态调整。
 """
-import json
 import logging
-import os
-from string import Template
 from typing import List, Optional, Dict, Any, Callable
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 
+from agent.concurrency import LLMQueueTimeout
+from agent.llm import achat_completion, chat_completion, get_async_llm_client, get_llm_client
+from agent.memory import render_context
+from agent.metrics import ROLE_PLAN, ROLE_REPLAN
+from agent.plan_cache import get_plan_cache
+from agent.registry import ToolRegistry
+from agent.routing import acall_with_escalation, call_with_escalation, get_model_policy
+from agent.tracing import span
 from agent.schema import StepStatus, Step, Plan, StepRecord
+from agent.serialization import JSONDecodeError, history_json, loads_object, plan_json, refined_steps
 # from core.config import settings
 # from schema import Plan, Step
-from agent.prompts import PLANNER_SYSTEM_PROMPT_TEMPLATE, REPLANNER_SYSTEM_PROMPT_TEMPLATE
+from agent.prompts import PLANNER_SYSTEM_PROMPT, REPLANNER_INPUT, REPLANNER_SYSTEM_PROMPT
 
 logger = logging.getLogger(__name__)
 
 class Planner:
-    def __init__(self, tools: Optional[List[Callable]] = None):
+    def __init__(self, tools: Optional[List[Callable]] = None, registry: Optional[ToolRegistry] = None):
         # 初始化LLM客户端
         # 这里假设使用OpenAI兼容的接口，你可以根据实际情况调整
-        self.client = OpenAI(
-            api_key=os.getenv('DASHSCOPE_API_KEY'),
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1" # 示例URL
-        )
-        self.model = "qwen-plus" # 示例模型
+        self.client = self._create_client()
+        # 按角色选择模型（初始规划 / 重规划），见 core.config 中的 llm_role_models
+        self.models = get_model_policy()
+        # 同形态目标（只有数字不同）的计划缓存，未启用时为 None
+        self.plan_cache = get_plan_cache()
+
+        # 可调用工具的注册表，未传入时由 tools 列表构建
+        self.registry = registry if registry is not None else ToolRegistry(tools)
 
-        # 加载可调用工具列表
-        self.tools = {func.__name__: func for func in tools}
+    def _create_client(self) -> OpenAI:
+        # 所有实例共享进程级客户端及其连接池
+        return get_llm_client()
 
-    def create_initial_plan(self, goal: str) -> Plan:
+    def create_initial_plan(self, goal: str, context: Optional[str] = None) -> Plan:
         """
         根据用户目标创建初始计划
         :param goal: 用户输入的原始目标
+        :param context: 同一任务之前的对话记忆，后续提问时提供
         :return: 包含步骤列表的Plan对象
         """
         logger.info(f"正在为目标创建初始计划: {goal}")
-        
-        # 1. 准备工具描述
-        tool_list_str = "\n".join([f"- {name}: {func.__doc__}" for name, func in self.tools.items()])
-        
-        # 2. 填充 Prompt
-        system_prompt = Template(PLANNER_SYSTEM_PROMPT_TEMPLATE).safe_substitute(
-            tool_list=tool_list_str
-        )
+        with span("planner.create_initial_plan") as current:
+            plan = self._cached_plan(goal, context)
+            if plan is not None:
+                current.set_attribute("plan_cache", "hit")
+                current.set_attribute("steps", len(plan.steps))
+                return plan
 
-        messages = [
-            {"role":"system", "content": system_prompt},
-            {"role":"user", "content": goal}
-        ]
-        try:
-            response = self._call_llm(messages)
-            print(f"初次调用得到的计划JSON格式：{response}")
-
-            plan_data = self._parse_json_response(response)
-            
-            steps = []
-            for step_data in plan_data.get("steps", []):
-                steps.append(Step(
-                    id=step_data["id"],
-                    description=step_data["description"],
-                    status=StepStatus.PENDING,
-                    action_type=step_data["action_type"],
-                    tool_name=step_data.get("tool_name"),
-                    tool_args=step_data.get("tool_args")
-                ))
-
-            print(f"转化后的steps为：{steps}")
-
-            return Plan(steps=steps, original_goal=goal)
-            
-        except Exception as e:
-            logger.error(f"创建初始计划失败: {e}")
-            # 发生错误时返回一个简单的单步计划作为兜底
-            return Plan(
-                steps=[Step(id=1, description=f"直接尝试解决问题: {goal}", status="pending")],
-                original_goal=goal
-            )
+            messages = self._build_initial_messages(goal, context)
+            try:
+                plan = call_with_escalation(
+                    self.models, ROLE_PLAN,
+                    lambda model, parse: self._call_llm(messages, role=ROLE_PLAN, model=model, parse=parse),
+                    lambda response: self._build_initial_plan(goal, response)
+                )
+            except LLMQueueTimeout:
+                # 等待 LLM 并发名额超时说明服务过载，不当作普通的调用失败处理，交给接口层返回 429
+                raise
+            except Exception as e:
+                logger.error(f"创建初始计划失败: {e}")
+                current.set_attribute("fallback", True)
+                plan = self._fallback_plan(goal)
+            current.set_attribute("steps", len(plan.steps))
+            return plan
 
-    def refine_plan(self, current_plan: Plan, history:Optional[List[StepRecord]] = None) -> Plan:
+    def refine_plan(
+        self,
+        current_plan: Plan,
+        history: Optional[List[StepRecord]] = None,
+        context: Optional[str] = None
+    ) -> Plan:
         """
         根据执行反馈重规划任务
         :param current_plan: 当前计划
         :param history: 执行历史记录
+        :param context: 同一任务之前的对话记忆
         :return: 新的计划
         """
         logger.info(f"正在根据反馈调整计划: {current_plan.original_goal}")
-        if history is None:
-            history = []
+        with span("planner.refine_plan", history_steps=len(history or [])) as current:
+            messages = self._build_refine_messages(current_plan, history or [], context)
+            try:
+                return call_with_escalation(
+                    self.models, ROLE_REPLAN,
+                    lambda model, parse: self._call_llm(messages, role=ROLE_REPLAN, model=model, parse=parse),
+                    lambda response: self._build_refined_plan(current_plan, response)
+                )
+            except LLMQueueTimeout:
+                raise
+            except Exception as e:
+                logger.error(f"重规划失败: {e}")
+                current.set_attribute("failed", True)
+                return current_plan
+
+    def _cached_plan(self, goal: str, context: Optional[str] = None) -> Optional[Plan]:
+        """
+        形态相同的目标的计划可以直接复用时返回该计划，省去规划调用
+        带有对话记忆的后续提问依赖上下文，不使用计划缓存
+        """
+        if self.plan_cache is None or context:
+            return None
+        plan = self.plan_cache.lookup(goal)
+        if plan is not None:
+            logger.info(f"命中计划缓存，复用 {len(plan.steps)} 个步骤: {goal}")
+        return plan
+
+    def remember_plan(self, goal: str, plan: Plan):
+        """
+        记录一次成功运行的初始计划，供之后形态相同的目标复用
+        规划失败时的兜底计划不记录
+        """
+        if self.plan_cache is None or plan.source == "fallback":
+            return
+        self.plan_cache.add(goal, plan)
+
+    def _tool_list_str(self) -> str:
+        # 注册表缓存了渲染好的工具列表，工具变更前不会重新拼接
+        return self.registry.tool_list_prompt()
+
+    def _build_initial_messages(self, goal: str, context: Optional[str] = None) -> List[Dict[str, str]]:
+        # 1. 准备工具描述
+        tool_list_str = self._tool_list_str()
+
+        # 2. 填充 Prompt：system 只含静态指令与工具列表，用户目标放在 user 消息中
+        system_prompt = PLANNER_SYSTEM_PROMPT.safe_substitute(
+            tool_list=tool_list_str
+        )
+
+        return [
+            {"role":"system", "content": system_prompt},
+            {"role":"user", "content": render_context(context) + goal}
+        ]
+
+    def _build_initial_plan(self, goal: str, response: str) -> Plan:
+        logger.debug(f"初次调用得到的计划JSON格式：{response}")
+
+        plan_data = self._parse_json_response(response)
 
+        steps = []
+        for step_data in self._step_items(plan_data):
+            steps.append(Step(
+                id=step_data["id"],
+                description=step_data["description"],
+                status=StepStatus.PENDING,
+                action_type=step_data["action_type"],
+                tool_name=step_data.get("tool_name"),
+                tool_args=step_data.get("tool_args"),
+                depends_on=step_data.get("depends_on"),
+                decision_point=bool(step_data.get("decision_point", False))
+            ))
+
+        logger.debug(f"转化后的steps为：{steps}")
+
+        return Plan(steps=steps, original_goal=goal)
+
+    def _fallback_plan(self, goal: str) -> Plan:
+        """发生错误时返回一个简单的单步计划作为兜底"""
+        return Plan(
+            steps=[Step(id=1, description=f"直接尝试解决问题: {goal}", status=StepStatus.PENDING, action_type="LLM")],
+            original_goal=goal,
+            source="fallback"
+        )
+
+    def _build_refine_messages(
+        self,
+        current_plan: Plan,
+        history: List[StepRecord],
+        context: Optional[str] = None
+    ) -> List[Dict[str, str]]:
         # 1. 准备上下文
-        tool_list_str = "\n".join([f"- {name}: {func.__doc__}" for name, func in self.tools.items()])
-        
-        # 序列化当前计划和历史 (兼容 Pydantic v1/v2)
-        try:
-            current_plan_str = current_plan.model_dump_json()
-            history_str = json.dumps([h.model_dump() for h in history], ensure_ascii=False)
-        except AttributeError:
-            current_plan_str = current_plan.json()
-            history_str = json.dumps([h.dict() for h in history], ensure_ascii=False)
-
-        # 2. 填充 Prompt
-        system_prompt = Template(REPLANNER_SYSTEM_PROMPT_TEMPLATE).safe_substitute(
-            tool_list=tool_list_str,
-            current_plan=current_plan_str,
-            execution_history=history_str
+        tool_list_str = self._tool_list_str()
+
+        # 序列化当前计划和历史：每条记录的 JSON 片段只生成一次，之后的重规划直接拼接
+        current_plan_str = plan_json(current_plan)
+        history_str = history_json(history)
+
+        # 2. 填充 Prompt：system 与 Planner 一样保持静态，计划与历史放在 user 消息中
+        # 历史记录只追加不修改，放在每次都会变化的当前计划之前，连续重规划可共享更长的前缀
+        system_prompt = REPLANNER_SYSTEM_PROMPT.safe_substitute(
+            tool_list=tool_list_str
+        )
+        user_prompt = REPLANNER_INPUT.safe_substitute(
+            original_goal=current_plan.original_goal,
+            execution_history=history_str,
+            current_plan=current_plan_str
         )
 
-        messages = [
+        return [
             {"role": "system", "content": system_prompt},
-            {"role": "user", "content": f"请根据执行情况调整计划。目标：{current_plan.original_goal}"}
+            {"role": "user", "content": render_context(context) + user_prompt}
         ]
 
-        try:
-            response = self._call_llm(messages)
-            print(f"重规划调用得到的计划JSON格式：{response}")
+    def _build_refined_plan(self, current_plan: Plan, response: str) -> Plan:
+        logger.debug(f"重规划调用得到的计划JSON格式：{response}")
 
-            plan_data = self._parse_json_response(response)
+        plan_data = self._parse_json_response(response)
 
-            if plan_data.get("final_answer"):
-                return Plan(
-                    steps=current_plan.steps,
-                    original_goal=current_plan.original_goal,
-                    final_answer=plan_data.get("final_answer")
-                )
-            
-            new_steps = []
-            # 建立旧步骤的查找表 (id -> step)
-            old_steps_map = {s.id: s for s in current_plan.steps}
-
-            for step_data in plan_data.get("steps", []):
-                step_id = step_data["id"]
-                
-                # 默认状态为 PENDING
-                status = StepStatus.PENDING
-                
-                # 如果是已有步骤，保留其状态
-                if step_id in old_steps_map:
-                    status = old_steps_map[step_id].status
-                
-                new_steps.append(Step(
-                    id=step_id,
-                    description=step_data["description"],
-                    status=status,
-                    action_type=step_data["action_type"],
-                    tool_name=step_data.get("tool_name"),
-                    tool_args=step_data.get("tool_args")
-                ))
-
-            print(f"重规划后的steps为：{new_steps}")
-            
+        if plan_data.get("final_answer"):
             return Plan(
-                steps=new_steps, 
-                original_goal=current_plan.original_goal
+                steps=current_plan.steps,
+                original_goal=current_plan.original_goal,
+                final_answer=plan_data.get("final_answer")
             )
 
-        except Exception as e:
-            logger.error(f"重规划失败: {e}")
-            return current_plan
+        # 未变化的步骤复制旧步骤，只校验新增或修改的步骤
+        new_steps = refined_steps(current_plan, self._step_items(plan_data))
+
+        logger.debug(f"重规划后的steps为：{new_steps}")
+
+        return Plan(
+            steps=new_steps,
+            original_goal=current_plan.original_goal
+        )
 
-    def _call_llm(self, messages: List[Dict[str, str]]) -> str:
-        """调用LLM的辅助函数"""
-        completion = self.client.chat.completions.create(
-            model=self.model,
+    def _call_llm(
+        self,
+        messages: List[Dict[str, str]],
+        role: str = ROLE_PLAN,
+        model: Optional[str] = None,
+        parse: Optional[Callable[[str], Any]] = None
+    ) -> Any:
+        """调用LLM的辅助函数（相同请求直接命中响应缓存），未指定 model 时使用角色对应的模型；提供 parse 时返回解析结果"""
+        return chat_completion(
+            self.client,
+            model=model or self.models.model_for(role),
             messages=messages,
-            response_format={"type": "json_object"} # 强制JSON输出
+            response_format={"type": "json_object"}, # 强制JSON输出
+            role=role,
+            parse=parse
         )
-        return completion.choices[0].message.content
+
+    def _step_items(self, plan_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """计划中的步骤数据，steps 不是由对象组成的列表时抛出 ValueError，由更强的模型重试"""
+        items = plan_data.get("steps", [])
+        if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+            raise ValueError("steps 应为由步骤对象组成的列表")
+        return items
 
     def _parse_json_response(self, response: str) -> Dict[str, Any]:
         """解析JSON响应的辅助函数"""
         try:
             # 清理可能的Markdown标记
             cleaned_response = response.replace("```json", "").replace("```", "").strip()
-            return json.loads(cleaned_response)
-        except json.JSONDecodeError:
+            return loads_object(cleaned_response)
+        except JSONDecodeError:
             logger.error(f"JSON解析失败: {response}")
             raise
 
 
+class AsyncPlanner(Planner):
+    """
+    Planner 的异步版本
+    提示词构建与结果解析与 Planner 共用，仅 LLM 调用改为 await，不阻塞事件循环
+    """
+    def _create_client(self) -> AsyncOpenAI:
+        return get_async_llm_client()
+
+    async def create_initial_plan(self, goal: str, context: Optional[str] = None) -> Plan:
+        logger.info(f"正在为目标创建初始计划: {goal}")
+        with span("planner.create_initial_plan") as current:
+            plan = self._cached_plan(goal, context)
+            if plan is not None:
+                current.set_attribute("plan_cache", "hit")
+                current.set_attribute("steps", len(plan.steps))
+                return plan
+
+            messages = self._build_initial_messages(goal, context)
+            try:
+                plan = await acall_with_escalation(
+                    self.models, ROLE_PLAN,
+                    lambda model, parse: self._call_llm(messages, role=ROLE_PLAN, model=model, parse=parse),
+                    lambda response: self._build_initial_plan(goal, response)
+                )
+            except LLMQueueTimeout:
+                raise
+            except Exception as e:
+                logger.error(f"创建初始计划失败: {e}")
+                current.set_attribute("fallback", True)
+                plan = self._fallback_plan(goal)
+            current.set_attribute("steps", len(plan.steps))
+            return plan
+
+    async def refine_plan(
+        self,
+        current_plan: Plan,
+        history: Optional[List[StepRecord]] = None,
+        context: Optional[str] = None
+    ) -> Plan:
+        logger.info(f"正在根据反馈调整计划: {current_plan.original_goal}")
+        with span("planner.refine_plan", history_steps=len(history or [])) as current:
+            messages = self._build_refine_messages(current_plan, history or [], context)
+            try:
+                return await acall_with_escalation(
+                    self.models, ROLE_REPLAN,
+                    lambda model, parse: self._call_llm(messages, role=ROLE_REPLAN, model=model, parse=parse),
+                    lambda response: self._build_refined_plan(current_plan, response)
+                )
+            except LLMQueueTimeout:
+                raise
+            except Exception as e:
+                logger.error(f"重规划失败: {e}")
+                current.set_attribute("failed", True)
+                return current_plan
+
+    async def _call_llm(
+        self,
+        messages: List[Dict[str, str]],
+        role: str = ROLE_PLAN,
+        model: Optional[str] = None,
+        parse: Optional[Callable[[str], Any]] = None
+    ) -> Any:
+        return await achat_completion(
+            self.client,
+            model=model or self.models.model_for(role),
+            messages=messages,
+            response_format={"type": "json_object"}, # 强制JSON输出
+            role=role,
+            parse=parse
+        )
+
+
 
 
 if __name__ == "__main__":
@@ -0,0 +1,52 @@
+"""
+重规划策略
+决定一批步骤执行完成后是否需要调用 Replanner。
+"""
+import logging
+from typing import List, Optional
+
+from agent.schema import Plan, StepRecord, StepStatus
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ReplanPolicy:
+    """
+    - always: 每批步骤执行后都重规划（原有行为）
+    - conditional: 仅在以下情况重规划
+        1. 有步骤执行失败
+        2. 有步骤被标记为 decision_point
+        3. 距上次重规划已执行 every_k 个步骤（every_k > 0 时）
+        4. 计划中已没有待执行的步骤（需要 Replanner 给出最终答案或补充步骤）
+    """
+    ALWAYS = "always"
+    CONDITIONAL = "conditional"
+
+    def __init__(self, mode: Optional[str] = None, every_k: Optional[int] = None):
+        self.mode = mode or settings.replan_mode
+        self.every_k = settings.replan_every_k if every_k is None else every_k
+
+        if self.mode not in (self.ALWAYS, self.CONDITIONAL):
+            logger.warning(f"未知的重规划模式 {self.mode}，使用 {self.ALWAYS}")
+            self.mode = self.ALWAYS
+
+    def should_replan(self, plan: Plan, records: List[StepRecord], steps_since_replan: int) -> bool:
+        """
+        :param plan: 当前计划
+        :param records: 刚执行完成的步骤记录
+        :param steps_since_replan: 距上次重规划已执行的步骤数（包含 records）
+        """
+        if self.mode == self.ALWAYS:
+            return True
+
+        if any(not record.result.is_success for record in records):
+            return True
+
+        if any(record.step.decision_point for record in records):
+            return True
+
+        if self.every_k > 0 and steps_since_replan >= self.every_k:
+            return True
+
+        return not any(step.status == StepStatus.PENDING for step in plan.steps)
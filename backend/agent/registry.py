@@ -0,0 +1,113 @@
+"""
+工具注册表
+工具在注册时一次性生成名称、描述、参数 JSON Schema、校验器、容错包装与 Prompt 片段，
+Planner 与 Executor 共享同一个注册表，运行期间注册 / 注销工具无需重建 AgentManager。
+"""
+import inspect
+import json
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from agent.resilience import ResilientTool, wrap_tool
+from agent.tool_schema import build_tool_schema, validate_args
+
+
+class ToolSpec:
+    """注册后的工具，所有派生信息在创建时计算好"""
+    def __init__(self, func: Callable, name: Optional[str] = None, description: Optional[str] = None):
+        self.func = func
+        self.name = name or func.__name__
+        self.description = inspect.cleandoc(description or func.__doc__ or "").strip()
+        self.schema: Dict[str, Any] = build_tool_schema(func)
+        self.is_coroutine = inspect.iscoroutinefunction(func)
+        self.runner: ResilientTool = wrap_tool(func, self.name)
+
+        # Planner 工具列表中的一项
+        self.list_fragment = f"- {self.name}: {self.description}"
+        # 参数生成 Prompt 中的工具文档：描述 + 参数 Schema
+        self.doc_fragment = (
+            f"{self.description}\n\n参数 JSON Schema:\n"
+            f"{json.dumps(self.schema, ensure_ascii=False)}"
+        )
+
+    def validate(self, args: Any) -> List[str]:
+        """校验参数，返回错误信息列表，为空表示通过"""
+        return validate_args(self.schema, args)
+
+
+class ToolRegistry:
+    """
+    线程安全的工具注册表
+    读多写少：注册 / 注销时整体替换内部字典并使缓存的 Prompt 片段失效，读取无需加锁
+    """
+    def __init__(self, tools: Optional[Iterable[Callable]] = None):
+        self._lock = threading.Lock()
+        self._specs: Dict[str, ToolSpec] = {}
+        self._tool_list: Optional[str] = None
+        # 每次变更递增，供依赖工具列表的缓存判断是否过期
+        self.version = 0
+        for func in tools or []:
+            self.register(func)
+
+    def register(self, func: Callable, name: Optional[str] = None, description: Optional[str] = None) -> ToolSpec:
+        """注册工具，同名工具会被替换"""
+        spec = ToolSpec(func, name, description)
+        with self._lock:
+            specs = dict(self._specs)
+            specs[spec.name] = spec
+            self._specs = specs
+            self._tool_list = None
+            self.version += 1
+        return spec
+
+    def unregister(self, name: str) -> bool:
+        """注销工具，返回该工具此前是否存在"""
+        with self._lock:
+            if name not in self._specs:
+                return False
+            specs = dict(self._specs)
+            del specs[name]
+            self._specs = specs
+            self._tool_list = None
+            self.version += 1
+        return True
+
+    def get(self, name: str) -> Optional[ToolSpec]:
+        return self._specs.get(name)
+
+    def names(self) -> List[str]:
+        return list(self._specs)
+
+    def specs(self) -> List[ToolSpec]:
+        return list(self._specs.values())
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._specs
+
+    def __len__(self) -> int:
+        return len(self._specs)
+
+    def tool_list_prompt(self) -> str:
+        """Planner / Replanner Prompt 中的工具列表，注册表变更前一直复用同一份渲染结果"""
+        tool_list = self._tool_list
+        if tool_list is None:
+            with self._lock:
+                if self._tool_list is None:
+                    self._tool_list = "\n".join(spec.list_fragment for spec in self._specs.values())
+                tool_list = self._tool_list
+        return tool_list
+
+
+_default_registry: Optional[ToolRegistry] = None
+_default_lock = threading.Lock()
+
+
+def get_default_registry() -> ToolRegistry:
+    """进程内默认的工具注册表，首次使用时注册内置工具"""
+    global _default_registry
+    if _default_registry is None:
+        with _default_lock:
+            if _default_registry is None:
+                from agent.tools import web_search, web_search_batch
+                _default_registry = ToolRegistry([web_search, web_search_batch])
+    return _default_registry
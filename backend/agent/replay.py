@@ -0,0 +1,177 @@
+"""
+LLM 请求的录制 / 回放
+以 httpx transport 的形式接入共享 LLM 客户端，对 Planner / Executor 完全透明：
+- record: 请求照常发往 llm_base_url，响应按请求内容寻址保存为 fixture 文件
+- replay: 不访问网络，直接从 fixture 文件返回录制的响应；找不到时返回 404 并指出缺失的 fixture
+用于离线、可重复地运行 Agent 循环（基准测试、CI 回归）。
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+MODE_LIVE = "live"
+MODE_RECORD = "record"
+MODE_REPLAY = "replay"
+
+# 录制时保留的响应头，其余（日期、请求ID、限流信息等）每次都不同，不写入 fixture
+_KEPT_HEADERS = ("content-type",)
+# 响应体读取后已解压、长度可能变化，重新构造响应时去掉这些头
+_ENCODING_HEADERS = ("content-encoding", "content-length", "transfer-encoding")
+
+
+def _decoded_response(response: httpx.Response, content: bytes, request: httpx.Request) -> httpx.Response:
+    headers = [(name, value) for name, value in response.headers.items() if name.lower() not in _ENCODING_HEADERS]
+    return httpx.Response(status_code=response.status_code, headers=headers, content=content, request=request)
+
+
+class FixtureStore:
+    """
+    fixture 文件目录，每个请求一个 JSON 文件
+    文件名为 (方法, 路径, 规范化后的请求体) 的 sha256，同一请求总是落到同一文件
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def key(self, request: httpx.Request) -> str:
+        body = request.content or b""
+        try:
+            # 请求体按键排序后再计算哈希，避免字段顺序不同导致无法命中
+            body = json.dumps(json.loads(body), ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+        except ValueError:
+            pass
+        digest = hashlib.sha256()
+        digest.update(request.method.encode("utf-8"))
+        digest.update(b" ")
+        digest.update(request.url.path.encode("utf-8"))
+        digest.update(b"\n")
+        digest.update(body)
+        return digest.hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def load(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.path(key), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, key: str, request: httpx.Request, response: httpx.Response):
+        try:
+            request_body: Any = json.loads(request.content or b"null")
+        except ValueError:
+            request_body = (request.content or b"").decode("utf-8", errors="replace")
+
+        fixture = {
+            "request": {"method": request.method, "path": request.url.path, "body": request_body},
+            "response": {
+                "status_code": response.status_code,
+                "headers": {name: response.headers[name] for name in _KEPT_HEADERS if name in response.headers},
+                "body": response.content.decode("utf-8", errors="replace"),
+            },
+        }
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = self.path(key) + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(fixture, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path(key))
+        logger.info(f"已录制LLM响应: {key[:12]} ({request.url.path})")
+
+    def to_response(self, fixture: Dict[str, Any], request: httpx.Request) -> httpx.Response:
+        data = fixture["response"]
+        return httpx.Response(
+            status_code=data["status_code"],
+            headers=data.get("headers") or {},
+            content=data["body"].encode("utf-8"),
+            request=request
+        )
+
+    def missing_response(self, key: str, request: httpx.Request) -> httpx.Response:
+        # 404 不会被 OpenAI SDK 重试，调用方会立即得到明确的错误
+        message = f"replay fixture not found: {self.path(key)}"
+        logger.error(message)
+        return httpx.Response(
+            status_code=404,
+            json={"error": {"message": message, "type": "fixture_not_found"}},
+            request=request
+        )
+
+
+class RecordReplayTransport(httpx.BaseTransport):
+    """同步客户端使用的录制 / 回放 transport"""
+    def __init__(self, mode: str, store: FixtureStore, transport: Optional[httpx.BaseTransport] = None):
+        self.mode = mode
+        self.store = store
+        self._transport = transport or httpx.HTTPTransport()
+
+    @property
+    def _pool(self):
+        # 连接池统计（llm._pool_stats）透传到实际发送请求的 transport
+        return getattr(self._transport, "_pool", None)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        key = self.store.key(request)
+        if self.mode == MODE_REPLAY:
+            fixture = self.store.load(key)
+            if fixture is None:
+                return self.store.missing_response(key, request)
+            return self.store.to_response(fixture, request)
+
+        response = self._transport.handle_request(request)
+        if self.mode != MODE_RECORD:
+            return response
+
+        # 读完整个响应（包括流式响应）再保存，返回一个内容相同的新响应
+        content = response.read()
+        response.close()
+        recorded = _decoded_response(response, content, request)
+        if response.status_code < 400:
+            self.store.save(key, request, recorded)
+        return recorded
+
+    def close(self):
+        self._transport.close()
+
+
+class AsyncRecordReplayTransport(httpx.AsyncBaseTransport):
+    """RecordReplayTransport 的异步版本"""
+    def __init__(self, mode: str, store: FixtureStore, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.mode = mode
+        self.store = store
+        self._transport = transport or httpx.AsyncHTTPTransport()
+
+    @property
+    def _pool(self):
+        return getattr(self._transport, "_pool", None)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        key = self.store.key(request)
+        if self.mode == MODE_REPLAY:
+            fixture = self.store.load(key)
+            if fixture is None:
+                return self.store.missing_response(key, request)
+            return self.store.to_response(fixture, request)
+
+        response = await self._transport.handle_async_request(request)
+        if self.mode != MODE_RECORD:
+            return response
+
+        content = await response.aread()
+        await response.aclose()
+        recorded = _decoded_response(response, content, request)
+        if response.status_code < 400:
+            self.store.save(key, request, recorded)
+        return recorded
+
+    async def aclose(self):
+        await self._transport.aclose()
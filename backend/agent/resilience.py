@@ -0,0 +1,280 @@
+"""
+工具调用的容错包装
+- 超时：每个工具有独立的执行时限，超时后立即返回失败，不再等待卡住的调用
+- 重试：瞬时错误（超时、网络错误、限流等）按带抖动的指数退避重试有限次数
+- 熔断：同一工具连续失败达到阈值后熔断，冷却期内直接失败；冷却结束后放行一次试探调用
+熔断器按工具名在进程内共享，状态通过 /metrics 导出。
+"""
+import asyncio
+import contextvars
+import inspect
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, Optional
+
+from agent.metrics import registry
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+BREAKER_STATE = registry.gauge(
+    "planflow_tool_circuit_state", "工具熔断器状态（0=closed, 1=half_open, 2=open）", ("tool",)
+)
+BREAKER_OPENED = registry.counter(
+    "planflow_tool_circuit_opened_total", "工具熔断器打开次数", ("tool",)
+)
+BREAKER_REJECTED = registry.counter(
+    "planflow_tool_circuit_rejected_total", "熔断期间被直接拒绝的工具调用次数", ("tool",)
+)
+TOOL_RETRIES = registry.counter(
+    "planflow_tool_retries_total", "工具调用重试次数", ("tool",)
+)
+TOOL_TIMEOUTS = registry.counter(
+    "planflow_tool_timeouts_total", "工具调用超时次数", ("tool",)
+)
+
+
+class ToolError(Exception):
+    """工具调用失败（已经过重试或被熔断）"""
+
+
+class ToolTimeoutError(ToolError):
+    pass
+
+
+class CircuitOpenError(ToolError):
+    pass
+
+
+def is_transient(error: BaseException) -> bool:
+    """
+    判断错误是否值得重试
+    参数错误（TypeError / ValueError / KeyError）重试也不会成功，其余错误（网络、超时、限流等）视为瞬时错误
+    """
+    if isinstance(error, CircuitOpenError):
+        return False
+    return not isinstance(error, (TypeError, ValueError, KeyError))
+
+
+class CircuitBreaker:
+    """
+    连续失败计数的熔断器
+    closed -> （连续失败 failure_threshold 次）-> open -> （经过 reset_timeout）-> half_open
+    half_open 状态只放行一次试探调用，成功则关闭，失败则重新打开
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    _STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        BREAKER_STATE.set(0, tool=name)
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            logger.warning(f"工具 {self.name} 熔断器状态: {self.state} -> {state}")
+        self.state = state
+        BREAKER_STATE.set(self._STATE_VALUES[state], tool=self.name)
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self._set_state(self.HALF_OPEN)
+                self._probing = False
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+        BREAKER_REJECTED.inc(tool=self.name)
+        return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    BREAKER_OPENED.inc(tool=self.name)
+                self.opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+    def release(self):
+        """结束一次不计入成败的调用（如参数错误），允许 half_open 状态再次试探"""
+        with self._lock:
+            self._probing = False
+
+    def retry_after(self) -> float:
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"state": self.state, "failures": self.failures}
+
+
+class ResilientTool:
+    """为单个工具函数加上超时、重试与熔断"""
+    def __init__(
+        self,
+        name: str,
+        func: Callable,
+        timeout: float,
+        max_retries: int,
+        backoff: float,
+        backoff_max: float,
+        breaker: CircuitBreaker
+    ):
+        self.name = name
+        self.func = func
+        self.timeout = timeout
+        self.max_retries = max(0, max_retries)
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.breaker = breaker
+        self.is_coroutine = inspect.iscoroutinefunction(func)
+
+    def _delay(self, attempt: int) -> float:
+        # full jitter：在 [0, min(上限, base * 2^attempt)] 内随机等待，避免并发重试同时打到后端
+        return random.uniform(0, min(self.backoff_max, self.backoff * (2 ** attempt)))
+
+    def _check_breaker(self):
+        if not self.breaker.allow():
+            raise CircuitOpenError(
+                f"工具 {self.name} 暂时不可用（连续失败已熔断，约 {self.breaker.retry_after():.0f} 秒后重试）"
+            )
+
+    def _should_retry(self, error: BaseException, attempt: int) -> bool:
+        if attempt >= self.max_retries or not is_transient(error):
+            return False
+        TOOL_RETRIES.inc(tool=self.name)
+        logger.warning(f"工具 {self.name} 第 {attempt + 1} 次调用失败，准备重试: {error}")
+        return True
+
+    def _failed(self, error: BaseException) -> ToolError:
+        # 参数错误说明调用方式有误而非后端故障，不计入熔断
+        if is_transient(error):
+            self.breaker.record_failure()
+        else:
+            self.breaker.release()
+        if isinstance(error, ToolError):
+            return error
+        return ToolError(f"{type(error).__name__}: {error}")
+
+    def call(self, **kwargs) -> Any:
+        """同步调用：在工具线程池中执行并等待至多 timeout 秒"""
+        self._check_breaker()
+        attempt = 0
+        while True:
+            try:
+                result = self._call_once(kwargs)
+                self.breaker.record_success()
+                return result
+            except Exception as e:
+                if not self._should_retry(e, attempt):
+                    raise self._failed(e) from e
+                time.sleep(self._delay(attempt))
+                attempt += 1
+
+    async def acall(self, **kwargs) -> Any:
+        """异步调用：协程工具直接 await，同步工具放到线程中执行"""
+        self._check_breaker()
+        attempt = 0
+        while True:
+            try:
+                result = await self._acall_once(kwargs)
+                self.breaker.record_success()
+                return result
+            except Exception as e:
+                if not self._should_retry(e, attempt):
+                    raise self._failed(e) from e
+                await asyncio.sleep(self._delay(attempt))
+                attempt += 1
+
+    def _call_once(self, kwargs: Dict[str, Any]) -> Any:
+        if self.is_coroutine:
+            return asyncio.run(self._acall_once(kwargs))
+        if not self.timeout:
+            return self.func(**kwargs)
+        # 超时后调用方立即返回，卡住的调用留在线程中自行结束
+        future = _get_tool_pool().submit(contextvars.copy_context().run, self.func, **kwargs)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            TOOL_TIMEOUTS.inc(tool=self.name)
+            raise ToolTimeoutError(f"工具 {self.name} 执行超时（{self.timeout}s）")
+
+    async def _acall_once(self, kwargs: Dict[str, Any]) -> Any:
+        call = self.func(**kwargs) if self.is_coroutine else asyncio.to_thread(self.func, **kwargs)
+        if not self.timeout:
+            return await call
+        try:
+            return await asyncio.wait_for(call, timeout=self.timeout)
+        except asyncio.TimeoutError:
+            TOOL_TIMEOUTS.inc(tool=self.name)
+            raise ToolTimeoutError(f"工具 {self.name} 执行超时（{self.timeout}s）")
+
+
+_lock = threading.Lock()
+_tool_pool: Optional[ThreadPoolExecutor] = None
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def _get_tool_pool() -> ThreadPoolExecutor:
+    global _tool_pool
+    if _tool_pool is None:
+        with _lock:
+            if _tool_pool is None:
+                _tool_pool = ThreadPoolExecutor(max_workers=settings.tool_max_workers, thread_name_prefix="tool")
+    return _tool_pool
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """获取工具的熔断器，同名工具在进程内共享"""
+    with _lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(
+                name,
+                failure_threshold=settings.tool_breaker_failure_threshold,
+                reset_timeout=settings.tool_breaker_reset_timeout
+            )
+        return breaker
+
+
+def breaker_states() -> Dict[str, Dict[str, Any]]:
+    with _lock:
+        breakers = dict(_breakers)
+    return {name: breaker.snapshot() for name, breaker in breakers.items()}
+
+
+def wrap_tool(func: Callable, name: Optional[str] = None) -> ResilientTool:
+    """按配置为工具创建容错包装，tool_timeouts 中可按工具名覆盖默认时限"""
+    name = name or func.__name__
+    return ResilientTool(
+        name,
+        func,
+        timeout=settings.tool_timeouts.get(name, settings.tool_timeout),
+        max_retries=settings.tool_max_retries,
+        backoff=settings.tool_retry_backoff,
+        backoff_max=settings.tool_retry_backoff_max,
+        breaker=get_breaker(name)
+    )
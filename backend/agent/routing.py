@@ -0,0 +1,96 @@
+"""
+按调用角色选择模型
+参数生成、重规划等结构简单的调用可以使用更快更便宜的模型，最终回答使用更强的模型；
+便宜模型返回的 JSON 校验失败时，按配置改用更强的模型重试一次。
+各角色的模型在 core.config.Settings 中配置（llm_model / llm_role_models / llm_escalation_models）。
+"""
+import logging
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+from agent.metrics import record_llm_escalation
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 视为“模型输出不合格”的错误：JSON 解析失败、结构或字段取值不符合要求（ValueError）、缺少字段（KeyError）
+# json.JSONDecodeError 与 pydantic.ValidationError 都是 ValueError 的子类；
+# TypeError / AttributeError 通常是代码或 SDK 的缺陷，不触发升级重试，直接抛出。
+# 解析函数需自行检查 JSON 的结构（如顶层必须是对象），不符合时抛出 ValueError
+VALIDATION_ERRORS = (ValueError, KeyError)
+
+
+class ModelPolicy:
+    """各角色使用的模型及校验失败时升级到的模型"""
+    def __init__(self, default: str, role_models: Optional[Dict[str, str]] = None, escalation_models: Optional[Dict[str, str]] = None):
+        self.default = default
+        self.role_models = dict(role_models or {})
+        self.escalation_models = dict(escalation_models or {})
+
+    @classmethod
+    def from_settings(cls) -> "ModelPolicy":
+        return cls(settings.llm_model, settings.llm_role_models, settings.llm_escalation_models)
+
+    def model_for(self, role: str) -> str:
+        return self.role_models.get(role) or self.default
+
+    def escalation_for(self, role: str) -> Optional[str]:
+        """校验失败时改用的模型，未配置或与当前模型相同时返回 None"""
+        model = self.escalation_models.get(role)
+        if not model or model == self.model_for(role):
+            return None
+        return model
+
+
+_default_policy: Optional[ModelPolicy] = None
+
+
+def get_model_policy() -> ModelPolicy:
+    global _default_policy
+    if _default_policy is None:
+        _default_policy = ModelPolicy.from_settings()
+    return _default_policy
+
+
+def _escalate(policy: ModelPolicy, role: str, model: str, error: Exception) -> str:
+    stronger = policy.escalation_for(role)
+    if stronger is None:
+        raise error
+    logger.warning(f"模型 {model} 的 {role} 输出校验失败（{error}），改用 {stronger} 重试")
+    record_llm_escalation(role, model, stronger)
+    return stronger
+
+
+def call_with_escalation(
+    policy: ModelPolicy,
+    role: str,
+    call: Callable[[str, Callable[[str], T]], T],
+    parse: Callable[[str], T]
+) -> T:
+    """
+    用角色对应的模型调用 LLM 并解析结果，解析 / 校验失败时用更强的模型重试一次
+    :param call: 以模型名与 parse 为参数发起调用并返回解析结果；解析交给 LLM 层，校验通过的响应才会写入缓存
+    :param parse: 解析并校验文本，失败时抛出 VALIDATION_ERRORS 中的异常
+    """
+    model = policy.model_for(role)
+    try:
+        return call(model, parse)
+    except VALIDATION_ERRORS as e:
+        stronger = _escalate(policy, role, model, e)
+    return call(stronger, parse)
+
+
+async def acall_with_escalation(
+    policy: ModelPolicy,
+    role: str,
+    call: Callable[[str, Callable[[str], T]], Awaitable[T]],
+    parse: Callable[[str], T]
+) -> T:
+    """call_with_escalation 的异步版本"""
+    model = policy.model_for(role)
+    try:
+        return await call(model, parse)
+    except VALIDATION_ERRORS as e:
+        stronger = _escalate(policy, role, model, e)
+    return await call(stronger, parse)
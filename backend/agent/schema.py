@@ -1,6 +1,9 @@
+import logging
 from enum import Enum
 from typing import List, Optional, Literal, Any, Dict
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
+
+logger = logging.getLogger(__name__)
 
 class StepStatus(str, Enum):
     PENDING = "PENDING"
@@ -25,6 +28,12 @@ class Step(BaseModel):
     # 使用则点存储参数，避免反复序列化
     tool_args: Dict[str, Any] | None = None
 
+    # 依赖的步骤ID列表，None 表示依赖之前的所有步骤（顺序执行），[] 表示无依赖可立即执行
+    depends_on: List[int] | None = Field(None, description="依赖的步骤ID列表")
+
+    # 决策相关步骤：其结果可能改变后续计划，执行后需要交给 Replanner 判断
+    decision_point: bool = Field(False, description="执行后是否需要重规划")
+
 class Plan(BaseModel):
     """
     当前计划执行视图
@@ -37,6 +46,9 @@ class Plan(BaseModel):
     # 当前任务完成后，Planner会将最终答案填写再这里
     final_answer: Optional[str] = Field(None, description="最终答案")
 
+    # 计划来源：llm / cache（复用同形态目标的计划）/ fallback（规划失败的兜底计划），只在进程内使用，不参与序列化
+    source: str = Field("llm", exclude=True)
+
     def next_step(self) -> Step | None:
         """
         获取当前需要执行的步骤。
@@ -47,21 +59,67 @@ class Plan(BaseModel):
                 return step
         return None
 
+    def ready_steps(self) -> List[Step]:
+        """
+        获取当前所有可以同时执行的步骤。
+        逻辑：状态为 PENDING，且所有依赖步骤均已 COMPLETED 或 SKIPPED。
+        未声明 depends_on 的步骤视为依赖其之前的全部步骤；引用不存在的步骤ID的依赖会被忽略。
+        返回顺序与 steps 中的顺序一致。
+        """
+        known_ids = {step.id for step in self.steps}
+        done_ids = {step.id for step in self.steps if step.status in [StepStatus.COMPLETED, StepStatus.SKIPPED]}
+
+        ready = []
+        for index, step in enumerate(self.steps):
+            if step.status != StepStatus.PENDING:
+                continue
+            if step.depends_on is None:
+                dependencies = [s.id for s in self.steps[:index]]
+            else:
+                dependencies = [dep for dep in step.depends_on if dep in known_ids and dep != step.id]
+            if all(dep in done_ids for dep in dependencies):
+                ready.append(step)
+        return ready
+
 class StepResult(BaseModel):
     """
     每一步执行结果
     """
     is_success: bool
 
-    # LLM/TOOL的原始输出
+    # LLM/TOOL的原始输出；输出过大被移入输出存储时只保留截断预览
     raw_output: str | None = None
 
-    # 结构化信息，如解析出的JSON
+    # 结构化信息，如解析出的JSON；输出外置时为 None
     structured_output: Dict[str, Any] | None = None
 
     error_message: str | None = None
     tool_name: str | None = None
 
+    # 外置输出的引用（内容哈希）与原文长度，输出保留在内存中时为 None
+    output_ref: str | None = None
+    output_size: int | None = None
+
+    def full_output(self) -> str | None:
+        """完整的原始输出，外置时从输出存储读取；读取失败时退回预览"""
+        if self.output_ref is None:
+            return self.raw_output
+        return self._load_output().get("raw_output", self.raw_output)
+
+    def full_structured_output(self) -> Dict[str, Any] | None:
+        if self.output_ref is None:
+            return self.structured_output
+        return self._load_output().get("structured_output")
+
+    def _load_output(self) -> Dict[str, Any]:
+        # output_store 依赖 serialization，而后者依赖本模块，这里延迟导入
+        from agent.output_store import OutputNotFound, load_output
+        try:
+            return load_output(self.output_ref)
+        except OutputNotFound as e:
+            logger.warning(f"{e}，使用截断预览")
+            return {}
+
 class StepRecord(BaseModel):
     """
     历史执行记录
@@ -70,6 +128,62 @@ class StepRecord(BaseModel):
     step: Step
     result: StepResult
 
+    # JSON 片段缓存，见 agent.serialization.record_json
+    _json: Optional[str] = PrivateAttr(default=None)
+
+class CallStats(BaseModel):
+    """
+    某一类调用（按角色或工具区分）的累计统计
+    """
+    calls: int = 0
+    errors: int = 0
+    # 命中响应缓存、未实际发起请求的次数
+    cache_hits: int = 0
+    latency_seconds: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    # prompt 中命中模型服务端前缀缓存的 token 数
+    cached_prompt_tokens: int = 0
+
+class RunMetrics(BaseModel):
+    """
+    单次运行的统计信息
+    """
+    # 推测执行：结果被采用的次数 / 因计划变化被丢弃的次数
+    speculation_hits: int = 0
+    speculation_waste: int = 0
+
+    # LLM 调用总计
+    llm_calls: int = 0
+    llm_latency_seconds: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_prompt_tokens: int = 0
+    # 输出校验失败后改用更强模型重试的次数
+    llm_escalations: int = 0
+    # 初始计划命中计划缓存、省去规划调用的次数
+    plan_cache_hits: int = 0
+
+    # 工具调用总计
+    tool_calls: int = 0
+    tool_latency_seconds: float = 0.0
+    # 直接使用 Planner 参数、省去参数生成 LLM 调用的次数
+    tool_args_reused: int = 0
+
+    # 按角色（plan / replan / tool-args / llm-step / summary）区分的 LLM 调用统计
+    llm_by_role: Dict[str, CallStats] = Field(default_factory=dict)
+    # 按工具名区分的工具调用统计
+    tools: Dict[str, CallStats] = Field(default_factory=dict)
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    @property
+    def prompt_cache_ratio(self) -> float:
+        """prompt token 中命中前缀缓存的比例"""
+        return self.cached_prompt_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
 class AgentState(BaseModel):
     """
     AgentState
@@ -77,13 +191,31 @@ class AgentState(BaseModel):
     """
     problem: str = Field(...)
 
+    # 运行ID，同时作为追踪链路的 trace_id
+    run_id: Optional[str] = None
+
+    # 同一任务之前的对话记忆（已按 token 预算渲染），首次提问时为空
+    context: Optional[str] = None
+
     # 当前计划
     current_plan: Plan
 
     # 历史执行记录
     history: List[StepRecord] = Field(default_factory=list)
 
+    # 最近一次失败步骤的错误信息
+    last_error: Optional[str] = None
+
+    # 运行统计
+    metrics: RunMetrics = Field(default_factory=RunMetrics)
+
     def is_task_completed(self) -> bool:
         return self.current_plan.final_answer is not None
 
-    
\ No newline at end of file
+class AgentEvent(BaseModel):
+    """
+    Agent 运行过程中产生的事件，用于流式推送执行进度
+    type: plan / step_started / step_finished / replan / answer_delta / done / error
+    """
+    type: str
+    data: Dict[str, Any] = Field(default_factory=dict)
@@ -0,0 +1,199 @@
+"""
+计划与执行历史的快速序列化
+- 统一的 JSON 编解码：安装了 orjson 时使用 orjson，否则退回标准库（输出同为紧凑格式、不转义非 ASCII 字符）
+- 执行记录保存步骤的副本，写入历史后不再变化，其 JSON 片段只生成一次并缓存在记录上，重规划与检查点直接拼接
+- 已校验过的步骤（重规划中未变化的步骤、计划缓存中的步骤）用 model_construct 构造，跳过重复校验
+
+python -m agent.serialization --steps 50 可对比优化前后的重规划序列化耗时。
+"""
+import argparse
+import json
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from agent.schema import Plan, Step, StepRecord, StepResult, StepStatus
+
+try:
+    import orjson
+except ImportError:  # orjson 为可选依赖
+    orjson = None
+
+# orjson.JSONDecodeError 是 json.JSONDecodeError 的子类，捕获后者即可覆盖两种实现
+JSONDecodeError = json.JSONDecodeError
+
+# 重规划时与旧步骤比较的字段，全部相同时视为未变化的步骤
+_STEP_FIELDS = ("description", "action_type", "tool_name", "tool_args", "depends_on", "decision_point")
+
+
+def dumps(obj: Any, sort_keys: bool = False) -> str:
+    """编码为紧凑的 JSON 字符串，无法直接编码的值转为字符串"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        return orjson.dumps(obj, default=str, option=option).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, sort_keys=sort_keys, separators=(",", ":"), default=str)
+
+
+def loads(data: str | bytes) -> Any:
+    """
+    解码 JSON
+    :raises JSONDecodeError: 不是合法的 JSON
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def loads_object(data: str | bytes) -> Dict[str, Any]:
+    """
+    解码顶层为对象的 JSON（模型按 json_object 格式返回的内容）
+    :raises JSONDecodeError: 不是合法的 JSON
+    :raises ValueError: 顶层不是对象
+    """
+    value = loads(data)
+    if not isinstance(value, dict):
+        raise ValueError(f"应为 JSON 对象，实际为 {type(value).__name__}")
+    return value
+
+
+def record_json(record: StepRecord) -> str:
+    """执行记录的 JSON 片段，首次调用时生成并缓存；记录持有步骤的副本，写入历史后不应再修改"""
+    if record._json is None:
+        record._json = record.model_dump_json()
+    return record._json
+
+
+def history_json(history: Iterable[StepRecord]) -> str:
+    """拼接各条记录缓存的 JSON 片段，得到整个历史的 JSON 数组"""
+    return "[" + ",".join(record_json(record) for record in history) + "]"
+
+
+def plan_json(plan: Plan) -> str:
+    return plan.model_dump_json()
+
+
+def trusted_step(data: Dict[str, Any]) -> Step:
+    """由已经校验过的字段构造步骤，不再重复校验"""
+    return Step.model_construct(**data)
+
+
+def _unchanged_step(old: Optional[Step], item: Dict[str, Any]) -> bool:
+    if old is None:
+        return False
+    values = {
+        "description": item.get("description"),
+        "action_type": item.get("action_type"),
+        "tool_name": item.get("tool_name"),
+        "tool_args": item.get("tool_args"),
+        "depends_on": item.get("depends_on"),
+        "decision_point": bool(item.get("decision_point", False)),
+    }
+    return all(getattr(old, field) == values[field] for field in _STEP_FIELDS)
+
+
+def refined_steps(current_plan: Plan, items: List[Dict[str, Any]]) -> List[Step]:
+    """
+    由重规划返回的步骤数据构造新计划的步骤
+    - 与旧计划中同 id 步骤完全相同的步骤直接复制旧步骤，不再校验
+    - 新增或修改的步骤完整校验；已有步骤保留原状态，新步骤为 PENDING
+    """
+    old_steps = {step.id: step for step in current_plan.steps}
+    steps = []
+    for item in items:
+        old = old_steps.get(item["id"])
+        if _unchanged_step(old, item):
+            steps.append(old.model_copy())
+            continue
+        steps.append(Step(
+            id=item["id"],
+            description=item["description"],
+            status=old.status if old is not None else StepStatus.PENDING,
+            action_type=item["action_type"],
+            tool_name=item.get("tool_name"),
+            tool_args=item.get("tool_args"),
+            depends_on=item.get("depends_on"),
+            decision_point=bool(item.get("decision_point", False))
+        ))
+    return steps
+
+
+def _legacy_refine_inputs(plan: Plan, history: List[StepRecord], response: str) -> Plan:
+    """优化前的做法：每次重新序列化全部历史，解析结果时逐个完整校验步骤"""
+    plan.model_dump_json()
+    json.dumps([record.model_dump() for record in history], ensure_ascii=False)
+    data = json.loads(response)
+    old_steps = {step.id: step for step in plan.steps}
+    steps = [
+        Step(
+            id=item["id"],
+            description=item["description"],
+            status=old_steps[item["id"]].status if item["id"] in old_steps else StepStatus.PENDING,
+            action_type=item["action_type"],
+            tool_name=item.get("tool_name"),
+            tool_args=item.get("tool_args"),
+            depends_on=item.get("depends_on"),
+            decision_point=bool(item.get("decision_point", False))
+        )
+        for item in data["steps"]
+    ]
+    return Plan(steps=steps, original_goal=plan.original_goal)
+
+
+def _fast_refine_inputs(plan: Plan, history: List[StepRecord], response: str) -> Plan:
+    plan_json(plan)
+    history_json(history)
+    data = loads(response)
+    return Plan(steps=refined_steps(plan, data["steps"]), original_goal=plan.original_goal)
+
+
+def _sample(step_count: int, output_chars: int):
+    steps = [
+        Step(
+            id=i,
+            description=f"搜索第 {i} 个候选对象的相关资料并记录关键数据",
+            status=StepStatus.COMPLETED,
+            action_type="TOOL",
+            tool_name="web_search",
+            tool_args={"query": f"候选对象 {i} 资料", "max_results": 5},
+            depends_on=[i - 1] if i > 1 else [],
+        )
+        for i in range(1, step_count + 1)
+    ]
+    history = [
+        StepRecord(step=step, result=StepResult(
+            is_success=True,
+            raw_output="检索结果：" + "相关内容" * (output_chars // 4),
+            structured_output={"result": "检索结果", "items": list(range(10))},
+            tool_name="web_search"
+        ))
+        for step in steps
+    ]
+    pending = {"id": step_count + 1, "description": "汇总全部结果", "action_type": "LLM", "depends_on": [step_count]}
+    plan = Plan(steps=steps + [Step(**pending)], original_goal="对比候选对象")
+    response = json.dumps({"steps": [step.model_dump(mode="json") for step in plan.steps]}, ensure_ascii=False)
+    return plan, history, response
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="对比重规划序列化的耗时")
+    parser.add_argument("--steps", type=int, default=50, help="执行历史中的步骤数")
+    parser.add_argument("--output-chars", type=int, default=500, help="每个步骤输出的字符数")
+    parser.add_argument("--rounds", type=int, default=200, help="重复次数（每次相当于一次重规划）")
+    args = parser.parse_args(argv)
+
+    plan, history, response = _sample(args.steps, args.output_chars)
+    print(f"JSON 实现: {'orjson ' + orjson.__version__ if orjson else 'json（标准库）'}")
+    print(f"{args.steps} 个步骤，每步输出 {args.output_chars} 字，重复 {args.rounds} 次")
+
+    results = {}
+    for name, func in (("优化前", _legacy_refine_inputs), ("优化后", _fast_refine_inputs)):
+        func(plan, history, response)
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            func(plan, history, response)
+        results[name] = (time.perf_counter() - start) / args.rounds * 1000
+        print(f"{name}: {results[name]:.3f} ms/次")
+    print(f"加速比: {results['优化前'] / results['优化后']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
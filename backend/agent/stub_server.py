@@ -0,0 +1,223 @@
+"""
+本地 OpenAI 兼容桩服务
+按系统提示词识别调用角色（plan / replan / tool-args / llm-step / summary），返回脚本化的 JSON，
+并按配置模拟模型延迟，用于离线测量 Agent 循环的性能与在 CI 中做回归。
+同时模拟服务端前缀缓存：system 消息与此前请求完全相同时，在 usage.prompt_tokens_details.cached_tokens 中报告其 token 数。
+
+启动：
+    python -m agent.stub_server --port 9000 --latency 0.3 --jitter 0.2 [--script script.json]
+然后让后端指向它：
+    LLM_BASE_URL=http://127.0.0.1:9000/v1
+
+脚本文件为 JSON，可覆盖下列任意字段：
+    {
+      "plan": {"steps": [...]},                 # 初始计划
+      "final_answer": "...",                    # 计划全部完成后 Replanner 返回的最终答案
+      "step_content": "...",                    # LLM 步骤的输出
+      "summary": "...",                         # 兜底总结的输出
+      "latency": {"plan": 1.0, "replan": 0.5}   # 按角色覆盖延迟（秒）
+    }
+本模块不依赖后端配置，只需要 fastapi 与 uvicorn。
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+import uuid
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+ROLE_PLAN = "plan"
+ROLE_REPLAN = "replan"
+ROLE_TOOL_ARGS = "tool-args"
+ROLE_LLM_STEP = "llm-step"
+ROLE_SUMMARY = "summary"
+
+# 按顺序匹配系统提示词中的角色标识（Replanner 须在 Planner 之前）
+ROLE_MARKERS: List[Tuple[str, str]] = [
+    ("Replanner", ROLE_REPLAN),
+    ("Planner", ROLE_PLAN),
+    ("参数生成", ROLE_TOOL_ARGS),
+    ("Final Answer Generator", ROLE_SUMMARY),
+    ("Executor", ROLE_LLM_STEP),
+]
+
+DEFAULT_SCRIPT: Dict[str, Any] = {
+    "plan": {
+        "steps": [
+            {"id": 1, "description": "搜索相关背景信息", "action_type": "TOOL", "tool_name": "web_search",
+             "tool_args": {"query": "背景信息"}, "depends_on": [], "decision_point": False},
+            {"id": 2, "description": "搜索最新数据", "action_type": "TOOL", "tool_name": "web_search",
+             "tool_args": {"query": "最新数据"}, "depends_on": [], "decision_point": False},
+            {"id": 3, "description": "综合搜索结果回答问题", "action_type": "LLM", "tool_name": None,
+             "tool_args": None, "depends_on": [1, 2], "decision_point": False},
+        ]
+    },
+    "final_answer": "这是桩服务返回的最终答案。",
+    "step_content": "这是桩服务返回的步骤执行结果。",
+    "summary": "这是桩服务返回的总结答案。",
+    "latency": {},
+}
+
+_PENDING_PATTERN = re.compile(r'"status"\s*:\s*"PENDING"')
+_STEP_DESCRIPTION_PATTERN = re.compile(r"## 当前步骤描述\s*\n\s*(.+)")
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 2)
+
+
+class StubBehavior:
+    """根据脚本生成各角色的响应，并模拟延迟"""
+    def __init__(self, script: Optional[Dict[str, Any]] = None, latency: float = 0.0, jitter: float = 0.0, seed: Optional[int] = None):
+        self.script = {**DEFAULT_SCRIPT, **(script or {})}
+        self.latency = latency
+        self.jitter = jitter
+        self.requests: Counter = Counter()
+        self._random = random.Random(seed)
+        self._prefixes: set = set()
+
+    def classify(self, messages: List[Dict[str, Any]]) -> str:
+        system = next((str(m.get("content", "")) for m in messages if m.get("role") == "system"), "")
+        for marker, role in ROLE_MARKERS:
+            if marker in system:
+                return role
+        return ROLE_LLM_STEP
+
+    def cached_tokens(self, messages: List[Dict[str, Any]]) -> int:
+        """模拟前缀缓存：以 system 消息为前缀，再次出现时视为命中"""
+        if not messages or messages[0].get("role") != "system":
+            return 0
+        prefix = str(messages[0].get("content", ""))
+        digest = hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+        if digest in self._prefixes:
+            return _estimate_tokens(prefix)
+        self._prefixes.add(digest)
+        return 0
+
+    def delay(self, role: str) -> float:
+        base = float(self.script.get("latency", {}).get(role, self.latency))
+        if self.jitter:
+            base *= 1 + self._random.uniform(-self.jitter, self.jitter)
+        return max(base, 0.0)
+
+    def respond(self, role: str, messages: List[Dict[str, Any]]) -> str:
+        text = "\n".join(str(m.get("content", "")) for m in messages)
+        if role == ROLE_PLAN:
+            return json.dumps(self.script["plan"], ensure_ascii=False)
+        if role == ROLE_REPLAN:
+            # 当前计划中已没有待执行步骤时给出最终答案，否则原样返回计划（步骤状态由 Planner 按 id 保留）
+            if _PENDING_PATTERN.search(text):
+                return json.dumps({**self.script["plan"], "final_answer": None}, ensure_ascii=False)
+            return json.dumps({"steps": [], "final_answer": self.script["final_answer"]}, ensure_ascii=False)
+        if role == ROLE_TOOL_ARGS:
+            match = _STEP_DESCRIPTION_PATTERN.search(text)
+            return json.dumps({"query": match.group(1).strip() if match else "query"}, ensure_ascii=False)
+        if role == ROLE_SUMMARY:
+            return self.script["summary"]
+        return json.dumps({"type": "message", "content": self.script["step_content"]}, ensure_ascii=False)
+
+
+def create_app(behavior: Optional[StubBehavior] = None) -> FastAPI:
+    behavior = behavior or StubBehavior()
+    app = FastAPI(title="PlanFlow LLM stub")
+    app.state.behavior = behavior
+
+    async def chat_completions(request: Request):
+        body = await request.json()
+        messages = body.get("messages") or []
+        model = body.get("model", "stub")
+        role = behavior.classify(messages)
+        behavior.requests[role] += 1
+
+        content = behavior.respond(role, messages)
+        prompt_tokens = sum(_estimate_tokens(str(m.get("content", ""))) for m in messages)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": _estimate_tokens(content),
+            "total_tokens": prompt_tokens + _estimate_tokens(content),
+            "prompt_tokens_details": {"cached_tokens": behavior.cached_tokens(messages)},
+        }
+        completion_id = f"chatcmpl-stub-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        await asyncio.sleep(behavior.delay(role))
+
+        if body.get("stream"):
+            include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+            return StreamingResponse(
+                _stream_chunks(completion_id, created, model, content, usage if include_usage else None),
+                media_type="text/event-stream"
+            )
+
+        return JSONResponse({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": usage,
+        })
+
+    app.add_api_route("/v1/chat/completions", chat_completions, methods=["POST"])
+    app.add_api_route("/chat/completions", chat_completions, methods=["POST"])
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": "stub", "object": "model", "owned_by": "planflow"}]}
+
+    @app.get("/stats")
+    async def stats():
+        """各角色收到的请求数"""
+        return dict(behavior.requests)
+
+    return app
+
+
+async def _stream_chunks(completion_id: str, created: int, model: str, content: str, usage: Optional[Dict[str, Any]]):
+    def chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None, chunk_usage=None) -> str:
+        choices = [] if chunk_usage else [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+        data = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model, "choices": choices}
+        if chunk_usage:
+            data["usage"] = chunk_usage
+        return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    yield chunk({"role": "assistant", "content": ""})
+    for i in range(0, len(content), 8):
+        yield chunk({"content": content[i:i + 8]})
+    yield chunk({}, finish_reason="stop")
+    if usage:
+        yield chunk({}, chunk_usage=usage)
+    yield "data: [DONE]\n\n"
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容桩服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", type=float, default=0.0, help="每次请求的模拟延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="延迟的随机浮动比例，如 0.2 表示 ±20%%")
+    parser.add_argument("--seed", type=int, default=None, help="延迟浮动的随机种子")
+    parser.add_argument("--script", default=None, help="脚本 JSON 文件路径")
+    args = parser.parse_args(argv)
+
+    script = None
+    if args.script:
+        with open(args.script, encoding="utf-8") as f:
+            script = json.load(f)
+
+    import uvicorn
+    uvicorn.run(create_app(StubBehavior(script, args.latency, args.jitter, args.seed)), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+根据工具函数签名生成参数 JSON Schema，并校验 Planner 给出的 tool_args
+校验通过且不引用前序步骤输出的参数可直接用于调用工具，省去一次参数生成的 LLM 调用。
+"""
+import inspect
+import re
+import typing
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional
+
+_JSON_TYPES = {
+    str: "string",
+    int: "integer",
+    float: "number",
+    bool: "boolean",
+    list: "array",
+    tuple: "array",
+    dict: "object",
+}
+
+# 参数值中引用前序步骤输出的常见写法：占位符、“步骤1的结果”、“上一步”等
+_STEP_REFERENCE = re.compile(
+    r"(\{\{.*?\}\}|\$\{.*?\}|<[^<>]*(step|result|步骤|结果)[^<>]*>"
+    r"|\bstep[ _-]?\d+\b|\bresult of step\b|\bprevious (step|result)\b"
+    r"|步骤\s*\d+|第\s*\d+\s*步|上一步|前一步|前面步骤|前序步骤|上述结果|搜索结果中)",
+    re.IGNORECASE
+)
+
+
+def _json_type(annotation: Any) -> Optional[Dict[str, Any]]:
+    """把类型注解转换为 JSON Schema 片段，无法识别时返回 None（不做类型约束）"""
+    if annotation is inspect.Parameter.empty or annotation is Any:
+        return None
+
+    origin = typing.get_origin(annotation)
+    if origin is typing.Union or type(annotation).__name__ == "UnionType":
+        options = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+        schemas = [_json_type(arg) for arg in options]
+        if any(schema is None for schema in schemas):
+            return None
+        types = [schema["type"] for schema in schemas]
+        if len(options) < len(typing.get_args(annotation)):
+            types.append("null")
+        return {"type": types[0] if len(types) == 1 else types}
+    if origin is typing.Literal:
+        return {"enum": list(typing.get_args(annotation))}
+
+    json_type = _JSON_TYPES.get(origin or annotation)
+    if json_type is None:
+        return None
+    schema: Dict[str, Any] = {"type": json_type}
+    args = typing.get_args(annotation)
+    if json_type == "array" and len(args) == 1:
+        items = _json_type(args[0])
+        if items:
+            schema["items"] = items
+    return schema
+
+
+@lru_cache(maxsize=None)
+def build_tool_schema(func: Callable) -> Dict[str, Any]:
+    """
+    由函数签名生成参数的 JSON Schema
+    无默认值的参数为必填；声明了 **kwargs 的函数允许额外参数
+    """
+    try:
+        hints = typing.get_type_hints(func)
+    except Exception:
+        hints = {}
+
+    properties: Dict[str, Any] = {}
+    required: List[str] = []
+    additional = False
+    for name, param in inspect.signature(func).parameters.items():
+        if param.kind == inspect.Parameter.VAR_KEYWORD:
+            additional = True
+            continue
+        if param.kind == inspect.Parameter.VAR_POSITIONAL:
+            continue
+        properties[name] = _json_type(hints.get(name, param.annotation)) or {}
+        if param.default is inspect.Parameter.empty:
+            required.append(name)
+
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": required,
+        "additionalProperties": additional,
+    }
+
+
+def _matches_type(value: Any, json_type: Any) -> bool:
+    if isinstance(json_type, list):
+        return any(_matches_type(value, t) for t in json_type)
+    if json_type == "null":
+        return value is None
+    if json_type == "string":
+        return isinstance(value, str)
+    if json_type == "boolean":
+        return isinstance(value, bool)
+    if json_type == "integer":
+        return isinstance(value, int) and not isinstance(value, bool)
+    if json_type == "number":
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    if json_type == "array":
+        return isinstance(value, list)
+    if json_type == "object":
+        return isinstance(value, dict)
+    return True
+
+
+def validate_args(schema: Dict[str, Any], args: Any) -> List[str]:
+    """
+    按 build_tool_schema 生成的 Schema 校验参数
+    :return: 错误信息列表，为空表示校验通过
+    """
+    if not isinstance(args, dict):
+        return ["参数必须是 JSON 对象"]
+
+    errors = []
+    properties = schema.get("properties", {})
+    for name in schema.get("required", []):
+        value = args.get(name)
+        if value is None or (isinstance(value, str) and not value.strip()):
+            errors.append(f"缺少必填参数 {name}")
+
+    for name, value in args.items():
+        prop = properties.get(name)
+        if prop is None:
+            if not schema.get("additionalProperties", False):
+                errors.append(f"未知参数 {name}")
+            continue
+        if "enum" in prop and value not in prop["enum"]:
+            errors.append(f"参数 {name} 取值必须是 {prop['enum']} 之一")
+        elif "type" in prop and not _matches_type(value, prop["type"]):
+            errors.append(f"参数 {name} 类型应为 {prop['type']}")
+        elif isinstance(value, list) and "type" in prop.get("items", {}):
+            if not all(_matches_type(item, prop["items"]["type"]) for item in value):
+                errors.append(f"参数 {name} 的元素类型应为 {prop['items']['type']}")
+    return errors
+
+
+def references_step_output(args: Any) -> bool:
+    """参数值中是否出现引用前序步骤输出的占位符或描述"""
+    if isinstance(args, str):
+        return bool(_STEP_REFERENCE.search(args))
+    if isinstance(args, dict):
+        return any(references_step_output(value) for value in args.values())
+    if isinstance(args, (list, tuple)):
+        return any(references_step_output(value) for value in args)
+    return False
@@ -1,4 +1,16 @@
+import contextvars
+import logging
+import re
+import threading
+import unicodedata
 import warnings
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+from agent.cache import TieredCache
+from agent.tracing import span
+from core.config import settings
 
 try:
     # 优先尝试导入新包名 ddgs
@@ -12,6 +24,109 @@ except ImportError:
     except ImportError:
         DDGS = None
 
+logger = logging.getLogger(__name__)
+
+# 每个线程复用一个 DDGS 会话，避免每次搜索都重新建立连接
+_local = threading.local()
+_cache_lock = threading.Lock()
+_search_cache: Optional[TieredCache] = None
+# 批量搜索共用的线程池
+_batch_pool: Optional[ThreadPoolExecutor] = None
+# 进程内同时进行的搜索请求上限，单次搜索与批量搜索中的每个查询都要先取得名额
+_search_slots: Optional[threading.BoundedSemaphore] = None
+
+
+# 句子级标点：中文句读符号总是去除；半角标点（含 NFKC 转换后的全角标点）不在两个字母 / 数字之间时去除，
+# 因此 node.js、3.14、1,000 中的标点保留，C# / C++ 等符号不属于句子级标点，也保留
+_SENTENCE_PUNCT = re.compile(r"[。、]+|(?<![0-9a-z])[.,!?;:]+|[.,!?;:]+(?![0-9a-z])")
+
+
+def normalize_query(query: str) -> str:
+    """
+    规范化搜索词，作为缓存键
+    统一全半角与大小写，去除句末与句间的标点，合并多余空白；词内的符号保留（C# / C++ / node.js）
+    """
+    text = unicodedata.normalize("NFKC", query).lower()
+    text = _SENTENCE_PUNCT.sub(" ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def get_search_cache() -> Optional[TieredCache]:
+    """获取进程内共享的搜索结果缓存，未启用时返回 None"""
+    global _search_cache
+    if not settings.search_cache_enabled:
+        return None
+    if _search_cache is None:
+        with _cache_lock:
+            if _search_cache is None:
+                _search_cache = TieredCache(
+                    namespace="web_search",
+                    max_entries=settings.search_cache_max_entries,
+                    ttl=settings.search_cache_ttl,
+                    db_path=settings.cache_db_path if settings.search_cache_persist else None
+                )
+    return _search_cache
+
+
+def _get_batch_pool() -> ThreadPoolExecutor:
+    global _batch_pool
+    if _batch_pool is None:
+        with _cache_lock:
+            if _batch_pool is None:
+                _batch_pool = ThreadPoolExecutor(
+                    max_workers=max(1, settings.search_max_concurrency),
+                    thread_name_prefix="web-search"
+                )
+    return _batch_pool
+
+
+def _get_search_slots() -> threading.BoundedSemaphore:
+    global _search_slots
+    if _search_slots is None:
+        with _cache_lock:
+            if _search_slots is None:
+                _search_slots = threading.BoundedSemaphore(max(1, settings.search_max_concurrency))
+    return _search_slots
+
+
+def normalize_url(url: str) -> str:
+    """规范化链接用于去重：忽略协议、www 前缀、锚点与末尾斜杠"""
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    return urlunsplit(("", host, parts.path.rstrip("/"), parts.query, ""))
+
+
+def _get_ddgs():
+    ddgs = getattr(_local, "ddgs", None)
+    if ddgs is None:
+        ddgs = DDGS(timeout=settings.search_request_timeout)
+        _local.ddgs = ddgs
+    return ddgs
+
+
+def _search(query: str, max_results: int = 3) -> List[Dict[str, str]]:
+    """执行搜索并返回原始结果列表，相同（规范化后）的查询直接命中缓存"""
+    cache = get_search_cache()
+    key = f"{max_results}:{normalize_query(query)}"
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    # 缓存未命中才占用并发名额，命中缓存的查询不排队
+    with _get_search_slots(), span("ddgs.search", query=query, max_results=max_results):
+        results = [
+            {"title": r.get("title", ""), "href": r.get("href", ""), "body": r.get("body", "")}
+            for r in _get_ddgs().text(query, max_results=max_results)
+        ]
+
+    if cache is not None:
+        cache.set(key, results)
+    return results
+
+
 def web_search(query: str) -> str:
     """
     使用网络搜索引擎查找信息。
@@ -24,14 +139,92 @@ def web_search(query: str) -> str:
     """
     if DDGS:
         try:
-            with DDGS() as ddgs:
-                results = list(ddgs.text(query, max_results=3))
-                # print(f"关于{query} 的搜索，获得信息：{results}")
-                if not results:
-                    return f"未找到关于 '{query}' 的结果。"
-                return "\n\n".join([f"标题: {r['title']}\n链接: {r['href']}\n摘要: {r['body']}" for r in results])
-        except Exception as e:
-            return f"搜索出错: {str(e)}"
+            results = _search(query)
+            # print(f"关于{query} 的搜索，获得信息：{results}")
+            if not results:
+                return f"未找到关于 '{query}' 的结果。"
+            return _format_results(results)
+        except Exception:
+            # 会话出错后丢弃，下次搜索重新创建；错误交给调用方（重试 / 熔断 / 标记步骤失败）处理
+            _local.ddgs = None
+            raise
     else:
         # Mock implementation if library is missing
         return f"[模拟搜索结果] 关于 '{query}' 的相关信息：\n1. 这是一个模拟的搜索结果条目。\n2. 请安装 duckduckgo-search 库以启用真实搜索。"
+
+
+def _format_results(results: List[Dict[str, str]]) -> str:
+    return "\n\n".join([f"标题: {r['title']}\n链接: {r['href']}\n摘要: {r['body']}" for r in results])
+
+
+def _search_one(query: str, max_results: int) -> Optional[List[Dict[str, str]]]:
+    """批量搜索中的单个查询，出错时返回 None，不影响其它查询"""
+    try:
+        return _search(query, max_results=max_results)
+    except Exception as e:
+        _local.ddgs = None
+        logger.warning(f"搜索 '{query}' 出错: {e}")
+        return None
+
+
+def merge_search_results(result_lists: List[List[Dict[str, str]]], limit: int, k: int = 60) -> List[Dict[str, str]]:
+    """
+    合并多个查询的搜索结果：按链接去重，并以倒数排名融合（RRF）排序
+    同一链接出现在多个查询的结果中、或排名越靠前，得分越高
+    """
+    merged: Dict[str, Dict] = {}
+    for query_index, results in enumerate(result_lists):
+        for rank, result in enumerate(results):
+            key = normalize_url(result.get("href", "")) or f"{query_index}:{rank}"
+            entry = merged.get(key)
+            if entry is None:
+                entry = merged[key] = {"result": result, "score": 0.0, "first_seen": (rank, query_index)}
+            entry["score"] += 1.0 / (k + rank + 1)
+            # 同一链接保留摘要更长的一条
+            if len(result.get("body", "")) > len(entry["result"].get("body", "")):
+                entry["result"] = result
+
+    ranked = sorted(merged.values(), key=lambda e: (-e["score"], e["first_seen"]))
+    return [entry["result"] for entry in ranked[:limit]]
+
+
+def web_search_batch(queries: List[str]) -> str:
+    """
+    同时使用多个关键词进行网络搜索，合并去重后返回一份按相关度排序的结果。
+    需要从多个角度或多个来源检索同一问题时使用，比多次调用 web_search 更快。
+
+    Args:
+        queries: 搜索关键词或问题的列表，例如 ["2025 考研 国家线", "2025 考研 软件工程 复试线"]。
+
+    Returns:
+        str: 合并后的搜索结果摘要信息。
+    """
+    # 规范化后相同的查询只搜索一次
+    unique_queries: List[str] = []
+    seen = set()
+    for query in queries or []:
+        normalized = normalize_query(str(query))
+        if normalized and normalized not in seen:
+            seen.add(normalized)
+            unique_queries.append(str(query))
+    unique_queries = unique_queries[:settings.search_batch_max_queries]
+
+    if not unique_queries:
+        return "未提供有效的搜索关键词。"
+    if not DDGS:
+        return "\n\n".join(web_search(query) for query in unique_queries)
+
+    # 每个查询在当前上下文的副本中运行，追踪 span 挂在本次工具调用之下
+    pool = _get_batch_pool()
+    futures = [
+        pool.submit(contextvars.copy_context().run, _search_one, query, settings.search_batch_results_per_query)
+        for query in unique_queries
+    ]
+    result_lists = [future.result() for future in futures]
+    if all(results is None for results in result_lists):
+        raise RuntimeError(f"全部 {len(unique_queries)} 个搜索请求均失败")
+
+    results = merge_search_results([r for r in result_lists if r is not None], settings.search_batch_max_results)
+    if not results:
+        return f"未找到关于 {unique_queries} 的结果。"
+    return f"搜索关键词: {'; '.join(unique_queries)}\n\n" + _format_results(results)
@@ -0,0 +1,277 @@
+"""
+运行链路追踪
+以 span 记录一次 Agent 运行中规划、执行、工具、LLM 与数据库操作的耗时及父子关系。
+- 当前 span 保存在 contextvars 中，协程任务与（复制了上下文的）线程自动继承父 span
+- span 结束时交给导出器，默认追加写入本地 JSONL 文件，可通过 settings.trace_exporter 替换
+- 命令行查看某次运行的时间线：python -m agent.tracing <run_id>
+"""
+import argparse
+import contextvars
+import importlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    """一次被追踪的操作"""
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "start", "end", "attributes", "status", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None, attributes: Optional[Dict[str, Any]] = None):
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.time()
+        self.end: Optional[float] = None
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.status = "ok"
+        self.error: Optional[str] = None
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else time.time()) - self.start
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "end": self.end,
+            "duration": round(self.duration, 6),
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class SpanExporter:
+    """导出器接口：span 结束时调用 export"""
+    def export(self, span: Span):
+        raise NotImplementedError
+
+    def shutdown(self):
+        pass
+
+
+class NoopSpanExporter(SpanExporter):
+    def export(self, span: Span):
+        pass
+
+
+class JsonlSpanExporter(SpanExporter):
+    """每个 span 一行 JSON，追加写入本地文件"""
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def export(self, span: Span):
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str)
+        with self._lock:
+            try:
+                if self._file is None:
+                    directory = os.path.dirname(self.path)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    self._file = open(self.path, "a", encoding="utf-8")
+                self._file.write(line + "\n")
+                self._file.flush()
+            except OSError as e:
+                logger.warning(f"写入追踪文件 {self.path} 失败: {e}")
+
+    def shutdown(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+_exporter: Optional[SpanExporter] = None
+_exporter_lock = threading.Lock()
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("planflow_current_span", default=None)
+
+
+def _create_exporter() -> SpanExporter:
+    """
+    根据配置创建导出器
+    trace_exporter 取值：jsonl（默认）/ none / 形如 "package.module:factory" 的自定义导出器工厂
+    """
+    name = (settings.trace_exporter or "none").strip()
+    if not settings.tracing_enabled or name == "none":
+        return NoopSpanExporter()
+    if name == "jsonl":
+        return JsonlSpanExporter(settings.trace_file_path)
+
+    module_name, _, attr = name.partition(":")
+    try:
+        factory = getattr(importlib.import_module(module_name), attr)
+        return factory()
+    except Exception as e:
+        logger.warning(f"加载追踪导出器 {name} 失败，追踪已禁用: {e}")
+        return NoopSpanExporter()
+
+
+def get_exporter() -> SpanExporter:
+    global _exporter
+    if _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                _exporter = _create_exporter()
+    return _exporter
+
+
+def set_exporter(exporter: Optional[SpanExporter]):
+    """替换当前导出器，传入 None 时下次使用前按配置重新创建"""
+    global _exporter
+    with _exporter_lock:
+        previous, _exporter = _exporter, exporter
+    if previous is not None and previous is not exporter:
+        previous.shutdown()
+
+
+def shutdown_tracing():
+    set_exporter(None)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def current_trace_id() -> Optional[str]:
+    span = _current_span.get()
+    return span.trace_id if span else None
+
+
+@contextmanager
+def span(name: str, trace_id: Optional[str] = None, **attributes: Any) -> Iterator[Span]:
+    """
+    记录一个 span，自动挂到当前 span 之下
+    没有父 span 且未指定 trace_id 时开启一条新的链路
+    """
+    parent = _current_span.get()
+    if trace_id is None:
+        trace_id = parent.trace_id if parent else uuid.uuid4().hex
+    current = Span(name, trace_id, parent.span_id if parent and parent.trace_id == trace_id else None, attributes)
+
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.status = "error"
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.end = time.time()
+        _current_span.reset(token)
+        try:
+            get_exporter().export(current)
+        except Exception as e:
+            logger.warning(f"导出 span {name} 失败: {e}")
+
+
+def record_span(name: str, duration: float, status: str = "ok", **attributes: Any):
+    """
+    补记一个刚刚结束的叶子 span（如 LLM 调用），挂到当前 span 之下
+    无当前 span 时不记录，避免产生孤立的链路
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return
+    finished = Span(name, parent.trace_id, parent.span_id, attributes)
+    finished.end = time.time()
+    finished.start = finished.end - duration
+    finished.status = status
+    try:
+        get_exporter().export(finished)
+    except Exception as e:
+        logger.warning(f"导出 span {name} 失败: {e}")
+
+
+def load_trace(trace_id: str, path: Optional[str] = None) -> List[Dict[str, Any]]:
+    """从 JSONL 文件中读取某次运行的全部 span"""
+    spans = []
+    with open(path or settings.trace_file_path, encoding="utf-8") as f:
+        for line in f:
+            if trace_id not in line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("trace_id") == trace_id:
+                spans.append(record)
+    return spans
+
+
+def format_timeline(spans: List[Dict[str, Any]], width: int = 50) -> str:
+    """
+    将 span 渲染为火焰图风格的时间线
+    按父子关系缩进，每行的条形按开始时间与耗时映射到整条链路的时间范围
+    """
+    if not spans:
+        return "未找到该运行的追踪记录"
+
+    children: Dict[Optional[str], List[Dict[str, Any]]] = {}
+    ids = {s["span_id"] for s in spans}
+    for s in spans:
+        parent = s.get("parent_id") if s.get("parent_id") in ids else None
+        children.setdefault(parent, []).append(s)
+    for group in children.values():
+        group.sort(key=lambda s: s["start"])
+
+    origin = min(s["start"] for s in spans)
+    total = max(s["start"] + s["duration"] for s in spans) - origin or 1e-9
+
+    rows = []
+
+    def walk(node: Dict[str, Any], depth: int):
+        begin = int((node["start"] - origin) / total * width)
+        length = max(1, int(round(node["duration"] / total * width)))
+        bar = " " * begin + "█" * min(length, width - begin)
+        attrs = " ".join(f"{k}={v}" for k, v in (node.get("attributes") or {}).items())
+        label = ("  " * depth + node["name"] + (f" [{attrs}]" if attrs else ""))[:60]
+        mark = " !" if node.get("status") == "error" else ""
+        rows.append(f"{label:<60} {node['duration']:>8.3f}s |{bar:<{width}}|{mark}")
+        for child in children.get(node["span_id"], []):
+            walk(child, depth + 1)
+
+    for root in children.get(None, []):
+        walk(root, 0)
+
+    header = f"trace {spans[0]['trace_id']}  共 {len(spans)} 个 span，总耗时 {total:.3f}s"
+    return header + "\n" + "\n".join(rows)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="打印一次 Agent 运行的追踪时间线")
+    parser.add_argument("run_id", help="运行ID（即 trace_id）")
+    parser.add_argument("--file", default=None, help="追踪文件路径，默认使用 settings.trace_file_path")
+    parser.add_argument("--width", type=int, default=50, help="时间线宽度（字符数）")
+    args = parser.parse_args(argv)
+
+    try:
+        spans = load_trace(args.run_id, args.file)
+    except FileNotFoundError as e:
+        print(f"追踪文件不存在: {e.filename}", file=sys.stderr)
+        sys.exit(1)
+    print(format_timeline(spans, args.width))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,53 @@
+import asyncio
+import logging
+import uuid
+from typing import Optional, Tuple
+
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
+from core.constants import AGENT_FALLBACK_ANSWER, AGENT_JOB_RETRY_AFTER, DEFAULT_AGENT_MAX_STEPS, LLM_OVERLOAD_RETRY_AFTER
 from core.mysql import get_db
 from services.UserService import get_current_user
 from models.UserModel import User
 from models.TasksModel import Task
 from models.ChatModel import Chat
-from schemas.ChatSchema import ChatRequest, ChatResponse
-from agent.manager import AgentManager
+from schemas.ChatSchema import ChatRequest, ChatResponse, ChatJobResponse, ChatJobStatus
+from agent.checkpoint import CheckpointNotFound, get_checkpoint_store
+from agent.concurrency import LLMQueueTimeout, bind_llm_user
+from agent.manager import AsyncAgentManager
+from services.AgentService import (
+    AgentJob,
+    JobQueueFull,
+    discard_checkpoint,
+    is_run_active,
+    job_manager,
+    save_chat_message,
+    stream_agent_run
+)
+from services.MemoryService import memory_store
+from services.RateLimitService import limit_chat_submission
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
-@router.post("/chat", response_model=ChatResponse)
-async def chat(
-    request: ChatRequest,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
+def _find_task(db: Session, task_id: Optional[int], user_id: int) -> Optional[Task]:
+    return db.query(Task).filter(Task.id == task_id, Task.user_id == user_id).first()
+
+def _prepare_task(request: ChatRequest, current_user: User, db: Session) -> Tuple[Task, str]:
+    """
+    Load or create the task and save the user message
+    Returns the task and the rendered memory of its earlier conversation ("" for a new task)
+    Blocking database work: async routes run it in a worker thread
+    """
     # 1. Handle Task
+    context = ""
     if request.task_id:
-        task = db.query(Task).filter(Task.id == request.task_id, Task.user_id == current_user.id).first()
+        task = _find_task(db, request.task_id, current_user.id)
         if not task:
             raise HTTPException(status_code=404, detail="Task not found")
+        # Load earlier turns before saving this message, so the question itself is not part of the memory
+        context = memory_store.load(db, task.id)
     else:
         # Create new task
         task = Task(
@@ -39,23 +66,41 @@ async def chat(
     )
     db.add(user_chat)
     db.commit()
+    return task, context
+
+@router.post("/chat", response_model=ChatResponse)
+async def chat(
+    request: ChatRequest,
+    current_user: User = Depends(limit_chat_submission),
+    db: Session = Depends(get_db)
+):
+    # 1. Handle Task & 2. Save User Message
+    task, context = await asyncio.to_thread(_prepare_task, request, current_user, db)
 
     # 3. Run Agent
     # Initialize AgentManager with a max step limit
-    agent = AgentManager(max_steps=10)
+    agent = AsyncAgentManager(max_steps=DEFAULT_AGENT_MAX_STEPS)
+    run_id = uuid.uuid4().hex
     
     try:
-        # Run the agent
-        agent_state = agent.run(request.message)
+        # Run the agent (async, does not block the event loop); its LLM calls queue fairly under this user
+        # The checkpoint carries the task id so an interrupted run can be resumed by its owner
+        with bind_llm_user(current_user.id):
+            agent_state = await agent.run(
+                request.message, context=context, run_id=run_id, metadata={"task_id": task.id}
+            )
         
         # Extract final answer
         final_answer = agent_state.current_plan.final_answer
         if not final_answer:
-            final_answer = "抱歉，我无法完成您的请求，请稍后再试。"
+            final_answer = AGENT_FALLBACK_ANSWER
             
+    except LLMQueueTimeout:
+        # LLM capacity is exhausted: back-pressure, not a server error
+        raise _overloaded_error()
     except Exception as e:
         # Handle any errors during agent execution
-        print(f"Agent execution error: {e}")
+        logger.error(f"Agent execution error: {e}", exc_info=True)
         final_answer = f"处理请求时发生错误: {str(e)}"
         # We might want to return a partial state or just the error
         # For now, we'll construct a minimal state or just proceed
@@ -67,17 +112,152 @@ async def chat(
         # But let's stick to the happy path + basic error handling.
         raise HTTPException(status_code=500, detail=f"Agent execution failed: {str(e)}")
 
-    # 4. Save Assistant Message
-    assistant_chat = Chat(
-        task_id=task.id,
-        role="assistant",
-        content=final_answer
-    )
-    db.add(assistant_chat)
-    db.commit()
+    # 4. Save Assistant Message (in a worker thread, like the streaming and job paths)
+    await asyncio.to_thread(save_chat_message, task.id, "assistant", final_answer, agent_state.run_id)
+    # The answer is saved, the run no longer needs to be resumable
+    await asyncio.to_thread(discard_checkpoint, run_id)
 
     # 5. Return Response
     return ChatResponse(
         task_id=task.id,
         final_answer=final_answer
     )
+
+@router.post("/chat/stream")
+async def chat_stream(
+    request: ChatRequest,
+    current_user: User = Depends(limit_chat_submission),
+    db: Session = Depends(get_db)
+):
+    """
+    Streaming variant of /chat (Server-Sent Events).
+    Events: task, plan, step_started, step_finished, replan, answer_delta, done / error
+    """
+    task, context = await asyncio.to_thread(_prepare_task, request, current_user, db)
+    agent = AsyncAgentManager(max_steps=DEFAULT_AGENT_MAX_STEPS)
+
+    return StreamingResponse(
+        stream_agent_run(agent, request.message, task.id, context, user_id=current_user.id),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # disable proxy buffering (nginx)
+        }
+    )
+
+@router.post("/chat/runs/{run_id}/resume")
+async def resume_chat_run(
+    run_id: str,
+    current_user: User = Depends(limit_chat_submission),
+    db: Session = Depends(get_db)
+):
+    """
+    Resume an interrupted run from its last checkpoint (Server-Sent Events, same events as /chat/stream).
+    The run_id comes from the "task" event of /chat/stream or from the job status.
+    Finished steps are not executed again; the checkpoint is removed once the answer is saved.
+    """
+    store = get_checkpoint_store()
+    try:
+        if store is None:
+            raise CheckpointNotFound(run_id)
+        metadata = await asyncio.to_thread(store.metadata, run_id)
+    except CheckpointNotFound:
+        raise HTTPException(status_code=404, detail="Run not found")
+
+    task = await asyncio.to_thread(_find_task, db, metadata.get("task_id"), current_user.id)
+    if not task:
+        raise HTTPException(status_code=404, detail="Run not found")
+    if is_run_active(run_id):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Run is still in progress")
+
+    agent = AsyncAgentManager(max_steps=DEFAULT_AGENT_MAX_STEPS)
+    return StreamingResponse(
+        stream_agent_run(agent, "", task.id, resume_run_id=run_id, user_id=current_user.id),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        }
+    )
+
+def _queue_full_error() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Agent job queue is full, please retry later",
+        headers={"Retry-After": str(AGENT_JOB_RETRY_AFTER)}
+    )
+
+def _overloaded_error() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="The agent is overloaded, please retry later",
+        headers={"Retry-After": str(LLM_OVERLOAD_RETRY_AFTER)}
+    )
+
+def _get_job(job_id: str, current_user: User) -> AgentJob:
+    job = job_manager.get(job_id)
+    if not job or job.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.post("/chat/jobs", response_model=ChatJobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def submit_chat_job(
+    request: ChatRequest,
+    current_user: User = Depends(limit_chat_submission),
+    db: Session = Depends(get_db)
+):
+    """
+    Submit a chat to the background job queue and return immediately.
+    Poll /chat/jobs/{job_id} or subscribe to /chat/jobs/{job_id}/events for the result.
+    """
+    # Reject before touching the task so a rejected request leaves no trace
+    if job_manager.is_full():
+        raise _queue_full_error()
+
+    task, context = await asyncio.to_thread(_prepare_task, request, current_user, db)
+    try:
+        job = job_manager.submit(user_id=current_user.id, task_id=task.id, message=request.message, context=context)
+    except JobQueueFull:
+        raise _queue_full_error()
+
+    return ChatJobResponse(
+        job_id=job.id,
+        task_id=task.id,
+        run_id=job.run_id,
+        status=job.status,
+        queue_position=job_manager.queue_depth()
+    )
+
+@router.get("/chat/jobs/{job_id}", response_model=ChatJobStatus)
+async def get_chat_job(
+    job_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    job = _get_job(job_id, current_user)
+    return ChatJobStatus(
+        job_id=job.id,
+        task_id=job.task_id,
+        run_id=job.run_id,
+        status=job.status,
+        final_answer=job.final_answer,
+        error=job.error,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at
+    )
+
+@router.get("/chat/jobs/{job_id}/events")
+async def subscribe_chat_job(
+    job_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Subscribe to a job's events (Server-Sent Events), replaying those already emitted"""
+    job = _get_job(job_id, current_user)
+    return StreamingResponse(
+        job_manager.subscribe(job),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        }
+    )
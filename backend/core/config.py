@@ -1,6 +1,6 @@
 from pydantic_settings import BaseSettings
 from pydantic import field_validator, model_validator, Field
-from typing import Optional
+from typing import Dict, Optional
 import secrets
 import logging
 
@@ -38,6 +38,111 @@ class Settings(BaseSettings):
     # LLM API Key
     dashscope_api_key: Optional[str] = Field(default=None, validation_alias="DASHSCOPE_API_KEY")
 
+    # LLM 客户端配置（进程内共享连接池）
+    llm_base_url: str = Field(
+        default="https://dashscope.aliyuncs.com/compatible-mode/v1",
+        validation_alias="LLM_BASE_URL",
+        description="OpenAI兼容接口的基础URL"
+    )
+    llm_max_connections: int = 100  # 连接池最大连接数
+    llm_max_keepalive_connections: int = 20  # 最大空闲保活连接数
+    llm_keepalive_expiry: float = 30.0  # 空闲连接保活时间（秒）
+    llm_timeout: float = 120.0  # 单次请求超时时间（秒）
+    llm_connect_timeout: float = 10.0  # 建立连接超时时间（秒）
+    llm_max_retries: int = 2  # SDK内置重试次数
+    llm_max_concurrency: int = 16  # 进程内同时进行的LLM请求上限，按用户轮转分配，0 表示不限制
+    llm_queue_timeout: float = 120.0  # 等待LLM并发名额的最长时间（秒），0 表示一直等待
+    llm_transport_mode: str = "live"  # live: 直接请求; record: 请求并录制响应; replay: 只从录制的 fixture 回放，不访问网络
+    llm_fixture_dir: str = "fixtures/llm"  # record / replay 模式下的 fixture 目录
+
+    # 按调用角色（plan / replan / tool-args / llm-step / summary）选择模型
+    # replan 会在任务完成时直接给出面向用户的 final_answer，因此默认与 plan / summary 一样使用默认模型，
+    # 只有参数生成这类机械性的调用默认使用便宜的模型
+    llm_model: str = "qwen-plus"  # 未单独配置的角色使用的默认模型
+    llm_role_models: Dict[str, str] = {"tool-args": "qwen-turbo"}  # 按角色覆盖模型，如 {"summary": "qwen-max"}
+    llm_escalation_models: Dict[str, str] = {"tool-args": "qwen-plus"}  # 返回的 JSON 校验失败时改用的更强模型，为空则不升级
+
+    # 本地缓存配置
+    cache_db_path: Optional[str] = ".cache/planflow_cache.sqlite3"  # 持久化缓存的SQLite文件，为空则只使用内存缓存
+    llm_cache_enabled: bool = True  # 是否缓存LLM响应
+    llm_cache_ttl: float = 3600  # LLM响应缓存有效期（秒）
+    llm_cache_max_entries: int = 512  # 内存中最多缓存的LLM响应数
+    llm_cache_max_disk_entries: int = 10000  # 磁盘中最多缓存的LLM响应数
+    search_cache_enabled: bool = True  # 是否缓存网络搜索结果
+    search_cache_ttl: float = 1800  # 搜索结果缓存有效期（秒）
+    search_cache_max_entries: int = 1024  # 内存中最多缓存的搜索结果数
+    search_cache_persist: bool = False  # 是否将搜索结果持久化到 cache_db_path
+    plan_cache_enabled: bool = True  # 是否对形态相同（只有数字不同）的目标复用已成功执行的计划
+    plan_cache_max_entries: int = 512  # 计划缓存最多索引的目标数
+
+    # 工具调用容错配置
+    tool_timeout: float = 20.0  # 工具默认执行时限（秒），0 表示不限时
+    tool_timeouts: Dict[str, float] = {"web_search_batch": 40.0}  # 按工具名覆盖执行时限
+    tool_max_retries: int = 2  # 瞬时错误的最大重试次数
+    tool_retry_backoff: float = 0.5  # 重试退避基数（秒），按指数增长并加入随机抖动
+    tool_retry_backoff_max: float = 4.0  # 单次退避等待的上限（秒）
+    tool_breaker_failure_threshold: int = 5  # 连续失败多少次后熔断
+    tool_breaker_reset_timeout: float = 30.0  # 熔断后多久放行试探调用（秒）
+    tool_max_workers: int = 32  # 同步执行工具的线程池大小
+
+    # 批量搜索配置
+    search_request_timeout: int = 10  # 单次 DDGS 请求超时（秒）
+    search_max_concurrency: int = 4  # 进程内同时进行的搜索请求上限（单次搜索与批量搜索共用）
+    search_batch_max_queries: int = 5  # 单次批量搜索最多执行的查询数
+    search_batch_results_per_query: int = 5  # 每个查询取回的结果数
+    search_batch_max_results: int = 8  # 合并去重后返回的结果数
+
+    # 执行历史渲染配置
+    history_token_budget: int = 3000  # Prompt中执行历史部分的token预算
+    history_recent_steps: int = 3  # 最近多少个步骤保留完整输出
+    history_preview_chars: int = 200  # 较早步骤保留的输出字符数
+
+    # 同一任务的对话记忆配置
+    memory_enabled: bool = True  # 后续提问是否携带同一任务之前的对话
+    memory_window_messages: int = 6  # 保留原文的最近消息数
+    memory_token_budget: int = 1500  # Prompt中对话记忆部分的token预算
+    memory_brief_chars: int = 120  # 滚动摘要中每条较早消息保留的字符数
+    memory_max_summary_lines: int = 50  # 滚动摘要最多保留的行数
+    memory_load_limit: int = 50  # 每次从数据库加载的最大消息数
+    memory_cache_tasks: int = 256  # 进程内缓存对话记忆的任务数
+
+    # 运行检查点配置
+    checkpoint_enabled: bool = True  # 是否在每步结束后追加写入 AgentState 检查点，用于崩溃后恢复运行
+    checkpoint_dir: str = ".cache/checkpoints"  # 检查点文件目录，每次运行一个 <run_id>.jsonl
+    checkpoint_fsync: bool = False  # 每次写入后是否 fsync，开启后可抵御断电但每步多一次磁盘同步
+    checkpoint_retention_hours: float = 24  # 检查点文件保留时间，写入时定期清理过期文件
+    checkpoint_prune_interval: float = 600  # 两次清理过期检查点之间的最小间隔（秒）
+
+    # 步骤输出外置存储配置
+    output_store_enabled: bool = True  # 是否把过大的步骤输出移出内存，写入按内容寻址的本地存储
+    output_store_dir: str = ".cache/outputs"  # 外置输出的存储目录
+    output_inline_chars: int = 4000  # 输出不超过该字符数时保留在内存中
+    output_preview_chars: int = 500  # 外置输出在执行记录中保留的预览字符数
+    output_store_retention_hours: float = 24  # 外置输出的保留时间，应不短于检查点的保留时间；写入时定期清理过期的 blob
+    output_store_prune_interval: float = 600  # 两次清理过期 blob 之间的最小间隔（秒）
+
+    # 重规划策略配置
+    replan_mode: str = "conditional"  # always: 每步后重规划; conditional: 仅在失败/决策步骤/每K步/计划耗尽时重规划
+    replan_every_k: int = 0  # conditional 模式下每执行K个步骤强制重规划一次，0 表示不启用
+    speculative_execution: bool = False  # 重规划期间是否推测执行下一个待执行步骤
+    reuse_planner_tool_args: bool = True  # Planner 给出的 tool_args 校验通过时直接调用工具，不再用 LLM 生成参数
+
+    # 聊天提交的限流配置（每个用户一个令牌桶）
+    rate_limit_enabled: bool = True  # 是否限制每个用户提交聊天的频率
+    chat_rate_per_minute: float = 6.0  # 每个用户每分钟补充的令牌数（持续提交速率）
+    chat_burst: int = 3  # 令牌桶容量，即允许的突发提交数
+    rate_limit_max_users: int = 10000  # 进程内保留令牌桶的用户数，超出时淘汰最久未提交的用户
+
+    # 后台任务队列配置
+    agent_job_workers: int = 4  # 同时运行的Agent任务数
+    agent_job_queue_size: int = 100  # 排队任务上限，超出后拒绝提交（429）
+    agent_job_result_ttl: int = 3600  # 已结束任务的状态保留时间（秒）
+
+    # 运行追踪配置
+    tracing_enabled: bool = True  # 是否记录运行链路 span
+    trace_exporter: str = "jsonl"  # jsonl: 写入本地文件; none: 不导出; 或 "package.module:factory" 形式的自定义导出器
+    trace_file_path: str = ".cache/traces.jsonl"  # jsonl 导出器的输出文件
+
     # 环境配置
     environment: str = "development"  # development, production, testing
     
@@ -49,6 +154,15 @@ class Settings(BaseSettings):
         case_sensitive = False
         extra = "ignore"  # 忽略额外的环境变量，避免部署时出错
     
+    @field_validator("llm_transport_mode")
+    @classmethod
+    def check_llm_transport_mode(cls, value: str) -> str:
+        """LLM 请求模式只能是 live / record / replay"""
+        value = value.strip().lower()
+        if value not in ("live", "record", "replay"):
+            raise ValueError(f"llm_transport_mode 必须是 live、record 或 replay，当前为 {value}")
+        return value
+
     @model_validator(mode='after')
     def build_database_url(self):
         """从独立配置项构建数据库URL"""
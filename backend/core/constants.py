@@ -70,6 +70,17 @@ DB_POOL_TIMEOUT = 30
 DB_POOL_RECYCLE = 3600  # 1小时
 
 
+# ===================================
+# Agent 运行相关常量
+# ===================================
+DEFAULT_AGENT_MAX_STEPS = 10
+SSE_HEARTBEAT_INTERVAL = 15  # 流式响应的心跳间隔（秒），防止代理因长时间无数据断开连接
+AGENT_FALLBACK_ANSWER = "抱歉，我无法完成您的请求，请稍后再试。"
+AGENT_JOB_MAX_EVENTS = 1000  # 每个后台任务保留的事件数，供晚到的订阅者回放
+AGENT_JOB_RETRY_AFTER = 5  # 任务队列已满时建议客户端的重试间隔（秒）
+LLM_OVERLOAD_RETRY_AFTER = 10  # 等待 LLM 并发名额超时（服务过载）时建议客户端的重试间隔（秒）
+
+
 # ===================================
 # 错误消息常量
 # ===================================
@@ -1,8 +1,9 @@
+from contextlib import asynccontextmanager
 from enum import Enum
 from typing import Optional, Union
 
 from fastapi import FastAPI, Path, Query, Body, Cookie, Header, HTTPException, status, Depends
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 
 import os
 
@@ -13,6 +14,12 @@ from api.user import router as user_router
 from api.chat import router as chat_router
 from api.tasks import router as task_router
 from core.mysql import get_db
+from agent.llm import close_llm_clients, get_llm_cache, get_pool_stats
+from agent.output_store import get_output_store
+from agent.plan_cache import get_plan_cache
+from agent.metrics import render_metrics
+from agent.tracing import shutdown_tracing
+from services.AgentService import job_manager
 
 # fastapi.Path/Query/Body支持url内参数的验证
 # 其中Body可以将查询参数移到请求报文内，并且实现验证
@@ -26,7 +33,18 @@ from core.mysql import get_db
 
 # 或者使用自定义的异常处理函数，使用@app.exception_handler进行自定义异常处理
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 启动后台Agent任务队列
+    await job_manager.start()
+    yield
+    await job_manager.stop()
+    # 应用退出时释放共享的LLM连接池
+    await close_llm_clients()
+    # 关闭追踪导出器（刷新并关闭追踪文件）
+    shutdown_tracing()
+
+app = FastAPI(lifespan=lifespan)
 
 app.include_router(user_router, prefix='/api')
 app.include_router(chat_router, prefix='/api')
@@ -62,4 +80,37 @@ async def health(db_session: Session = Depends(get_db)):
             detail=f"Database connection failed: {str(e)}"
         )
 
+@app.get("/llm/pool")
+async def llm_pool():
+    """LLM 客户端连接池状态，用于评估连接池大小配置"""
+    return get_pool_stats()
+
+@app.get("/jobs/stats")
+async def jobs_stats():
+    """后台Agent任务队列状态"""
+    return job_manager.stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus 格式的 LLM / 工具调用计数与耗时分布"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/llm/cache")
+async def llm_cache():
+    """LLM 响应缓存的命中统计"""
+    cache = get_llm_cache()
+    return cache.stats() if cache else {"enabled": False}
+
+@app.get("/plans/cache")
+async def plan_cache():
+    """计划缓存的条目数与命中率"""
+    cache = get_plan_cache()
+    return cache.stats() if cache else {"enabled": False}
+
+@app.get("/outputs/store")
+async def output_store():
+    """外置步骤输出的写入与读取统计"""
+    store = get_output_store()
+    return store.stats() if store else {"enabled": False}
+
 # responses={400:{'model':ERROR_MESSAGE}, 401:...}
\ No newline at end of file
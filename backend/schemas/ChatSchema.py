@@ -18,3 +18,21 @@ class ChatMessage(BaseModel):
 
     class Config:
         from_attributes = True
+
+class ChatJobResponse(BaseModel):
+    job_id: str
+    task_id: int
+    run_id: str
+    status: str
+    queue_position: Optional[int] = None
+
+class ChatJobStatus(BaseModel):
+    job_id: str
+    task_id: int
+    run_id: str
+    status: str
+    final_answer: Optional[str] = None
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
@@ -0,0 +1,382 @@
+"""
+Agent 运行相关的业务逻辑
+"""
+import asyncio
+import json
+import logging
+import time
+import uuid
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional, Set
+
+from agent.checkpoint import get_checkpoint_store
+from agent.concurrency import ANONYMOUS, LLMQueueTimeout, bind_llm_user
+from agent.manager import AsyncAgentManager
+from agent.output_store import get_output_store
+from agent.schema import AgentEvent
+from agent.tracing import span
+from core.config import settings
+from core.constants import (
+    AGENT_FALLBACK_ANSWER,
+    AGENT_JOB_MAX_EVENTS,
+    DEFAULT_AGENT_MAX_STEPS,
+    LLM_OVERLOAD_RETRY_AFTER,
+    SSE_HEARTBEAT_INTERVAL
+)
+from core.mysql import SessionLocal
+from models.ChatModel import Chat
+
+logger = logging.getLogger(__name__)
+
+
+def format_sse(event: AgentEvent) -> str:
+    """将事件编码为 Server-Sent Events 格式"""
+    return f"event: {event.type}\ndata: {json.dumps(event.data, ensure_ascii=False)}\n\n"
+
+
+def save_chat_message(task_id: int, role: str, content: str, run_id: Optional[str] = None):
+    """
+    在独立会话中保存一条聊天记录（请求级会话可能已关闭）
+    :param run_id: 产生该消息的运行ID，传入时写库耗时记录到该运行的追踪链路中
+    """
+    with span("db.save_chat_message", trace_id=run_id, task_id=task_id, role=role):
+        db = SessionLocal()
+        try:
+            db.add(Chat(task_id=task_id, role=role, content=content))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+
+# 本进程中正在执行的运行ID，避免同一运行被重复恢复
+_active_runs: Set[str] = set()
+
+
+def is_run_active(run_id: str) -> bool:
+    return run_id in _active_runs
+
+
+def discard_checkpoint(run_id: Optional[str]):
+    """最终答案写库后删除运行的检查点及其引用的外置输出，之后该运行不再可恢复；需要读写文件，异步调用方应放到线程中执行"""
+    store = get_checkpoint_store()
+    if store is None or not run_id:
+        return
+    refs = store.output_refs(run_id)
+    store.delete(run_id)
+    output_store = get_output_store()
+    if output_store is not None and refs:
+        # 仍被其他运行的检查点引用的 blob 保留，由过期清理处理
+        output_store.delete(refs - store.shared_refs(refs))
+
+
+def _overloaded_event() -> AgentEvent:
+    """等待 LLM 并发名额超时（服务过载）时的 error 事件，带有建议的重试间隔，客户端可据此退避后重试"""
+    return AgentEvent(type="error", data={
+        "detail": "The agent is overloaded, please retry later",
+        "retry_after": LLM_OVERLOAD_RETRY_AFTER,
+    })
+
+
+async def stream_agent_run(
+    agent: AsyncAgentManager,
+    message: str,
+    task_id: int,
+    context: str = "",
+    resume_run_id: Optional[str] = None,
+    user_id: Optional[int] = None
+) -> AsyncIterator[str]:
+    """
+    运行 Agent 并以 SSE 格式逐条产出运行事件
+    - context 为同一任务之前的对话记忆，提供给 Planner 与 Executor
+    - 传入 resume_run_id 时从该运行的检查点继续，而不是开始新的运行
+    - user_id 用于 LLM 并发名额的公平排队
+    - 首先立即产出 task 事件（含运行ID，连接中断后可据此恢复），之后依次产出 plan / step_* / replan / answer_delta 事件，最后产出 done 或 error
+    - 长时间没有事件时发送心跳注释，避免代理超时断开
+    - 客户端断开时取消 Agent 运行
+    """
+    queue: "asyncio.Queue[AgentEvent | None]" = asyncio.Queue()
+
+    async def on_event(event: AgentEvent):
+        await queue.put(event)
+
+    run_id = resume_run_id or uuid.uuid4().hex
+
+    async def runner():
+        # runner 在独立的任务中运行，用户绑定只作用于本次运行的 LLM 请求
+        with bind_llm_user(user_id if user_id is not None else ANONYMOUS):
+            _active_runs.add(run_id)
+            try:
+                if resume_run_id:
+                    agent_state = await agent.resume(run_id, on_event=on_event)
+                else:
+                    agent_state = await agent.run(
+                        message, on_event=on_event, context=context, run_id=run_id, metadata={"task_id": task_id}
+                    )
+                final_answer = agent_state.current_plan.final_answer or AGENT_FALLBACK_ANSWER
+                # 同步写库放到线程中执行，不阻塞事件循环
+                await asyncio.to_thread(save_chat_message, task_id, "assistant", final_answer, agent_state.run_id)
+                await asyncio.to_thread(discard_checkpoint, run_id)
+                await queue.put(AgentEvent(
+                    type="done",
+                    data={
+                        "task_id": task_id,
+                        "run_id": agent_state.run_id,
+                        "final_answer": final_answer,
+                        "metrics": agent_state.metrics.model_dump()
+                    }
+                ))
+            except LLMQueueTimeout as e:
+                logger.warning(f"Agent run {run_id} rejected, LLM capacity exhausted: {e}")
+                await queue.put(_overloaded_event())
+            except Exception as e:
+                logger.error(f"Agent execution error: {e}", exc_info=True)
+                await queue.put(AgentEvent(type="error", data={"detail": f"Agent execution failed: {str(e)}"}))
+            finally:
+                _active_runs.discard(run_id)
+                await queue.put(None)
+
+    run_task = asyncio.create_task(runner())
+    yield format_sse(AgentEvent(type="task", data={"task_id": task_id, "run_id": run_id}))
+
+    try:
+        async for chunk in _sse_from_queue(queue):
+            yield chunk
+    finally:
+        if not run_task.done():
+            run_task.cancel()
+
+
+async def _sse_from_queue(queue: "asyncio.Queue[AgentEvent | None]") -> AsyncIterator[str]:
+    """从队列读取事件并编码为 SSE，收到 None 时结束；空闲时发送心跳"""
+    while True:
+        try:
+            event = await asyncio.wait_for(queue.get(), timeout=SSE_HEARTBEAT_INTERVAL)
+        except asyncio.TimeoutError:
+            yield ": ping\n\n"
+            continue
+        if event is None:
+            break
+        yield format_sse(event)
+
+
+class JobQueueFull(Exception):
+    """任务队列已满"""
+
+
+class AgentJob:
+    """
+    一次后台 Agent 运行
+    status: queued -> running -> succeeded / failed
+    """
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+    TERMINAL_EVENTS = ("done", "error")
+
+    def __init__(self, user_id: int, task_id: int, message: str, context: str = ""):
+        self.id = uuid.uuid4().hex
+        # Agent 运行ID，提交时即确定，进程重启后可据此从检查点恢复
+        self.run_id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.task_id = task_id
+        self.message = message
+        # 提交时加载的同一任务之前的对话记忆
+        self.context = context
+        self.status = self.QUEUED
+        self.final_answer: Optional[str] = None
+        self.error: Optional[str] = None
+        self.created_at = datetime.now()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+
+        # 已产生的事件（供晚到的订阅者回放）与当前订阅者
+        self.events: List[AgentEvent] = []
+        self.subscribers: Set["asyncio.Queue[AgentEvent | None]"] = set()
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in (self.SUCCEEDED, self.FAILED)
+
+    async def publish(self, event: AgentEvent):
+        self._store(event)
+        for queue in list(self.subscribers):
+            queue.put_nowait(event)
+
+    def _store(self, event: AgentEvent):
+        """
+        保存事件供回放
+        - 连续的 answer_delta 合并为一个事件，长答案不会占满事件上限
+        - 结束事件（done / error）不受 AGENT_JOB_MAX_EVENTS 限制，晚到的订阅者总能收到运行结果
+        """
+        last = self.events[-1] if self.events else None
+        if event.type == "answer_delta" and last is not None and last.type == "answer_delta":
+            # 已推送给订阅者的事件对象不能修改，这里替换为新的合并事件
+            merged = {**last.data, "content": (last.data.get("content") or "") + (event.data.get("content") or "")}
+            self.events[-1] = AgentEvent(type="answer_delta", data=merged)
+        elif event.type in self.TERMINAL_EVENTS or len(self.events) < AGENT_JOB_MAX_EVENTS:
+            self.events.append(event)
+
+    def close_subscribers(self):
+        for queue in list(self.subscribers):
+            queue.put_nowait(None)
+
+
+class AgentJobManager:
+    """
+    后台 Agent 任务队列
+    - 提交后立即返回任务ID，由固定数量的 worker 协程依次执行，限制同时运行的 Agent 数量
+    - 排队任务超过上限时拒绝提交，由接口返回 429
+    - 任务完成后将最终答案写入 chat 表
+    """
+    def __init__(self, workers: int, max_queue: int, result_ttl: int):
+        self.workers = max(1, workers)
+        self.max_queue = max(1, max_queue)
+        self.result_ttl = result_ttl
+
+        self._queue: Optional["asyncio.Queue[AgentJob]"] = None
+        self._workers: List[asyncio.Task] = []
+        self._jobs: Dict[str, AgentJob] = {}
+        self._running = 0
+
+    async def start(self):
+        if self._workers:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        logger.info(f"Agent任务队列已启动: workers={self.workers}, max_queue={self.max_queue}")
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def is_full(self) -> bool:
+        return self._queue is None or self._queue.full()
+
+    def submit(self, user_id: int, task_id: int, message: str, context: str = "") -> AgentJob:
+        """
+        提交任务
+        :raises JobQueueFull: 队列已满或任务队列未启动
+        """
+        if self.is_full():
+            raise JobQueueFull()
+        self._cleanup()
+
+        job = AgentJob(user_id=user_id, task_id=task_id, message=message, context=context)
+        self._queue.put_nowait(job)
+        self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[AgentJob]:
+        return self._jobs.get(job_id)
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "workers": self.workers,
+            "running": self._running,
+            "queued": self.queue_depth(),
+            "max_queue": self.max_queue,
+            "tracked_jobs": len(self._jobs),
+        }
+
+    async def subscribe(self, job: AgentJob) -> AsyncIterator[str]:
+        """以 SSE 格式订阅任务事件：先回放已有事件，再推送新事件直到任务结束"""
+        queue: "asyncio.Queue[AgentEvent | None]" = asyncio.Queue()
+        for event in job.events:
+            queue.put_nowait(event)
+        if job.is_finished:
+            queue.put_nowait(None)
+        else:
+            job.subscribers.add(queue)
+
+        try:
+            async for chunk in _sse_from_queue(queue):
+                yield chunk
+        finally:
+            job.subscribers.discard(queue)
+
+    async def _worker(self, index: int):
+        while True:
+            job = await self._queue.get()
+            self._running += 1
+            try:
+                await self._run(job)
+            except Exception as e:
+                logger.error(f"Agent任务 {job.id} 执行异常: {e}", exc_info=True)
+            finally:
+                self._running -= 1
+                self._queue.task_done()
+
+    async def _run(self, job: AgentJob):
+        job.status = AgentJob.RUNNING
+        job.started_at = datetime.now()
+        await job.publish(AgentEvent(
+            type="job_started", data={"job_id": job.id, "task_id": job.task_id, "run_id": job.run_id}
+        ))
+
+        agent = AsyncAgentManager(max_steps=DEFAULT_AGENT_MAX_STEPS)
+        _active_runs.add(job.run_id)
+        try:
+            with bind_llm_user(job.user_id):
+                agent_state = await agent.run(
+                    job.message,
+                    on_event=job.publish,
+                    context=job.context,
+                    run_id=job.run_id,
+                    metadata={"task_id": job.task_id}
+                )
+            job.final_answer = agent_state.current_plan.final_answer or AGENT_FALLBACK_ANSWER
+            await asyncio.to_thread(save_chat_message, job.task_id, "assistant", job.final_answer, agent_state.run_id)
+            await asyncio.to_thread(discard_checkpoint, job.run_id)
+            job.status = AgentJob.SUCCEEDED
+            await job.publish(AgentEvent(
+                type="done",
+                data={
+                    "task_id": job.task_id,
+                    "run_id": agent_state.run_id,
+                    "final_answer": job.final_answer,
+                    "metrics": agent_state.metrics.model_dump()
+                }
+            ))
+        except LLMQueueTimeout as e:
+            logger.warning(f"Agent任务 {job.id} 等待 LLM 并发名额超时: {e}")
+            event = _overloaded_event()
+            job.error = event.data["detail"]
+            job.status = AgentJob.FAILED
+            await job.publish(event)
+        except Exception as e:
+            logger.error(f"Agent execution error: {e}", exc_info=True)
+            job.error = f"Agent execution failed: {str(e)}"
+            job.status = AgentJob.FAILED
+            await job.publish(AgentEvent(type="error", data={"detail": job.error}))
+        finally:
+            _active_runs.discard(job.run_id)
+            job.finished_at = datetime.now()
+            job.close_subscribers()
+
+    def _cleanup(self):
+        """清理超过保留时间的已结束任务"""
+        deadline = time.time() - self.result_ttl
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.is_finished and job.finished_at and job.finished_at.timestamp() < deadline
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+# 进程内共享的任务队列，在应用启动时启动
+job_manager = AgentJobManager(
+    workers=settings.agent_job_workers,
+    max_queue=settings.agent_job_queue_size,
+    result_ttl=settings.agent_job_result_ttl
+)
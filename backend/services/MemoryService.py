@@ -0,0 +1,69 @@
+"""
+任务对话记忆的加载与进程内缓存
+每个任务的 ConversationMemory 缓存在进程内，后续提问只按 (task_id, id > last_id) 查询新增的消息，
+一次走 idx_task_id 索引的查询即可把记忆更新到最新。
+"""
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict
+
+from sqlalchemy.orm import Session
+
+from agent.memory import ConversationMemory
+from core.config import settings
+from models.ChatModel import Chat
+
+logger = logging.getLogger(__name__)
+
+
+class TaskMemoryStore:
+    """按任务缓存对话记忆，超过容量时淘汰最久未使用的任务"""
+    def __init__(self, max_tasks: int):
+        self.max_tasks = max(1, max_tasks)
+        self._memories: "OrderedDict[int, ConversationMemory]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, task_id: int) -> ConversationMemory:
+        with self._lock:
+            memory = self._memories.get(task_id)
+            if memory is None:
+                memory = self._memories[task_id] = ConversationMemory()
+                while len(self._memories) > self.max_tasks:
+                    self._memories.popitem(last=False)
+            else:
+                self._memories.move_to_end(task_id)
+            return memory
+
+    def load(self, db: Session, task_id: int) -> str:
+        """
+        加载任务之前的对话并渲染为 Prompt 上下文
+        应在保存本次用户消息之前调用，本次消息会在下一次加载时并入记忆
+        :return: 渲染后的对话记忆，没有之前的对话时为空字符串
+        """
+        if not settings.memory_enabled:
+            return ""
+        memory = self._get(task_id)
+        # 只取上次加载之后的新消息；首次加载时最多取最近 memory_load_limit 条
+        rows = (
+            db.query(Chat.id, Chat.role, Chat.content)
+            .filter(Chat.task_id == task_id, Chat.id > memory.last_id)
+            .order_by(Chat.id.desc())
+            .limit(settings.memory_load_limit)
+            .all()
+        )
+        memory.extend(reversed(rows))
+        context = memory.render()
+        logger.debug(f"任务 {task_id} 新增 {len(rows)} 条消息，对话记忆 {len(context)} 字")
+        return context
+
+    def forget(self, task_id: int):
+        with self._lock:
+            self._memories.pop(task_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"tasks": len(self._memories), "max_tasks": self.max_tasks}
+
+
+memory_store = TaskMemoryStore(max_tasks=settings.memory_cache_tasks)
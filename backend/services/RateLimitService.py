@@ -0,0 +1,89 @@
+"""
+按用户限制聊天提交频率
+每个用户一个令牌桶：容量为 chat_burst，每分钟补充 chat_rate_per_minute 个令牌，每次提交消耗一个令牌。
+令牌不足时拒绝提交，接口返回 429 并在 Retry-After 中给出下一个令牌到达的时间。
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+from fastapi import Depends, HTTPException, status
+
+from agent.metrics import registry
+from core.config import settings
+from models.UserModel import User
+from services.UserService import get_current_user
+
+CHAT_ADMISSIONS = registry.counter(
+    "planflow_chat_admissions_total", "聊天提交的准入结果", ("result",)
+)
+
+
+class TokenBucketLimiter:
+    """线程安全的按键令牌桶，超过容量时淘汰最久未使用的键"""
+    def __init__(self, rate_per_minute: float, burst: int, max_keys: int = 10000):
+        """
+        :param rate_per_minute: 每分钟补充的令牌数
+        :param burst: 令牌桶容量
+        :param max_keys: 最多保留的键数
+        """
+        self.rate = max(rate_per_minute, 0.0) / 60.0
+        self.burst = max(1, burst)
+        self.max_keys = max(1, max_keys)
+        # 键 -> (剩余令牌数, 上次更新时间)
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str) -> float:
+        """
+        尝试消耗一个令牌
+        :return: 0 表示通过；否则为需要等待的秒数
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (float(self.burst), now))
+            tokens = min(float(self.burst), tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / self.rate if self.rate > 0 else float("inf")
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            keys = len(self._buckets)
+        return {"users": keys, "rate_per_minute": self.rate * 60, "burst": self.burst}
+
+
+chat_limiter = TokenBucketLimiter(
+    rate_per_minute=settings.chat_rate_per_minute,
+    burst=settings.chat_burst,
+    max_keys=settings.rate_limit_max_users
+)
+
+
+async def limit_chat_submission(current_user: User = Depends(get_current_user)) -> User:
+    """
+    聊天提交接口的依赖：消耗当前用户的一个令牌，令牌不足时返回 429
+    :return: 当前用户，接口可直接用它代替 get_current_user
+    """
+    if not settings.rate_limit_enabled:
+        return current_user
+    wait = chat_limiter.acquire(str(current_user.id))
+    if wait > 0:
+        CHAT_ADMISSIONS.inc(result="rejected")
+        retry_after = max(1, math.ceil(wait)) if math.isfinite(wait) else 60
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"Too many chat requests, please retry in {retry_after}s",
+            headers={"Retry-After": str(retry_after)}
+        )
+    CHAT_ADMISSIONS.inc(result="accepted")
+    return current_user
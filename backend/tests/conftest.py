@@ -0,0 +1,14 @@
+"""
+测试公共配置
+Settings 中的数据库与密钥配置必须来自环境变量，这里为测试提供占位值（不会真正连接数据库）
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("MYSQL_HOST", "localhost")
+os.environ.setdefault("MYSQL_USER", "test")
+os.environ.setdefault("MYSQL_PASSWORD", "test")
+os.environ.setdefault("MYSQL_DATABASE", "test")
+os.environ.setdefault("SECURITY_KEY", "test-secret-key-for-unit-tests-only-0000")
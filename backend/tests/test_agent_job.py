@@ -0,0 +1,38 @@
+import asyncio
+
+from agent.schema import AgentEvent
+from core.constants import AGENT_JOB_MAX_EVENTS
+from services.AgentService import AgentJob
+
+
+def _publish_all(job: AgentJob, events):
+    async def publish():
+        for event in events:
+            await job.publish(event)
+    asyncio.run(publish())
+
+
+def test_terminal_event_is_kept_after_event_cap():
+    job = AgentJob(user_id=1, task_id=1, message="q")
+    steps = [AgentEvent(type="step_finished", data={"step_id": i}) for i in range(AGENT_JOB_MAX_EVENTS + 10)]
+    _publish_all(job, steps + [AgentEvent(type="done", data={"final_answer": "答案"})])
+
+    assert len(job.events) == AGENT_JOB_MAX_EVENTS + 1
+    assert job.events[-1].type == "done"
+    assert job.events[-1].data["final_answer"] == "答案"
+
+
+def test_answer_deltas_are_coalesced_in_replay_history():
+    job = AgentJob(user_id=1, task_id=1, message="q")
+    subscriber: "asyncio.Queue[AgentEvent | None]" = asyncio.Queue()
+    job.subscribers.add(subscriber)
+
+    deltas = [AgentEvent(type="answer_delta", data={"content": "字"}) for _ in range(AGENT_JOB_MAX_EVENTS * 2)]
+    _publish_all(job, [AgentEvent(type="plan", data={})] + deltas + [AgentEvent(type="error", data={"detail": "x"})])
+
+    assert [event.type for event in job.events] == ["plan", "answer_delta", "error"]
+    assert job.events[1].data["content"] == "字" * AGENT_JOB_MAX_EVENTS * 2
+    # 实时订阅者仍逐个收到原始的 answer_delta 事件
+    assert subscriber.qsize() == len(deltas) + 2
+    assert subscriber.get_nowait().type == "plan"
+    assert subscriber.get_nowait().data["content"] == "字"
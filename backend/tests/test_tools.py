@@ -0,0 +1,17 @@
+from agent.tools import normalize_query
+
+
+def test_sentence_punctuation_is_ignored():
+    assert normalize_query("AI 芯片？") == normalize_query("AI 芯片") == "ai 芯片"
+    assert normalize_query("ＡＩ芯片。") == normalize_query("ai芯片") == "ai芯片"
+    assert normalize_query("Python, 教程!") == normalize_query("python 教程") == "python 教程"
+    assert normalize_query("芯片，哪家强？") == "芯片 哪家强"
+
+
+def test_symbols_inside_tokens_are_kept():
+    assert normalize_query("C# 教程") == "c# 教程"
+    assert normalize_query("C++ 教程？") == "c++ 教程"
+    assert normalize_query("C 教程") == "c 教程"
+    assert len({normalize_query(q) for q in ("C# 教程", "C++ 教程", "C 教程")}) == 3
+    assert normalize_query("node.js 入门.") == "node.js 入门"
+    assert normalize_query("Python 3.12") == "python 3.12"